@@ -0,0 +1,405 @@
+"""
+Background deletion of all of a user's data: documents and their stored files, chat
+sessions and history, public shares and their views, and collections.
+
+POST /documents/delete-all only records an AccountDeletionJob; AccountDeleter runs it
+off-request, one kind of data after another in foreign key order (share views, shares,
+chat history, chat sessions, documents, collections). Every batch is one set-based
+DELETE ... WHERE id IN (SELECT ... LIMIT n) of at most ACCOUNT_DELETION_BATCH_SIZE rows
+(ACCOUNT_DELETION_DOCUMENT_BATCH_SIZE for documents), committed together with the job's
+progress, so locks stay short and the progress is exact. Before a batch of documents is
+deleted its files are removed from storage, ACCOUNT_DELETION_STORAGE_CHUNK keys per call
+with up to ACCOUNT_DELETION_STORAGE_CONCURRENCY calls in flight.
+
+Resuming: what is left to delete is whatever still exists, so a job that is restarted
+simply continues; removing a file twice is harmless. The worker running a job holds a
+lease (runner_id, renewed by every batch). Jobs are picked up again on startup, and by
+the status endpoint once their lease is older than ACCOUNT_DELETION_LEASE_SECONDS. A
+failing batch restarts the job from the first step (to clear rows created meanwhile)
+up to ACCOUNT_DELETION_RETRIES times before the job is marked failed.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import unquote
+
+from sqlalchemy import and_, bindparam, delete, func, or_, select, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal, supabase
+from models import (
+    AccountDeletionJob, ChatHistory, ChatSession, Collection, CollectionRollup, Document, PublicChatShare,
+    PublicChatView
+)
+from collection_rollups import rollup_cache
+from conversation_state import conversation_cache
+from public_shares import share_render_cache
+from user_stats import load_user_stats, user_stats_cache
+
+logger = logging.getLogger(__name__)
+
+STORAGE_BUCKET = "documents-uploaded-digestifile"
+
+ACCOUNT_DELETION_BATCH_SIZE = int(os.getenv("ACCOUNT_DELETION_BATCH_SIZE", "1000"))
+ACCOUNT_DELETION_DOCUMENT_BATCH_SIZE = int(os.getenv("ACCOUNT_DELETION_DOCUMENT_BATCH_SIZE", "200"))
+ACCOUNT_DELETION_STORAGE_CHUNK = int(os.getenv("ACCOUNT_DELETION_STORAGE_CHUNK", "100"))
+ACCOUNT_DELETION_STORAGE_CONCURRENCY = int(os.getenv("ACCOUNT_DELETION_STORAGE_CONCURRENCY", "4"))
+ACCOUNT_DELETION_LEASE_SECONDS = float(os.getenv("ACCOUNT_DELETION_LEASE_SECONDS", "120"))
+ACCOUNT_DELETION_RETRIES = int(os.getenv("ACCOUNT_DELETION_RETRIES", "3"))
+
+ACTIVE_STATUSES = ("pending", "running")
+ACTIVE_JOB_PREDICATE = text("status IN ('pending', 'running')")  # uq_account_deletion_jobs_active_user
+
+
+def storage_key(file_url: Optional[str]) -> Optional[str]:
+    """Object key of an uploaded file, from its public or signed URL"""
+    marker = f"/{STORAGE_BUCKET}/"
+    if not file_url or marker not in file_url:
+        return None
+    return unquote(file_url.split(marker, 1)[1].split("?", 1)[0]) or None
+
+
+async def deletion_preview(db: AsyncSession, user_id) -> Dict[str, int]:
+    """Counts of everything deleting the user's data would remove (current, not cached)"""
+    stats = await load_user_stats(db, user_id)
+    return {
+        "documents_to_delete": stats.documents,
+        "chat_messages_to_delete": stats.chat_messages,
+        "public_views_to_delete": stats.public_views,
+        "public_shares_to_delete": stats.public_shares,
+        "collections_to_delete": stats.collections,
+        "storage_files_to_delete": stats.storage_files,
+    }
+
+
+async def latest_deletion_job(db: AsyncSession, user_id) -> Optional[AccountDeletionJob]:
+    return await db.scalar(
+        select(AccountDeletionJob)
+        .where(AccountDeletionJob.user_id == user_id)
+        .order_by(AccountDeletionJob.created_at.desc())
+        .limit(1)
+    )
+
+
+class _LeaseLost(Exception):
+    """Another worker has taken the job over"""
+
+
+@dataclass
+class _RunningJob:
+    id: uuid.UUID
+    user_id: uuid.UUID
+    progress: Dict[str, int] = field(default_factory=dict)
+
+
+async def _remove_files(keys: List[str]) -> Tuple[int, int, Optional[str]]:
+    """Remove files from storage in concurrent chunks; returns (removed, errors, last error)"""
+    if not keys:
+        return 0, 0, None
+    if supabase is None:
+        return 0, len(keys), "Storage is not configured"
+
+    bucket = supabase.storage.from_(STORAGE_BUCKET)
+    semaphore = asyncio.Semaphore(ACCOUNT_DELETION_STORAGE_CONCURRENCY)
+
+    async def remove(chunk: List[str]) -> Tuple[int, int, Optional[str]]:
+        async with semaphore:
+            try:
+                # The storage client is synchronous
+                response = await asyncio.to_thread(bucket.remove, chunk)
+            except Exception as e:
+                return 0, len(chunk), str(e)
+        if not isinstance(response, list):
+            return len(chunk), 0, None
+        failed = [
+            item["error"] for item in response
+            if isinstance(item, dict) and item.get("error")
+        ]
+        # Keys that do not exist (already removed) are simply not listed
+        return len(response) - len(failed), len(failed), failed[-1] if failed else None
+
+    results = await asyncio.gather(*(
+        remove(keys[start:start + ACCOUNT_DELETION_STORAGE_CHUNK])
+        for start in range(0, len(keys), ACCOUNT_DELETION_STORAGE_CHUNK)
+    ))
+    last_error = next((error for _, _, error in reversed(results) if error), None)
+    return sum(r[0] for r in results), sum(r[1] for r in results), last_error
+
+
+class AccountDeleter:
+    """Runs account deletion jobs in the background, in bounded and resumable batches"""
+
+    def __init__(self):
+        # Identifies this worker's leases
+        self.runner_id = uuid.uuid4()
+        self._tasks: Dict[uuid.UUID, asyncio.Task] = {}
+
+    async def start(self, db: AsyncSession, user_id) -> AccountDeletionJob:
+        """Create a deletion job for the user, or return the one already under way"""
+        await db.execute(
+            pg_insert(AccountDeletionJob)
+            .values(
+                id=uuid.uuid4(),
+                user_id=user_id,
+                status="pending",
+                totals=await deletion_preview(db, user_id),
+                progress={},
+                attempts=0,
+            )
+            .on_conflict_do_nothing(index_elements=["user_id"], index_where=ACTIVE_JOB_PREDICATE)
+        )
+        await db.commit()
+        job = await latest_deletion_job(db, user_id)
+        self.schedule(job.id)
+        return job
+
+    def schedule(self, job_id: uuid.UUID):
+        """Run the job here unless this worker already is; a live lease elsewhere wins"""
+        task = self._tasks.get(job_id)
+        if task is not None and not task.done():
+            return
+        self._tasks[job_id] = asyncio.get_running_loop().create_task(self._run(job_id))
+
+    async def resume(self):
+        """Pick up the jobs that were pending or interrupted"""
+        try:
+            async with AsyncSessionLocal() as db:
+                job_ids = (await db.scalars(
+                    select(AccountDeletionJob.id).where(AccountDeletionJob.status.in_(ACTIVE_STATUSES))
+                )).all()
+        except Exception as e:
+            logger.error(f"❌ Could not look up unfinished account deletions: {e}")
+            return
+        for job_id in job_ids:
+            self.schedule(job_id)
+        if job_ids:
+            logger.info(f"🗑️ Resuming {len(job_ids)} account deletion(s)")
+
+    async def _claim(self, job_id: uuid.UUID) -> Optional[_RunningJob]:
+        async with AsyncSessionLocal() as db:
+            stale = func.now() - timedelta(seconds=ACCOUNT_DELETION_LEASE_SECONDS)
+            row = (await db.execute(
+                update(AccountDeletionJob)
+                .where(
+                    AccountDeletionJob.id == job_id,
+                    or_(
+                        AccountDeletionJob.status == "pending",
+                        and_(
+                            AccountDeletionJob.status == "running",
+                            or_(AccountDeletionJob.heartbeat_at.is_(None), AccountDeletionJob.heartbeat_at < stale),
+                        ),
+                    ),
+                )
+                .values(
+                    status="running",
+                    runner_id=self.runner_id,
+                    heartbeat_at=func.now(),
+                    attempts=AccountDeletionJob.attempts + 1,
+                )
+                .returning(AccountDeletionJob.user_id, AccountDeletionJob.progress)
+            )).first()
+            await db.commit()
+        if row is None:
+            return None
+        return _RunningJob(id=job_id, user_id=row.user_id, progress=dict(row.progress or {}))
+
+    async def _run(self, job_id: uuid.UUID):
+        job = await self._claim(job_id)
+        if job is None:
+            return  # Finished, or running elsewhere under a live lease
+
+        logger.info(f"🗑️ Deleting all data of user {job.user_id} (job {job_id})")
+        for attempt in range(1, ACCOUNT_DELETION_RETRIES + 1):
+            try:
+                await self._delete_all(job)
+            except _LeaseLost:
+                logger.warning(f"⚠️ Account deletion {job_id} was taken over by another worker")
+                return
+            except Exception as e:
+                logger.error(f"❌ Account deletion {job_id} failed (attempt {attempt}): {e}")
+                if attempt == ACCOUNT_DELETION_RETRIES:
+                    await self._finish(job, "failed", str(e))
+                    return
+                await asyncio.sleep(2 ** attempt)
+            else:
+                await self._finish(job, "completed")
+                logger.info(f"✅ Deleted all data of user {job.user_id}: {job.progress}")
+                return
+            finally:
+                conversation_cache.invalidate(job.user_id)
+                share_render_cache.invalidate(user_id=job.user_id)
+                user_stats_cache.invalidate(job.user_id)
+
+    async def _delete_all(self, job: _RunningJob):
+        steps = (
+            ("public_views", self._delete_public_views),
+            ("public_shares", self._delete_public_shares),
+            ("chat_history", self._delete_chat_history),
+            ("chat_sessions", self._delete_chat_sessions),
+            ("documents", self._delete_documents),
+            ("collections", self._delete_collections),
+        )
+        for step, delete_batch in steps:
+            while True:
+                async with AsyncSessionLocal() as db:
+                    counts = await delete_batch(db, job.user_id)
+                    await self._commit_batch(db, job, step, counts)
+                if not counts["rows"]:
+                    break
+
+    async def _commit_batch(self, db: AsyncSession, job: _RunningJob, step: str, counts: Dict[str, int]):
+        """Commit a batch with the job's progress, if this worker still holds the lease"""
+        progress = dict(job.progress)
+        for key, value in counts.items():
+            if key != "rows":
+                progress[key] = progress.get(key, 0) + value
+        renewed = await db.execute(
+            update(AccountDeletionJob)
+            .where(AccountDeletionJob.id == job.id, AccountDeletionJob.runner_id == self.runner_id)
+            .values(step=step, progress=progress, heartbeat_at=func.now())
+        )
+        if renewed.rowcount == 0:
+            await db.rollback()
+            raise _LeaseLost()
+        await db.commit()
+        job.progress = progress
+
+    async def _finish(self, job: _RunningJob, status: str, error: Optional[str] = None):
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(AccountDeletionJob)
+                .where(AccountDeletionJob.id == job.id, AccountDeletionJob.runner_id == self.runner_id)
+                .values(
+                    status=status,
+                    step=None,
+                    last_error=error,
+                    runner_id=None,
+                    completed_at=func.now() if status == "completed" else None,
+                )
+            )
+            await db.commit()
+
+    # Each step deletes one batch and returns what it deleted, by progress key; "rows" is
+    # the batch size and 0 means the step is done
+
+    @staticmethod
+    async def _delete_public_views(db: AsyncSession, user_id) -> Dict[str, int]:
+        batch = (
+            select(PublicChatView.id)
+            .join(PublicChatShare, PublicChatShare.id == PublicChatView.share_id)
+            .where(PublicChatShare.user_id == user_id)
+            .limit(ACCOUNT_DELETION_BATCH_SIZE)
+        )
+        deleted = (await db.execute(delete(PublicChatView).where(PublicChatView.id.in_(batch)))).rowcount
+        return {"rows": deleted, "public_views_deleted": deleted}
+
+    @staticmethod
+    async def _delete_public_shares(db: AsyncSession, user_id) -> Dict[str, int]:
+        # Locked, so views recorded since the previous step cannot be added meanwhile
+        share_ids = (await db.scalars(
+            select(PublicChatShare.id)
+            .where(PublicChatShare.user_id == user_id)
+            .limit(ACCOUNT_DELETION_BATCH_SIZE)
+            .with_for_update()
+        )).all()
+        if not share_ids:
+            return {"rows": 0}
+        views = (await db.execute(delete(PublicChatView).where(PublicChatView.share_id.in_(share_ids)))).rowcount
+        shares = (await db.execute(delete(PublicChatShare).where(PublicChatShare.id.in_(share_ids)))).rowcount
+        return {"rows": shares, "public_views_deleted": views, "public_shares_deleted": shares}
+
+    @staticmethod
+    async def _delete_chat_history(db: AsyncSession, user_id) -> Dict[str, int]:
+        batch = select(ChatHistory.id).where(ChatHistory.user_id == user_id).limit(ACCOUNT_DELETION_BATCH_SIZE)
+        deleted = (await db.execute(delete(ChatHistory).where(ChatHistory.id.in_(batch)))).rowcount
+        return {"rows": deleted, "chat_history_deleted": deleted}
+
+    @staticmethod
+    async def _delete_chat_sessions(db: AsyncSession, user_id) -> Dict[str, int]:
+        # Cascades to conversation summaries
+        batch = select(ChatSession.id).where(ChatSession.user_id == user_id).limit(ACCOUNT_DELETION_BATCH_SIZE)
+        deleted = (await db.execute(delete(ChatSession).where(ChatSession.id.in_(batch)))).rowcount
+        return {"rows": deleted, "chat_sessions_deleted": deleted}
+
+    @staticmethod
+    async def _delete_documents(db: AsyncSession, user_id) -> Dict[str, int]:
+        documents = (await db.execute(
+            select(Document.id, Document.file_url)
+            .where(Document.user_id == user_id)
+            .limit(ACCOUNT_DELETION_DOCUMENT_BATCH_SIZE)
+        )).all()
+        if not documents:
+            return {"rows": 0}
+        # No transaction stays open while storage is called
+        await db.rollback()
+
+        keys = [key for key in (storage_key(document.file_url) for document in documents) if key]
+        files_removed, errors, last_error = await _remove_files(keys)
+        if errors:
+            logger.warning(f"⚠️ {errors} file(s) could not be removed from storage: {last_error}")
+
+        # Cascades to document contents (and any chat sessions created meanwhile)
+        collection_ids = (await db.scalars(
+            delete(Document)
+            .where(Document.id.in_([document.id for document in documents]))
+            .returning(Document.collection_id)
+        )).all()
+        deleted = len(collection_ids)
+        removed = Counter(collection_id for collection_id in collection_ids if collection_id)
+        if removed:
+            collections = Collection.__table__
+            await db.execute(
+                update(collections)
+                .where(collections.c.id == bindparam("collection"))
+                .values(document_count=collections.c.document_count - bindparam("removed")),
+                [{"collection": collection_id, "removed": count} for collection_id, count in removed.items()],
+            )
+            # Rebuilt if read before the collections go too
+            await db.execute(
+                update(CollectionRollup)
+                .where(CollectionRollup.collection_id.in_(list(removed)))
+                .values(stale=True)
+            )
+            for collection_id in removed:
+                rollup_cache.invalidate(collection_id)
+        return {
+            "rows": deleted,
+            "documents_deleted": deleted,
+            "storage_files_deleted": files_removed,
+            "storage_errors": errors,
+        }
+
+    @staticmethod
+    async def _delete_collections(db: AsyncSession, user_id) -> Dict[str, int]:
+        batch = select(Collection.id).where(Collection.user_id == user_id).limit(ACCOUNT_DELETION_BATCH_SIZE)
+        deleted = (await db.execute(delete(Collection).where(Collection.id.in_(batch)))).rowcount
+        return {"rows": deleted, "collections_deleted": deleted}
+
+    async def shutdown(self):
+        """Stop running jobs and hand them back, so the next start resumes them at once"""
+        tasks = [task for task in self._tasks.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(AccountDeletionJob)
+                    .where(AccountDeletionJob.runner_id == self.runner_id, AccountDeletionJob.status == "running")
+                    .values(status="pending", runner_id=None)
+                )
+                await db.commit()
+        except Exception as e:
+            logger.error(f"❌ Could not release account deletion jobs: {e}")
+
+
+# Global account deleter instance
+account_deleter = AccountDeleter()
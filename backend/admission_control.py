@@ -0,0 +1,321 @@
+"""
+Admission control for LLM endpoints: per-user and per-plan token buckets, and
+weighted fair queuing of the model-call slots.
+
+Rate: every LLM request takes one token from the user's bucket and one from the
+bucket shared by everyone on the same plan (a global cap on the plan's total model
+traffic; a plan_per_minute of 0 turns it off). Buckets refill continuously at the
+per-minute rates in PLAN_RATE_LIMITS, which ADMISSION_PLAN_LIMITS_JSON overrides per
+plan. A request that finds either bucket empty is rejected straight away with the
+number of seconds until a token is available, which the route returns as 429 +
+Retry-After.
+
+Bucket state lives in a BucketStore. By default it is a SQLite file in the temp
+directory (ADMISSION_STORE_PATH to move it): every worker on the host opens the same
+file and takes tokens inside a BEGIN IMMEDIATE transaction, so the limits are
+host-wide however many workers run, without an extra service. ADMISSION_STORE_PATH=memory
+keeps the buckets in process memory instead, which multiplies the limits by the
+number of workers.
+
+Concurrency: at most LLM_MAX_CONCURRENT_REQUESTS admitted requests run model work at
+once in a worker. When all slots are busy, waiters are served in weighted fair
+queuing order: each waiter gets a virtual finish tag advanced by 1 / plan weight from
+the later of the queue's virtual time and the user's previous tag. A PRO user gets
+four slots for every FREE one under contention, and no single user can crowd out
+others on the same plan. A user may have only LLM_MAX_QUEUED_PER_USER requests
+waiting, and a waiter that is not served within LLM_QUEUE_TIMEOUT_SECONDS is turned
+away with an estimated Retry-After.
+"""
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from models import UserPlan
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_STORE_PATH = os.getenv("ADMISSION_STORE_PATH", os.path.join(tempfile.gettempdir(), "digestgpt_admission.sqlite"))
+LLM_MAX_CONCURRENT_REQUESTS = int(os.getenv("LLM_MAX_CONCURRENT_REQUESTS", "16"))
+LLM_MAX_QUEUED_PER_USER = int(os.getenv("LLM_MAX_QUEUED_PER_USER", "2"))
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "30"))
+
+# Per-minute refill rates and burst sizes. "weight" is the plan's share of the
+# model-call slots under contention.
+PLAN_RATE_LIMITS = {
+    UserPlan.FREE: {
+        "user_per_minute": 6,
+        "user_burst": 3,
+        "plan_per_minute": 120,
+        "plan_burst": 20,
+        "weight": 1
+    },
+    UserPlan.STANDARD: {
+        "user_per_minute": 20,
+        "user_burst": 8,
+        "plan_per_minute": 300,
+        "plan_burst": 50,
+        "weight": 2
+    },
+    UserPlan.PRO: {
+        "user_per_minute": 40,
+        "user_burst": 15,
+        "plan_per_minute": 600,
+        "plan_burst": 100,
+        "weight": 4
+    }
+}
+# Override per plan, e.g. ADMISSION_PLAN_LIMITS_JSON='{"free": {"plan_per_minute": 600, "plan_burst": 100}}'
+for _plan, _limits in json.loads(os.getenv("ADMISSION_PLAN_LIMITS_JSON", "{}")).items():
+    PLAN_RATE_LIMITS[UserPlan(_plan)].update(_limits)
+
+
+class AdmissionRejected(Exception):
+    """Request is over its share; retry_after is in whole seconds"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, retry_after)
+
+
+@dataclass(frozen=True)
+class Bucket:
+    key: str
+    capacity: float
+    rate_per_second: float
+
+
+def refill(tokens: float, updated_at: float, bucket: Bucket, now: float) -> float:
+    return min(bucket.capacity, tokens + max(0.0, now - updated_at) * bucket.rate_per_second)
+
+
+def wait_for_token(tokens: float, bucket: Bucket, cost: float) -> float:
+    """Seconds until the bucket holds `cost` tokens"""
+    if tokens >= cost:
+        return 0.0
+    if bucket.rate_per_second <= 0:
+        return math.inf
+    return (cost - tokens) / bucket.rate_per_second
+
+
+class MemoryBucketStore:
+    """Bucket state for a single worker"""
+
+    def __init__(self):
+        self._state: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def take(self, buckets: List[Bucket], cost: float = 1.0) -> float:
+        """Take `cost` from every bucket or from none; returns 0 or the seconds to wait"""
+        now = time.time()
+        with self._lock:
+            levels = []
+            for bucket in buckets:
+                tokens, updated_at = self._state.get(bucket.key, (bucket.capacity, now))
+                levels.append(refill(tokens, updated_at, bucket, now))
+
+            wait = max(wait_for_token(tokens, bucket, cost) for tokens, bucket in zip(levels, buckets))
+            if wait > 0:
+                return wait
+            for tokens, bucket in zip(levels, buckets):
+                self._state[bucket.key] = (tokens - cost, now)
+            return 0.0
+
+    def clear(self):
+        with self._lock:
+            self._state.clear()
+
+
+class SQLiteBucketStore:
+    """Bucket state in a SQLite file shared by every worker on the host"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS token_buckets ("
+                "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA busy_timeout=5000")
+            self._local.connection = connection
+        return connection
+
+    def take(self, buckets: List[Bucket], cost: float = 1.0) -> float:
+        connection = self._connect()
+        now = time.time()
+        # IMMEDIATE takes the write lock up front, so read-modify-write is atomic across processes
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            levels = []
+            for bucket in buckets:
+                row = connection.execute(
+                    "SELECT tokens, updated_at FROM token_buckets WHERE key = ?", (bucket.key,)
+                ).fetchone()
+                tokens, updated_at = row if row else (bucket.capacity, now)
+                levels.append(refill(tokens, updated_at, bucket, now))
+
+            wait = max(wait_for_token(tokens, bucket, cost) for tokens, bucket in zip(levels, buckets))
+            if wait <= 0:
+                connection.executemany(
+                    "INSERT INTO token_buckets (key, tokens, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at",
+                    [(bucket.key, tokens - cost, now) for tokens, bucket in zip(levels, buckets)],
+                )
+            connection.execute("COMMIT")
+            return max(wait, 0.0)
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def clear(self):
+        self._connect().execute("DELETE FROM token_buckets")
+
+
+class WeightedFairQueue:
+    """Bounded pool of model-call slots handed out in weighted fair order"""
+
+    def __init__(
+        self,
+        slots: int = LLM_MAX_CONCURRENT_REQUESTS,
+        max_queued_per_user: int = LLM_MAX_QUEUED_PER_USER,
+        timeout: float = LLM_QUEUE_TIMEOUT_SECONDS,
+    ):
+        self.slots = slots
+        self.max_queued_per_user = max_queued_per_user
+        self.timeout = timeout
+        self.in_use = 0
+        self.virtual_time = 0.0
+        self._last_finish: Dict[str, float] = {}
+        self._waiters: list = []  # heap of (finish, seq, start, future, user_key)
+        self._queued: Dict[str, int] = {}
+        self._sequence = itertools.count()
+        # Smoothed slot hold time, for Retry-After estimates
+        self._hold_seconds = 5.0
+
+    @property
+    def waiting(self) -> int:
+        return sum(self._queued.values())
+
+    def estimated_wait(self) -> int:
+        return math.ceil(self._hold_seconds * (self.waiting + 1) / max(1, self.slots))
+
+    async def acquire(self, user_key: str, weight: float):
+        """Wait for a slot; raises AdmissionRejected if the user's queue is full or the wait times out"""
+        if self.in_use < self.slots and not self._queued:
+            self.in_use += 1
+            return
+
+        if self._queued.get(user_key, 0) >= self.max_queued_per_user:
+            raise AdmissionRejected("Too many queued requests", self.estimated_wait())
+
+        start = max(self.virtual_time, self._last_finish.get(user_key, 0.0))
+        finish = start + 1.0 / weight
+        self._last_finish[user_key] = finish
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (finish, next(self._sequence), start, future, user_key))
+        self._queued[user_key] = self._queued.get(user_key, 0) + 1
+
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                # Granted in the same tick the timer fired; keep the slot
+                return
+            future.cancel()
+            raise AdmissionRejected("Timed out waiting for capacity", self.estimated_wait())
+        except BaseException:
+            if future.done() and not future.cancelled():
+                self.release()
+            else:
+                future.cancel()
+            raise
+        finally:
+            self._dequeued(user_key)
+
+    def _dequeued(self, user_key: str):
+        remaining = self._queued.get(user_key, 0) - 1
+        if remaining > 0:
+            self._queued[user_key] = remaining
+        else:
+            self._queued.pop(user_key, None)
+
+    def release(self, held_seconds: Optional[float] = None):
+        if held_seconds is not None:
+            self._hold_seconds = 0.8 * self._hold_seconds + 0.2 * held_seconds
+
+        while self._waiters:
+            _, _, start, future, _ = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            # The slot passes straight to the next waiter
+            self.virtual_time = max(self.virtual_time, start)
+            future.set_result(None)
+            return
+
+        self.in_use = max(0, self.in_use - 1)
+        if not self._waiters:
+            # Idle: forget finish tags so old usage is not held against anyone
+            self._last_finish.clear()
+
+
+class AdmissionController:
+    def __init__(self, store_path: Optional[str] = ADMISSION_STORE_PATH):
+        use_sqlite = store_path and store_path != "memory"
+        self.store = SQLiteBucketStore(store_path) if use_sqlite else MemoryBucketStore()
+        self._queues: Dict[asyncio.AbstractEventLoop, WeightedFairQueue] = {}
+
+    def _queue(self) -> WeightedFairQueue:
+        loop = asyncio.get_running_loop()
+        queue = self._queues.get(loop)
+        if queue is None:
+            # One queue per event loop (tests and reloads create new loops)
+            self._queues = {existing: q for existing, q in self._queues.items() if not existing.is_closed()}
+            queue = self._queues[loop] = WeightedFairQueue()
+        return queue
+
+    @staticmethod
+    def buckets(user_id, plan: UserPlan) -> List[Bucket]:
+        limits = PLAN_RATE_LIMITS[plan]
+        buckets = [Bucket(f"user:{user_id}", limits["user_burst"], limits["user_per_minute"] / 60.0)]
+        if limits["plan_per_minute"] > 0:
+            buckets.append(Bucket(f"plan:{plan.value}", limits["plan_burst"], limits["plan_per_minute"] / 60.0))
+        return buckets
+
+    async def check_rate(self, user_id, plan: UserPlan):
+        """Take one request from the user and plan buckets or raise AdmissionRejected"""
+        buckets = self.buckets(user_id, plan)
+        if isinstance(self.store, SQLiteBucketStore):
+            wait = await asyncio.to_thread(self.store.take, buckets)
+        else:
+            wait = self.store.take(buckets)
+        if wait > 0:
+            raise AdmissionRejected("Rate limit exceeded", math.ceil(wait))
+
+    async def admit(self, user_id, plan: UserPlan):
+        """Rate-check the request and wait for a fair-share slot; returns the release callback"""
+        await self.check_rate(user_id, plan)
+        queue = self._queue()
+        await queue.acquire(str(user_id), PLAN_RATE_LIMITS[plan]["weight"])
+        acquired_at = time.monotonic()
+        return lambda: queue.release(time.monotonic() - acquired_at)
+
+
+# Global admission controller instance
+admission_controller = AdmissionController()
@@ -0,0 +1,30 @@
+"""add content_hash to documents
+
+Revision ID: 3f1c9a7d2b64
+Revises: d2c3dbfa5463
+Create Date: 2026-10-19 09:12:40.512733
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1c9a7d2b64'
+down_revision: Union[str, Sequence[str], None] = 'd2c3dbfa5463'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('documents', sa.Column('content_hash', sa.String(length=64), nullable=True))
+    op.create_index('ix_documents_user_id_content_hash', 'documents', ['user_id', 'content_hash'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_documents_user_id_content_hash', table_name='documents')
+    op.drop_column('documents', 'content_hash')
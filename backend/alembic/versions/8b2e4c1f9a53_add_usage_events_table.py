@@ -0,0 +1,41 @@
+"""add usage_events table
+
+Revision ID: 8b2e4c1f9a53
+Revises: 3f1c9a7d2b64
+Create Date: 2026-10-19 10:02:17.348115
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b2e4c1f9a53'
+down_revision: Union[str, Sequence[str], None] = '3f1c9a7d2b64'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('usage_events',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('user_id', sa.UUID(), nullable=False),
+    sa.Column('document_id', sa.UUID(), nullable=True),
+    sa.Column('operation', sa.String(), nullable=False),
+    sa.Column('docs', sa.Integer(), nullable=False),
+    sa.Column('chats', sa.Integer(), nullable=False),
+    sa.Column('tokens', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_usage_events_user_id_created_at', 'usage_events', ['user_id', 'created_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_usage_events_user_id_created_at', table_name='usage_events')
+    op.drop_table('usage_events')
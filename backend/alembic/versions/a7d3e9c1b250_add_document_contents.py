@@ -0,0 +1,42 @@
+"""add document contents
+
+Revision ID: a7d3e9c1b250
+Revises: f2a7c5d8e104
+Create Date: 2026-10-19 15:22:49.104376
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7d3e9c1b250'
+down_revision: Union[str, Sequence[str], None] = 'f2a7c5d8e104'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('document_contents',
+    sa.Column('document_id', sa.UUID(), nullable=False),
+    sa.Column('codec', sa.String(length=8), nullable=False),
+    sa.Column('text_data', sa.LargeBinary(), nullable=True),
+    sa.Column('analysis_data', sa.LargeBinary(), nullable=True),
+    sa.Column('text_length', sa.Integer(), nullable=True),
+    sa.Column('stored_bytes', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.ForeignKeyConstraint(['document_id'], ['documents.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('document_id')
+    )
+    # Payloads are already compressed; store them out of line without a second pglz pass
+    op.execute("ALTER TABLE document_contents ALTER COLUMN text_data SET STORAGE EXTERNAL")
+    op.execute("ALTER TABLE document_contents ALTER COLUMN analysis_data SET STORAGE EXTERNAL")
+    # Existing rows are moved by backfill_document_contents.py, in batches, while the app runs
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('document_contents')
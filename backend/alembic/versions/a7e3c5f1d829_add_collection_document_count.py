@@ -0,0 +1,44 @@
+"""add collection document count
+
+Revision ID: a7e3c5f1d829
+Revises: f4d2b7c9e158
+Create Date: 2026-10-19 21:02:47.915264
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7e3c5f1d829'
+down_revision: Union[str, Sequence[str], None] = 'f4d2b7c9e158'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('collections', sa.Column('document_count', sa.Integer(), server_default='0', nullable=False))
+    op.create_index('ix_collections_user_id_created_at', 'collections', ['user_id', 'created_at'], unique=False)
+    op.create_index('ix_documents_collection_id_uploaded_at', 'documents', ['collection_id', 'uploaded_at'], unique=False)
+
+    op.execute("""
+        UPDATE collections
+        SET document_count = counted.documents
+        FROM (
+            SELECT collection_id, count(*) AS documents
+            FROM documents
+            WHERE collection_id IS NOT NULL
+            GROUP BY collection_id
+        ) AS counted
+        WHERE collections.id = counted.collection_id
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_documents_collection_id_uploaded_at', table_name='documents')
+    op.drop_index('ix_collections_user_id_created_at', table_name='collections')
+    op.drop_column('collections', 'document_count')
@@ -0,0 +1,39 @@
+"""add collection rollups
+
+Revision ID: b3f8d2a6c471
+Revises: a7e3c5f1d829
+Create Date: 2026-10-19 21:48:19.604731
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3f8d2a6c471'
+down_revision: Union[str, Sequence[str], None] = 'a7e3c5f1d829'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Rows are created on first read of a collection's rollup; no backfill needed
+    op.create_table('collection_rollups',
+    sa.Column('collection_id', sa.UUID(), nullable=False),
+    sa.Column('document_count', sa.Integer(), nullable=False),
+    sa.Column('tallies', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+    sa.Column('summary', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+    sa.Column('stale', sa.Boolean(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.ForeignKeyConstraint(['collection_id'], ['collections.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('collection_id')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('collection_rollups')
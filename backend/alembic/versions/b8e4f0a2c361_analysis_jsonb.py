@@ -0,0 +1,172 @@
+"""analysis jsonb
+
+Revision ID: b8e4f0a2c361
+Revises: a7d3e9c1b250
+Create Date: 2026-10-19 16:48:12.730215
+
+"""
+import gzip
+import json
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b8e4f0a2c361'
+down_revision: Union[str, Sequence[str], None] = 'a7d3e9c1b250'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 500
+
+SWOT_KEYS = ("strengths", "weaknesses", "opportunities", "threats")
+
+
+# Frozen copy of document_store.shape_analysis as of this revision, so later changes to
+# the application code do not change what this migration writes
+def _generated_impact(key_points, risk_flags):
+    insights_impact = []
+    risks_impact = []
+
+    for point in key_points[:3]:
+        point_text = point.get("text", "") if isinstance(point, dict) else point if isinstance(point, str) else ""
+        if point_text:
+            insights_impact.append({
+                "insight_point": point_text[:100] + "..." if len(point_text) > 100 else point_text,
+                "impact_description": "This insight could have significant implications for business operations and decision-making processes",
+                "impacted_organization": "Business Operations Team",
+                "affected_areas": ["Operations", "Strategy", "Decision Making"],
+                "impact_level": "medium",
+                "timeline": "medium-term",
+                "action_required": "Review and incorporate this insight into relevant business processes and strategic planning"
+            })
+
+    for risk in risk_flags[:3]:
+        risk_text = risk.get("text", "") if isinstance(risk, dict) else risk if isinstance(risk, str) else ""
+        if risk_text:
+            clean_risk_text = risk_text.replace("🚩", "").strip()
+            risks_impact.append({
+                "risk_point": clean_risk_text[:100] + "..." if len(clean_risk_text) > 100 else clean_risk_text,
+                "impact_description": "If this risk materializes, it could negatively affect operations and require immediate attention",
+                "impacted_organization": "Operations and Management Team",
+                "affected_areas": ["Operations", "Risk Management", "Compliance"],
+                "impact_level": "medium",
+                "timeline": "short-term",
+                "action_required": "Implement risk mitigation strategies and monitor for potential issues"
+            })
+
+    return {"insights_impact": insights_impact, "risks_impact": risks_impact}
+
+
+def _shape_analysis(values):
+    def of_type(key, default):
+        value = values.get(key)
+        return value if isinstance(value, type(default)) else default
+
+    key_points = of_type("key_points", [])
+    risk_flags = of_type("risk_flags", [])
+    swot = of_type("swot_analysis", {})
+    impact = of_type("impact_analysis", {})
+    impact_analysis = {
+        "insights_impact": impact.get("insights_impact", []),
+        "risks_impact": impact.get("risks_impact", [])
+    }
+    if not impact_analysis["insights_impact"] and not impact_analysis["risks_impact"]:
+        impact_analysis = _generated_impact(key_points, risk_flags)
+
+    return {
+        "problem_context": values.get("problem_context") if isinstance(values.get("problem_context"), str) else None,
+        "key_points": key_points,
+        "risk_flags": risk_flags,
+        "key_concepts": of_type("key_concepts", []),
+        "swot_analysis": {key: swot.get(key, []) for key in SWOT_KEYS},
+        "recommendations": of_type("recommendations", {}),
+        "impact_analysis": impact_analysis,
+    }
+
+
+def _decompress(data, codec):
+    if not data:
+        return b"{}"
+    if codec == "zstd":
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('document_contents', sa.Column('analysis', postgresql.JSONB(astext_type=sa.Text()), nullable=True))
+
+    # Re-encode the compressed analysis written by the previous revision as shaped JSONB
+    bind = op.get_bind()
+    contents = sa.table(
+        'document_contents',
+        sa.column('document_id', sa.UUID()),
+        sa.column('codec', sa.String()),
+        sa.column('analysis_data', sa.LargeBinary()),
+        sa.column('analysis', postgresql.JSONB()),
+    )
+    last_id = None
+    while True:
+        query = (
+            sa.select(contents.c.document_id, contents.c.codec, contents.c.analysis_data)
+            .where(contents.c.analysis.is_(None))
+            .order_by(contents.c.document_id)
+            .limit(BATCH_SIZE)
+        )
+        if last_id is not None:
+            query = query.where(contents.c.document_id > last_id)
+        rows = bind.execute(query).all()
+        if not rows:
+            break
+        for row in rows:
+            fields = json.loads(_decompress(row.analysis_data, row.codec))
+            fields["impact_analysis"] = fields.pop("impact", None)
+            bind.execute(
+                contents.update()
+                .where(contents.c.document_id == row.document_id)
+                .values(analysis=_shape_analysis(fields))
+            )
+        last_id = rows[-1].document_id
+
+    op.drop_column('document_contents', 'analysis_data')
+    op.create_index('ix_document_contents_analysis', 'document_contents', ['analysis'], unique=False, postgresql_using='gin', postgresql_ops={'analysis': 'jsonb_path_ops'})
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_document_contents_analysis', table_name='document_contents', postgresql_using='gin', postgresql_ops={'analysis': 'jsonb_path_ops'})
+    op.add_column('document_contents', sa.Column('analysis_data', postgresql.BYTEA(), autoincrement=False, nullable=True))
+
+    bind = op.get_bind()
+    contents = sa.table(
+        'document_contents',
+        sa.column('document_id', sa.UUID()),
+        sa.column('codec', sa.String()),
+        sa.column('analysis_data', sa.LargeBinary()),
+        sa.column('analysis', postgresql.JSONB()),
+    )
+    rows = bind.execute(
+        sa.select(contents.c.document_id, contents.c.codec, contents.c.analysis)
+        .where(contents.c.analysis.isnot(None))
+    ).all()
+    for row in rows:
+        fields = dict(row.analysis)
+        fields["impact"] = fields.pop("impact_analysis", None)
+        data = json.dumps(fields).encode("utf-8")
+        if row.codec == "zstd":
+            import zstandard
+            data = zstandard.ZstdCompressor().compress(data)
+        else:
+            data = gzip.compress(data)
+        bind.execute(
+            contents.update()
+            .where(contents.c.document_id == row.document_id)
+            .values(analysis_data=data)
+        )
+
+    op.drop_column('document_contents', 'analysis')
@@ -0,0 +1,30 @@
+"""add chat history indexes
+
+Revision ID: c2f9a4e6d713
+Revises: b8e4f0a2c361
+Create Date: 2026-10-19 17:31:54.662087
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c2f9a4e6d713'
+down_revision: Union[str, Sequence[str], None] = 'b8e4f0a2c361'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_chat_history_document_id_user_id_timestamp', 'chat_history', ['document_id', 'user_id', 'timestamp'], unique=False)
+    op.create_index('ix_chat_history_user_id_document_id_timestamp', 'chat_history', ['user_id', 'document_id', 'timestamp'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_chat_history_user_id_document_id_timestamp', table_name='chat_history')
+    op.drop_index('ix_chat_history_document_id_user_id_timestamp', table_name='chat_history')
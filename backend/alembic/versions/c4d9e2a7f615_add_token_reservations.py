@@ -0,0 +1,40 @@
+"""add token reservations
+
+Revision ID: c4d9e2a7f615
+Revises: 8b2e4c1f9a53
+Create Date: 2026-10-19 11:24:53.907231
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4d9e2a7f615'
+down_revision: Union[str, Sequence[str], None] = '8b2e4c1f9a53'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('usage', sa.Column('tokens_reserved', sa.Integer(), server_default='0', nullable=False))
+    op.create_table('usage_reservations',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('user_id', sa.UUID(), nullable=False),
+    sa.Column('tokens', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.Column('expires_at', sa.DateTime(timezone=True), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_usage_reservations_user_id_expires_at', 'usage_reservations', ['user_id', 'expires_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_usage_reservations_user_id_expires_at', table_name='usage_reservations')
+    op.drop_table('usage_reservations')
+    op.drop_column('usage', 'tokens_reserved')
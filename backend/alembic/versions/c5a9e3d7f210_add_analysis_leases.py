@@ -0,0 +1,33 @@
+"""add analysis leases
+
+Revision ID: c5a9e3d7f210
+Revises: b3f8d2a6c471
+Create Date: 2026-10-19 23:12:40.381905
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5a9e3d7f210'
+down_revision: Union[str, Sequence[str], None] = 'b3f8d2a6c471'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('analysis_leases',
+    sa.Column('lease_id', sa.BigInteger(), nullable=False),
+    sa.Column('owner', sa.UUID(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('lease_id')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('analysis_leases')
@@ -0,0 +1,102 @@
+"""tag generated impact placeholders
+
+Revision ID: d2b6f8a4c937
+Revises: c5a9e3d7f210
+Create Date: 2026-10-19 23:41:06.527318
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd2b6f8a4c937'
+down_revision: Union[str, Sequence[str], None] = 'c5a9e3d7f210'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 500
+
+# impact_description of the placeholders written by shape_analysis before they were tagged
+PLACEHOLDER_DESCRIPTIONS = {
+    "insights_impact": "This insight could have significant implications for business operations and decision-making processes",
+    "risks_impact": "If this risk materializes, it could negatively affect operations and require immediate attention",
+}
+
+
+def _retag(analysis, generated):
+    """Analysis with placeholder impact entries tagged (or untagged); None if nothing changed"""
+    impact = analysis.get("impact_analysis") if isinstance(analysis, dict) else None
+    if not isinstance(impact, dict):
+        return None
+    changed = False
+    retagged = dict(impact)
+    for section, description in PLACEHOLDER_DESCRIPTIONS.items():
+        entries = impact.get(section)
+        if not isinstance(entries, list):
+            continue
+        updated = []
+        for entry in entries:
+            if isinstance(entry, dict) and entry.get("impact_description") == description:
+                if generated and not entry.get("generated"):
+                    entry = {**entry, "generated": True}
+                    changed = True
+                elif not generated and "generated" in entry:
+                    entry = {key: value for key, value in entry.items() if key != "generated"}
+                    changed = True
+            updated.append(entry)
+        retagged[section] = updated
+    return {**analysis, "impact_analysis": retagged} if changed else None
+
+
+def _retag_all(generated):
+    bind = op.get_bind()
+    contents = sa.table(
+        'document_contents',
+        sa.column('document_id', sa.UUID()),
+        sa.column('analysis', postgresql.JSONB()),
+    )
+    placeholder = sa.or_(*(
+        contents.c.analysis.op("@?")(sa.literal_column(
+            f"""'$.impact_analysis.{section}[*] ? (@.impact_description == "{description}")'::jsonpath"""
+        ))
+        for section, description in PLACEHOLDER_DESCRIPTIONS.items()
+    ))
+    last_id = None
+    while True:
+        query = (
+            sa.select(contents.c.document_id, contents.c.analysis)
+            .where(placeholder)
+            .order_by(contents.c.document_id)
+            .limit(BATCH_SIZE)
+        )
+        if last_id is not None:
+            query = query.where(contents.c.document_id > last_id)
+        rows = bind.execute(query).all()
+        if not rows:
+            break
+        for row in rows:
+            analysis = _retag(row.analysis, generated)
+            if analysis is not None:
+                bind.execute(
+                    contents.update()
+                    .where(contents.c.document_id == row.document_id)
+                    .values(analysis=analysis)
+                )
+        last_id = rows[-1].document_id
+
+    # Rollup risk levels counted the placeholders; rebuilt on their next read
+    op.execute("UPDATE collection_rollups SET stale = true")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    _retag_all(generated=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    _retag_all(generated=False)
@@ -0,0 +1,39 @@
+"""add conversation summaries
+
+Revision ID: d5b1e8f3a427
+Revises: c2f9a4e6d713
+Create Date: 2026-10-19 18:12:07.318540
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5b1e8f3a427'
+down_revision: Union[str, Sequence[str], None] = 'c2f9a4e6d713'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('conversation_summaries',
+    sa.Column('user_id', sa.UUID(), nullable=False),
+    sa.Column('document_id', sa.UUID(), nullable=False),
+    sa.Column('summary', sa.Text(), nullable=False),
+    sa.Column('summarized_through', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('summarized_through_id', sa.UUID(), nullable=False),
+    sa.Column('turns_summarized', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.ForeignKeyConstraint(['document_id'], ['documents.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'document_id')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('conversation_summaries')
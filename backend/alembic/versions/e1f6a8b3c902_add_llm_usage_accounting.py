@@ -0,0 +1,48 @@
+"""add llm usage accounting
+
+Revision ID: e1f6a8b3c902
+Revises: c4d9e2a7f615
+Create Date: 2026-10-19 12:41:08.216540
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e1f6a8b3c902'
+down_revision: Union[str, Sequence[str], None] = 'c4d9e2a7f615'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('usage_events', sa.Column('input_tokens', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('usage_events', sa.Column('output_tokens', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('usage_events', sa.Column('cost_usd', sa.Float(), server_default='0', nullable=False))
+    op.create_table('usage_cost_daily',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('user_id', sa.UUID(), nullable=False),
+    sa.Column('operation', sa.String(), nullable=False),
+    sa.Column('provider', sa.String(), nullable=False),
+    sa.Column('model', sa.String(), nullable=False),
+    sa.Column('calls', sa.Integer(), nullable=False),
+    sa.Column('input_tokens', sa.BigInteger(), nullable=False),
+    sa.Column('output_tokens', sa.BigInteger(), nullable=False),
+    sa.Column('cost_usd', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('day', 'user_id', 'operation', 'provider', 'model')
+    )
+    op.create_index('ix_usage_cost_daily_day_operation', 'usage_cost_daily', ['day', 'operation'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_usage_cost_daily_day_operation', table_name='usage_cost_daily')
+    op.drop_table('usage_cost_daily')
+    op.drop_column('usage_events', 'cost_usd')
+    op.drop_column('usage_events', 'output_tokens')
+    op.drop_column('usage_events', 'input_tokens')
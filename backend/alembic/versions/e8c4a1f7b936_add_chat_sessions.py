@@ -0,0 +1,99 @@
+"""add chat sessions
+
+Revision ID: e8c4a1f7b936
+Revises: d5b1e8f3a427
+Create Date: 2026-10-19 19:05:41.227913
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e8c4a1f7b936'
+down_revision: Union[str, Sequence[str], None] = 'd5b1e8f3a427'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('chat_sessions',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('user_id', sa.UUID(), nullable=False),
+    sa.Column('document_id', sa.UUID(), nullable=False),
+    sa.Column('title', sa.String(), nullable=True),
+    sa.Column('message_count', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.Column('last_message_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.ForeignKeyConstraint(['document_id'], ['documents.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_chat_sessions_user_id_document_id_last_message_at', 'chat_sessions', ['user_id', 'document_id', 'last_message_at'], unique=False)
+
+    # Existing document chats become one session per (user, document); the column was never set
+    op.execute("UPDATE chat_history SET chat_session_id = NULL WHERE chat_session_id IS NOT NULL")
+    op.execute("""
+        INSERT INTO chat_sessions (id, user_id, document_id, message_count, created_at, last_message_at)
+        SELECT gen_random_uuid(), user_id, document_id, count(*), min(timestamp), max(timestamp)
+        FROM chat_history
+        WHERE document_id IS NOT NULL
+        GROUP BY user_id, document_id
+    """)
+    op.execute("""
+        UPDATE chat_history
+        SET chat_session_id = chat_sessions.id
+        FROM chat_sessions
+        WHERE chat_history.user_id = chat_sessions.user_id
+          AND chat_history.document_id = chat_sessions.document_id
+    """)
+    # Existing shares showed the whole document conversation: point them at that session
+    op.execute("""
+        UPDATE public_chat_shares
+        SET chat_session_id = chat_sessions.id
+        FROM chat_sessions
+        WHERE public_chat_shares.user_id = chat_sessions.user_id
+          AND public_chat_shares.document_id = chat_sessions.document_id
+    """)
+
+    op.drop_index('ix_chat_history_chat_session_id', table_name='chat_history')
+    op.create_index('ix_chat_history_chat_session_id_timestamp_id', 'chat_history', ['chat_session_id', 'timestamp', 'id'], unique=False)
+    op.create_foreign_key('chat_history_chat_session_id_fkey', 'chat_history', 'chat_sessions', ['chat_session_id'], ['id'], ondelete='CASCADE')
+
+    # Summaries are per session now; they are rebuilt from the history on the next turn
+    op.drop_table('conversation_summaries')
+    op.create_table('conversation_summaries',
+    sa.Column('chat_session_id', sa.UUID(), nullable=False),
+    sa.Column('summary', sa.Text(), nullable=False),
+    sa.Column('summarized_through', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('summarized_through_id', sa.UUID(), nullable=False),
+    sa.Column('turns_summarized', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.ForeignKeyConstraint(['chat_session_id'], ['chat_sessions.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('chat_session_id')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('conversation_summaries')
+    op.create_table('conversation_summaries',
+    sa.Column('user_id', sa.UUID(), nullable=False),
+    sa.Column('document_id', sa.UUID(), nullable=False),
+    sa.Column('summary', sa.Text(), nullable=False),
+    sa.Column('summarized_through', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('summarized_through_id', sa.UUID(), nullable=False),
+    sa.Column('turns_summarized', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.ForeignKeyConstraint(['document_id'], ['documents.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'document_id')
+    )
+    op.drop_constraint('chat_history_chat_session_id_fkey', 'chat_history', type_='foreignkey')
+    op.drop_index('ix_chat_history_chat_session_id_timestamp_id', table_name='chat_history')
+    op.create_index('ix_chat_history_chat_session_id', 'chat_history', ['chat_session_id'], unique=False)
+    op.drop_index('ix_chat_sessions_user_id_document_id_last_message_at', table_name='chat_sessions')
+    op.drop_table('chat_sessions')
@@ -0,0 +1,28 @@
+"""add document listing index
+
+Revision ID: f2a7c5d8e104
+Revises: e1f6a8b3c902
+Create Date: 2026-10-19 14:05:37.582913
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2a7c5d8e104'
+down_revision: Union[str, Sequence[str], None] = 'e1f6a8b3c902'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_documents_user_id_uploaded_at_id', 'documents', ['user_id', 'uploaded_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_documents_user_id_uploaded_at_id', table_name='documents')
@@ -0,0 +1,51 @@
+"""add account deletion jobs
+
+Revision ID: f4d2b7c9e158
+Revises: e8c4a1f7b936
+Create Date: 2026-10-19 20:14:32.508316
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f4d2b7c9e158'
+down_revision: Union[str, Sequence[str], None] = 'e8c4a1f7b936'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('account_deletion_jobs',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('user_id', sa.UUID(), nullable=False),
+    sa.Column('status', sa.String(length=16), nullable=False),
+    sa.Column('step', sa.String(length=32), nullable=True),
+    sa.Column('totals', postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+    sa.Column('progress', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('runner_id', sa.UUID(), nullable=True),
+    sa.Column('heartbeat_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.Column('completed_at', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_account_deletion_jobs_user_id_created_at', 'account_deletion_jobs', ['user_id', 'created_at'], unique=False)
+    op.create_index('uq_account_deletion_jobs_active_user', 'account_deletion_jobs', ['user_id'], unique=True, postgresql_where=sa.text("status IN ('pending', 'running')"))
+    # Deleting a share's views, and share analytics, look views up by share
+    op.create_index(op.f('ix_public_chat_views_share_id'), 'public_chat_views', ['share_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_public_chat_views_share_id'), table_name='public_chat_views')
+    op.drop_index('uq_account_deletion_jobs_active_user', table_name='account_deletion_jobs', postgresql_where=sa.text("status IN ('pending', 'running')"))
+    op.drop_index('ix_account_deletion_jobs_user_id_created_at', table_name='account_deletion_jobs')
+    op.drop_table('account_deletion_jobs')
@@ -0,0 +1,147 @@
+"""
+Single-flight coalescing for document analysis.
+
+Concurrent identical analysis requests (double-clicked uploads, two tabs submitting the
+same text) share one in-flight computation:
+
+- Within a worker, requests with the same key await the same future.
+- Across workers, the first request claims a lease row (analysis_leases) for the key in
+  a short transaction and computes; the lease is dropped when it finishes. The others
+  poll every ANALYSIS_LOCK_POLL_SECONDS: they return the result once the leader has
+  stored it (via `lookup_existing`), or take over the lease when the leader gave up
+  without a result or its lease ran out (ANALYSIS_LOCK_TIMEOUT_SECONDS). Nobody holds
+  a database connection while computing or waiting.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import uuid
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from sqlalchemy import delete, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from database import async_engine
+from models import AnalysisLease
+
+logger = logging.getLogger(__name__)
+
+ADVISORY_LOCK_POLL_SECONDS = float(os.getenv("ANALYSIS_LOCK_POLL_SECONDS", "0.5"))
+ADVISORY_LOCK_TIMEOUT_SECONDS = float(os.getenv("ANALYSIS_LOCK_TIMEOUT_SECONDS", "300"))
+
+
+def content_hash(data) -> str:
+    """SHA-256 hex digest of text or bytes"""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def lease_id_for(key: str) -> int:
+    """Map a key onto a signed 64-bit id (the analysis_leases key)"""
+    return int.from_bytes(hashlib.sha256(key.encode("utf-8")).digest()[:8], "big", signed=True)
+
+
+class SingleFlight:
+    """In-process single-flight: one running computation per key"""
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._inflight
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        existing = self._inflight.get(key)
+        if existing is not None:
+            logger.info(f"🔁 Joining in-flight analysis {key[:24]}...")
+            return await asyncio.shield(existing)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark as retrieved so a leader-only failure does not log "never retrieved"
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+
+analysis_single_flight = SingleFlight()
+
+
+async def _claim_lease(lease_id: int, owner: uuid.UUID) -> bool:
+    """Take the key's lease unless someone else holds an unexpired one"""
+    stmt = pg_insert(AnalysisLease).values(
+        lease_id=lease_id,
+        owner=owner,
+        expires_at=func.now() + timedelta(seconds=ADVISORY_LOCK_TIMEOUT_SECONDS),
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[AnalysisLease.lease_id],
+        set_={"owner": stmt.excluded.owner, "expires_at": stmt.excluded.expires_at},
+        where=AnalysisLease.expires_at <= func.now(),
+    ).returning(AnalysisLease.owner)
+    async with async_engine.begin() as conn:
+        return (await conn.scalar(stmt)) == owner
+
+
+async def _release_lease(lease_id: int, owner: uuid.UUID):
+    async with async_engine.begin() as conn:
+        await conn.execute(
+            delete(AnalysisLease).where(AnalysisLease.lease_id == lease_id, AnalysisLease.owner == owner)
+        )
+
+
+async def _run_under_lease(
+    key: str,
+    compute: Callable[[], Awaitable[Any]],
+    lookup_existing: Callable[[], Awaitable[Optional[Any]]],
+) -> Any:
+    lease_id = lease_id_for(key)
+    owner = uuid.uuid4()
+    waited = False
+
+    while not await _claim_lease(lease_id, owner):
+        # Another worker is analyzing the same submission; wait for its result without a connection
+        waited = True
+        await asyncio.sleep(ADVISORY_LOCK_POLL_SECONDS)
+        existing = await lookup_existing()
+        if existing is not None:
+            logger.info(f"🔁 Reusing analysis stored by another worker for {key[:24]}...")
+            return existing
+
+    try:
+        if waited:
+            # The previous holder finished (or gave up) between our last lookup and the claim
+            existing = await lookup_existing()
+            if existing is not None:
+                return existing
+        return await compute()
+    finally:
+        try:
+            await _release_lease(lease_id, owner)
+        except Exception as e:
+            # It expires on its own
+            logger.warning(f"⚠️ Could not release analysis lease for {key[:24]}...: {e}")
+
+
+async def coalesce_analysis(
+    key: str,
+    compute: Callable[[], Awaitable[Any]],
+    lookup_existing: Callable[[], Awaitable[Optional[Any]]],
+) -> Any:
+    """
+    Run `compute` once per key across concurrent requests and workers.
+    `lookup_existing` returns a previously stored result for the key, or None.
+    """
+    return await analysis_single_flight.do(
+        key, lambda: _run_under_lease(key, compute, lookup_existing)
+    )
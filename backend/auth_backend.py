@@ -1,5 +1,9 @@
 import os
 import jwt
+import hashlib
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import Optional, Union
 from passlib.context import CryptContext
@@ -16,6 +20,51 @@ SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-this-in-product
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "60"))  # 1 hour
 REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30"))     # 30 days
+JWT_CLAIMS_CACHE_SIZE = int(os.getenv("JWT_CLAIMS_CACHE_SIZE", "10000"))          # 0 disables
+
+class ClaimsCache:
+    """
+    Verified JWT claims keyed by a SHA-256 digest of the token.
+
+    Only tokens that passed signature verification are stored, and an entry never
+    outlives the token's own exp claim, so a hit is as good as a fresh verification.
+    """
+
+    def __init__(self, maxsize: int = JWT_CLAIMS_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def digest(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, key: bytes) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            payload, expires_at = entry
+            if time.time() >= expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return payload
+
+    def put(self, key: bytes, payload: dict):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (payload, payload.get("exp", 0))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+claims_cache = ClaimsCache()
 
 def hash_password(password: str) -> str:
     """Hash a password using bcrypt"""
@@ -47,18 +96,29 @@ def create_refresh_token(data: dict) -> str:
 
 def verify_token(token: str, token_type: str = "access") -> Optional[dict]:
     """Verify a JWT token and return the payload"""
+    if not isinstance(token, str) or not token:
+        return None
+    
+    # Fast path: token already verified and not yet expired
+    key = claims_cache.digest(token)
+    payload = claims_cache.get(key)
+    if payload is not None:
+        return dict(payload) if payload.get("type") == token_type else None
+    
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         
-        # Check token type
-        if payload.get("type") != token_type:
-            return None
-            
         # Check expiration
         if datetime.utcnow() > datetime.fromtimestamp(payload.get("exp", 0)):
             return None
+        
+        claims_cache.put(key, payload)
+        
+        # Check token type
+        if payload.get("type") != token_type:
+            return None
             
-        return payload
+        return dict(payload)
     except jwt.PyJWTError:
         return None
 
@@ -1,6 +1,6 @@
 # auth_helpers.py
 from fastapi import Response, Request, HTTPException, status, Depends
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 import os
 from typing import Optional
 from collections import defaultdict
@@ -8,8 +8,10 @@ from datetime import datetime, timedelta
 
 # Import your existing auth functions
 from auth_backend import verify_token, create_access_token, create_refresh_token
-from dependencies import get_access_token_from_cookie, get_refresh_token_from_cookie, get_db
+from dependencies import get_access_token_from_cookie, get_refresh_token_from_cookie
+from database import get_async_db
 from models import User
+from identity import request_claims, resolve_user
 
 # Cookie configuration
 ACCESS_TOKEN_COOKIE_NAME = "ACCESS_NWST"
@@ -142,7 +144,7 @@ def clear_all_auth_cookies(response: Response):
         )
 
 # Enhanced dependency that works with auto-refresh middleware
-async def get_current_user_with_auto_refresh(request: Request, db: Session = Depends(get_db)) -> User:
+async def get_current_user_with_auto_refresh(request: Request, db: AsyncSession = Depends(get_async_db)) -> User:
     """
     Enhanced dependency that works with auto-refresh middleware.
     Provides better error messages when auto-refresh fails.
@@ -166,7 +168,7 @@ async def get_current_user_with_auto_refresh(request: Request, db: Session = Dep
                 )
         
         # Verify access token
-        payload = verify_token(access_token, token_type="access")
+        payload = request_claims(request.scope, access_token, token_type="access")
         if not payload:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -180,8 +182,8 @@ async def get_current_user_with_auto_refresh(request: Request, db: Session = Dep
                 detail="Invalid token payload"
             )
         
-        # Get user from database
-        user = db.query(User).filter(User.id == user_id).first()
+        # Get user from database (once per request)
+        user = await resolve_user(request.scope, db, user_id)
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
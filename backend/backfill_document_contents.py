@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Move document text and analysis from the inline documents columns into the
+compressed document_contents table, in batches.
+
+Each batch locks up to --batch-size documents that have no document_contents row
+(FOR UPDATE SKIP LOCKED, so several copies can run side by side), writes their
+compressed payload, clears the inline columns and commits. The job is resumable:
+a document is done once its document_contents row exists, so an interrupted run
+simply continues where it stopped. The app reads both layouts meanwhile.
+
+Cleared columns leave dead space in documents until it is vacuumed; run
+VACUUM (ANALYZE) documents afterwards, or pg_repack / VACUUM FULL to return the
+space to the OS.
+
+Usage:
+    python backfill_document_contents.py --batch-size 200 --sleep 0.1
+    python backfill_document_contents.py --dry-run
+"""
+import argparse
+import os
+import sys
+import time
+
+# Add the backend directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import func, select, update
+
+from database import SessionLocal
+from document_store import ANALYSIS_FIELDS, legacy_payload_row
+from models import Document, DocumentContent
+
+PAYLOAD_COLUMNS = ("document_text",) + ANALYSIS_FIELDS
+
+
+def pending_documents():
+    return (
+        select(Document.id)
+        .outerjoin(DocumentContent, DocumentContent.document_id == Document.id)
+        .where(DocumentContent.document_id.is_(None))
+    )
+
+
+def backfill_batch(db, after, batch_size):
+    """Move one batch; returns (documents moved, inline bytes, stored bytes, last id)"""
+    query = (
+        select(Document.id, *(getattr(Document, column) for column in PAYLOAD_COLUMNS))
+        .outerjoin(DocumentContent, DocumentContent.document_id == Document.id)
+        .where(DocumentContent.document_id.is_(None))
+        .order_by(Document.id)
+        .limit(batch_size)
+        .with_for_update(of=Document, skip_locked=True)
+    )
+    if after is not None:
+        query = query.where(Document.id > after)
+    rows = db.execute(query).all()
+    if not rows:
+        db.rollback()
+        return 0, 0, 0, None
+
+    inline_total = stored_total = 0
+    for row in rows:
+        content, inline_bytes = legacy_payload_row(row)
+        db.add(content)
+        inline_total += inline_bytes
+        stored_total += content.stored_bytes
+
+    db.flush()
+    db.execute(
+        update(Document)
+        .where(Document.id.in_([row.id for row in rows]))
+        .values({column: None for column in PAYLOAD_COLUMNS})
+    )
+    db.commit()
+    return len(rows), inline_total, stored_total, rows[-1].id
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--sleep", type=float, default=0.1, help="pause between batches, in seconds")
+    parser.add_argument("--max-documents", type=int, default=None, help="stop after this many documents")
+    parser.add_argument("--dry-run", action="store_true", help="only count the documents left to move")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        remaining = db.scalar(select(func.count()).select_from(pending_documents().subquery()))
+        print(f"{remaining} document(s) to move")
+        if args.dry_run or not remaining:
+            return
+
+        moved = inline_bytes = stored_bytes = 0
+        last_id = None
+        started = time.monotonic()
+        while args.max_documents is None or moved < args.max_documents:
+            batch_size = args.batch_size
+            if args.max_documents is not None:
+                batch_size = min(batch_size, args.max_documents - moved)
+            count, inline, stored, batch_last_id = backfill_batch(db, last_id, batch_size)
+            if not count:
+                break
+            moved += count
+            last_id = batch_last_id
+            inline_bytes += inline
+            stored_bytes += stored
+            print(f"moved {moved}/{remaining} ({inline_bytes / 1e6:.1f} MB inline -> {stored_bytes / 1e6:.1f} MB stored)")
+            time.sleep(args.sleep)
+
+        elapsed = time.monotonic() - started
+        ratio = inline_bytes / stored_bytes if stored_bytes else 0
+        print(f"done: {moved} document(s) in {elapsed:.1f}s, {ratio:.1f}x smaller")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
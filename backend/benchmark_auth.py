@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Benchmark JWT verification and authenticated-endpoint throughput with and without
+the verified-claims cache.
+
+"verify_token" times the function alone: a full HMAC decode on every call (cache
+disabled) against a digest lookup (cache enabled). "endpoint" drives an authenticated
+route through the production middleware stack in-process, so the numbers include
+the auto-refresh middleware, the auth dependency and its users-table lookup.
+Per-request claim sharing is active in both endpoint runs; the difference is the
+process-wide cache.
+
+Needs the usual DB_* environment; a throwaway user is created and removed.
+
+Usage:
+    python benchmark_auth.py --requests 3000 --concurrency 20 --rounds 5
+"""
+import argparse
+import asyncio
+import contextlib
+import logging
+import os
+import statistics
+import sys
+import time
+import uuid
+
+# Add the backend directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import httpx
+from fastapi import Depends, FastAPI
+from fastapi.middleware.cors import CORSMiddleware
+
+from auth_backend import claims_cache, create_access_token, create_refresh_token, verify_token
+from database import SessionLocal
+from dependencies import get_current_active_user
+from identity import principal_cache
+from middleware.auth_middleware import AutoTokenRefreshMiddleware
+from middleware.request_logging import RequestLoggingMiddleware
+from middleware.timezone_middleware import TimezoneMiddleware
+from models import User, UserPlan
+
+
+def build_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/documents/me")
+    async def me(current_user: User = Depends(get_current_active_user)):
+        return {"id": str(current_user.id), "plan": current_user.plan.value}
+
+    app.add_middleware(CORSMiddleware, allow_origins=["http://localhost:3000"], allow_credentials=True)
+    app.add_middleware(TimezoneMiddleware)
+    app.add_middleware(AutoTokenRefreshMiddleware, excluded_paths=["/health", "/docs"])
+    app.add_middleware(RequestLoggingMiddleware)
+    return app
+
+
+def set_cache(enabled: bool, size: int):
+    claims_cache.clear()
+    claims_cache.maxsize = size if enabled else 0
+
+
+def bench_verify(token: str, iterations: int) -> float:
+    """Microseconds per verify_token call"""
+    started = time.perf_counter()
+    for _ in range(iterations):
+        verify_token(token)
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+async def bench_endpoint(app: FastAPI, cookies: dict, total: int, concurrency: int) -> float:
+    """Requests per second against the authenticated route"""
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", cookies=cookies) as client:
+        async def one():
+            async with semaphore:
+                response = await client.get("/documents/me")
+                response.raise_for_status()
+
+        # Warm up
+        await asyncio.gather(*(one() for _ in range(50)))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        return total / (time.perf_counter() - started)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=5, help="alternating rounds per mode; the median is reported")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    cache_size = claims_cache.maxsize
+
+    db = SessionLocal()
+    user = User(
+        email=f"bench-auth-{uuid.uuid4().hex[:8]}@example.com",
+        name="Auth Benchmark",
+        plan=UserPlan.PRO,
+        is_active=True,
+        timezone="Europe/London",
+        last_ip_address="127.0.0.1",
+    )
+    db.add(user)
+    db.commit()
+
+    try:
+        access_token = create_access_token(data={"sub": str(user.id)})
+        refresh_token = create_refresh_token(data={"sub": str(user.id)})
+        cookies = {"ACCESS_NWST": access_token, "REFRESH_NWST": refresh_token}
+        app = build_app()
+
+        modes = (("before (no claims cache)", False), ("after (claims cache)", True))
+        results = {label: ([], []) for label, _ in modes}
+        for round_index in range(args.rounds):
+            # Alternate the order so pool and cache warm-up do not favour one mode
+            for label, enabled in (modes if round_index % 2 == 0 else modes[::-1]):
+                set_cache(enabled, cache_size)
+                principal_cache.clear()
+                results[label][0].append(bench_verify(access_token, args.iterations))
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    results[label][1].append(await bench_endpoint(app, cookies, args.requests, args.concurrency))
+
+        print(f"{args.requests} requests, concurrency {args.concurrency}; {args.iterations} verify_token calls; "
+              f"median of {args.rounds} rounds")
+        print(f"{'mode':<28}{'verify us':>12}{'req/s':>10}")
+        for label, (per_call, rps) in results.items():
+            print(f"{label:<28}{statistics.median(per_call):>12.2f}{statistics.median(rps):>10.1f}")
+    finally:
+        db.delete(user)
+        db.commit()
+        db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
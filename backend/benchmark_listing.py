@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Benchmark document listing with whole-row loads against column projections.
+
+Creates a throwaway user with --documents documents, each carrying --text-kb of
+document_text and a comparably sized analysis (summary, key points, SWOT, ...), then
+times the listing queries used by GET /documents/ and GET /collections/{id}:
+
+  before: select(Document) - every column, including the text and analysis
+  after:  the explicit projections the routes now use
+
+Latency is the median per listing; memory is the tracemalloc peak while the rows
+are fetched and turned into response dicts.
+
+Needs the usual DB_* environment.
+
+Usage:
+    python benchmark_listing.py --documents 300 --text-kb 200 --rounds 5
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+import uuid
+
+# Add the backend directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import delete, func, insert, select
+
+from database import AsyncSessionLocal, SessionLocal
+from models import Collection, Document, User, UserPlan
+from routes.collections import SUMMARY_PREVIEW_LENGTH
+from routes.documents import DOCUMENT_LIST_COLUMNS
+
+
+def document_rows(user_id, collection_id, count, text_kb):
+    text = ("Quarterly revenue grew strongly across every region. " * 20)[:1024] * text_kb
+    analysis = text[: len(text) // 8]
+    return [
+        dict(
+            id=uuid.uuid4(),
+            user_id=user_id,
+            collection_id=collection_id,
+            filename=f"report-{i}.pdf",
+            filesize=len(text),
+            document_text=text,
+            summary=analysis[:2000],
+            problem_context=analysis,
+            key_points=analysis,
+            risk_flags=analysis,
+            swot_analysis=analysis,
+            key_concepts=analysis,
+            recommendations=analysis,
+            impact=analysis,
+            word_count=len(text) // 6,
+            analysis_method="benchmark",
+        )
+        for i in range(count)
+    ]
+
+
+async def list_full(db, user_id, collection_id):
+    documents = (await db.scalars(
+        select(Document).where(Document.user_id == user_id).order_by(Document.uploaded_at.desc())
+    )).all()
+    collection_documents = (await db.scalars(
+        select(Document)
+        .where(Document.collection_id == collection_id, Document.user_id == user_id)
+        .order_by(Document.uploaded_at.desc())
+    )).all()
+    return (
+        [dict(id=doc.id, filename=doc.filename, summary=doc.summary, file_url=doc.file_url) for doc in documents],
+        [dict(id=doc.id, filename=doc.filename, summary=doc.summary[:SUMMARY_PREVIEW_LENGTH]) for doc in collection_documents],
+    )
+
+
+async def list_projected(db, user_id, collection_id):
+    documents = (await db.execute(
+        select(*DOCUMENT_LIST_COLUMNS).where(Document.user_id == user_id).order_by(Document.uploaded_at.desc())
+    )).all()
+    collection_documents = (await db.execute(
+        select(
+            Document.id,
+            Document.filename,
+            func.substr(Document.summary, 1, SUMMARY_PREVIEW_LENGTH + 1).label("summary"),
+        )
+        .where(Document.collection_id == collection_id, Document.user_id == user_id)
+        .order_by(Document.uploaded_at.desc())
+    )).all()
+    return (
+        [dict(id=doc.id, filename=doc.filename, summary=doc.summary, file_url=doc.file_url) for doc in documents],
+        [dict(id=doc.id, filename=doc.filename, summary=doc.summary[:SUMMARY_PREVIEW_LENGTH]) for doc in collection_documents],
+    )
+
+
+async def measure(lister, user_id, collection_id):
+    """(milliseconds, peak MiB) for one listing in a fresh session"""
+    async with AsyncSessionLocal() as db:
+        tracemalloc.start()
+        started = time.perf_counter()
+        await lister(db, user_id, collection_id)
+        elapsed = (time.perf_counter() - started) * 1000
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return elapsed, peak / (1024 * 1024)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=300)
+    parser.add_argument("--text-kb", type=int, default=200, help="document_text size per document")
+    parser.add_argument("--rounds", type=int, default=5, help="alternating rounds per mode; the median is reported")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    user = User(email=f"bench-list-{uuid.uuid4().hex[:8]}@example.com", name="Listing Benchmark", plan=UserPlan.PRO, is_active=True)
+    db.add(user)
+    db.commit()
+    collection = Collection(user_id=user.id, name="Benchmark")
+    db.add(collection)
+    db.commit()
+
+    try:
+        rows = document_rows(user.id, collection.id, args.documents, args.text_kb)
+        for start in range(0, len(rows), 50):
+            db.execute(insert(Document), rows[start:start + 50])
+            db.commit()
+
+        modes = (("before (whole rows)", list_full), ("after (projections)", list_projected))
+        results = {label: ([], []) for label, _ in modes}
+        for round_index in range(args.rounds):
+            for label, lister in (modes if round_index % 2 == 0 else modes[::-1]):
+                elapsed, peak = await measure(lister, user.id, collection.id)
+                results[label][0].append(elapsed)
+                results[label][1].append(peak)
+
+        print(f"{args.documents} documents x {args.text_kb} KB text (+ analysis), user and collection listing; "
+              f"median of {args.rounds} rounds")
+        print(f"{'mode':<24}{'ms':>10}{'peak MiB':>12}")
+        for label, (elapsed, peak) in results.items():
+            print(f"{label:<24}{statistics.median(elapsed):>10.1f}{statistics.median(peak):>12.1f}")
+    finally:
+        db.execute(delete(Document).where(Document.user_id == user.id))
+        db.delete(collection)
+        db.delete(user)
+        db.commit()
+        db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
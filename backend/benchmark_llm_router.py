@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark for the LLM provider router (no network, no API keys).
+
+Compares a single provider with a slow tail against the router with hedging and
+failover across two mock providers.
+
+Usage:
+    python benchmark_llm_router.py --requests 500 --concurrency 20
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+# Add the backend directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from llm_router import ProviderRouter, MockProvider, TASK_CHAT
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(pct * (len(values) - 1))))]
+
+
+async def run(router: ProviderRouter, total: int, concurrency: int, hedge: bool) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+
+    async def one():
+        nonlocal failures
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await router.complete(TASK_CHAT, "benchmark prompt", hedge=hedge)
+                latencies.append(time.perf_counter() - started)
+            except Exception:
+                failures += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "failures": failures,
+        "rps": total / elapsed if elapsed else 0.0,
+    }
+
+
+def build_router(primary_error_rate: float) -> ProviderRouter:
+    providers = {
+        "primary": MockProvider("primary", median_latency=0.05, tail_probability=0.04,
+                                tail_multiplier=20.0, error_rate=primary_error_rate, seed=1),
+        "secondary": MockProvider("secondary", median_latency=0.07, tail_probability=0.02,
+                                  tail_multiplier=5.0, seed=2),
+    }
+    routes = {TASK_CHAT: [("primary", "mock-large"), ("secondary", "mock-small")]}
+    return ProviderRouter(providers, routes)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--primary-error-rate", type=float, default=0.05)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+
+    single = build_router(args.primary_error_rate)
+    single.routes[TASK_CHAT] = single.routes[TASK_CHAT][:1]
+    routed = build_router(args.primary_error_rate)
+
+    # Warm up the routed stats so hedge delays come from observed p95
+    await run(routed, 50, args.concurrency, hedge=True)
+
+    results = {
+        "single provider": await run(single, args.requests, args.concurrency, hedge=False),
+        "router (failover only)": await run(build_router(args.primary_error_rate), args.requests, args.concurrency, hedge=False),
+        "router (hedge + failover)": await run(routed, args.requests, args.concurrency, hedge=True),
+    }
+
+    print(f"{'mode':<28}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'failed':>8}{'req/s':>10}")
+    for mode, r in results.items():
+        print(f"{mode:<28}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}{r['failures']:>8}{r['rps']:>10.1f}")
+
+    print("\nRouter stats:")
+    for key, stats in routed.snapshot().items():
+        print(f"  {key}: {stats}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
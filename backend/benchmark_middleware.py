@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Benchmark the middleware stack against the previous BaseHTTPMiddleware chain.
+
+"before" rebuilds the old chain: CORS, a print-per-request test middleware, the
+timezone middleware opening a session per request, the auto-refresh middleware
+printing its cookies, and the @app.middleware security-header function, each a
+BaseHTTPMiddleware layer. Its prints go to /dev/null, so terminal or log-shipping cost
+is not counted. "after" is the pure-ASGI stack used by main.py.
+
+Both serve the same trivial JSON endpoint in-process, so the numbers isolate
+middleware overhead. No database connection is opened: requests carry no auth cookies.
+
+Usage:
+    python benchmark_middleware.py --requests 5000 --concurrency 50
+"""
+import argparse
+import asyncio
+import contextlib
+import logging
+import os
+import sys
+import time
+
+# Add the backend directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from database import DATABASE_URL, SessionLocal
+from dependencies import get_access_token_from_cookie, get_refresh_token_from_cookie
+from middleware.auth_middleware import AutoTokenRefreshMiddleware
+from middleware.request_logging import RequestLoggingMiddleware
+from middleware.timezone_middleware import TimezoneMiddleware
+
+CORS_OPTIONS = dict(
+    allow_origins=["http://localhost:3000"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+    expose_headers=["Set-Cookie"],
+)
+
+
+def add_endpoint(app: FastAPI):
+    @app.get("/documents/ping")
+    async def ping():
+        return {"ok": True}
+
+
+def build_before() -> FastAPI:
+    app = FastAPI()
+    add_endpoint(app)
+
+    class SimpleTestMiddleware(BaseHTTPMiddleware):
+        async def dispatch(self, request: Request, call_next):
+            print(f"🧪 SIMPLE MIDDLEWARE START: {request.method} {request.url.path}")
+            print(f"🧪 About to call next middleware (should be AutoTokenRefreshMiddleware)")
+            response = await call_next(request)
+            print(f"🧪 SIMPLE MIDDLEWARE END: {request.url.path}")
+            print(f"🧪 Response from next middleware received")
+            return response
+
+    class LegacyTimezoneMiddleware(BaseHTTPMiddleware):
+        async def dispatch(self, request: Request, call_next):
+            response = await call_next(request)
+            db = SessionLocal()
+            try:
+                print("Connecting to:", DATABASE_URL)
+            finally:
+                db.close()
+            return response
+
+    class LegacyAutoTokenRefreshMiddleware(BaseHTTPMiddleware):
+        async def dispatch(self, request: Request, call_next):
+            print(f"🔍 === AUTO-REFRESH MIDDLEWARE START: {request.method} {request.url.path} ===")
+            print(f"🔄 PROCESSING auto-refresh middleware for: {request.url.path}")
+            print(f"Access token: {get_access_token_from_cookie(request)}")
+            print(f"Refresh token: {get_refresh_token_from_cookie(request)}")
+            print(f"➡️  No refresh needed for: {request.url.path}")
+            response = await call_next(request)
+            print(f"✅ === AUTO-REFRESH MIDDLEWARE COMPLETE: {request.url.path} ===")
+            return response
+
+    app.add_middleware(CORSMiddleware, **CORS_OPTIONS)
+    app.add_middleware(SimpleTestMiddleware)
+    app.add_middleware(LegacyTimezoneMiddleware)
+    app.add_middleware(LegacyAutoTokenRefreshMiddleware)
+
+    @app.middleware("http")
+    async def add_security_headers(request, call_next):
+        print(f"🔒 SECURITY MIDDLEWARE: {request.url.path}")
+        response = await call_next(request)
+        response.headers["Cross-Origin-Opener-Policy"] = "same-origin-allow-popups"
+        response.headers["Cross-Origin-Embedder-Policy"] = "unsafe-none"
+        print(f"🔒 SECURITY MIDDLEWARE COMPLETE: {request.url.path}")
+        return response
+
+    return app
+
+
+def build_after() -> FastAPI:
+    app = FastAPI()
+    add_endpoint(app)
+    app.add_middleware(CORSMiddleware, **CORS_OPTIONS)
+    app.add_middleware(TimezoneMiddleware)
+    app.add_middleware(AutoTokenRefreshMiddleware, excluded_paths=["/health", "/docs"])
+    app.add_middleware(RequestLoggingMiddleware)
+    return app
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(pct * (len(values) - 1))))]
+
+
+async def run(app: FastAPI, total: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def one():
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.get("/documents/ping", headers={"Origin": "http://localhost:3000"})
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - started)
+
+        # Warm up
+        await asyncio.gather(*(one() for _ in range(100)))
+        latencies.clear()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "rps": total / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    # Production log level; sampled access lines still go through the logger
+    logging.basicConfig(level=logging.INFO, stream=open(os.devnull, "w"))
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        results = {
+            "before (BaseHTTPMiddleware)": await run(build_before(), args.requests, args.concurrency),
+            "after (pure ASGI)": await run(build_after(), args.requests, args.concurrency),
+        }
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}")
+    print(f"{'stack':<30}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for stack, r in results.items():
+        print(f"{stack:<30}{r['rps']:>10.1f}{r['p50_ms']:>10.1f}{r['p99_ms']:>10.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,305 @@
+"""
+Collection rollups: SWOT items, risks and key concepts merged across the documents of a
+collection, each with the number of documents that mention it.
+
+A collection has one collection_rollups row. tallies holds, per normalized item, the
+document count (and, for SWOT items, the count per impact level), so adding or removing
+a document folds just that document's analysis in or out: add_document and
+remove_document run in the transaction that creates or deletes the document, under a
+lock on the rollup row. summary is derived from tallies on every change (the top items
+per section, ROLLUP_TOP_* of each) and is what GET /collections/{id}/rollup returns, so
+serving a rollup reads one row and sends Postgres' JSON text as-is.
+
+New collections get an empty rollup row. A collection without one (created before
+rollups existed), or one marked stale (e.g. by a delete-all batch), is rebuilt from its
+documents' stored analyses on the next read; a document added before that creates the
+row as stale, so the rebuild and the document's transaction never both skip it. Rendered rollups are kept in a per-worker LRU for
+COLLECTION_ROLLUP_CACHE_TTL_SECONDS and invalidated by local document changes.
+"""
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Union
+
+from sqlalchemy import Text, cast, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from document_store import SWOT_KEYS, load_analysis, shape_analysis
+from models import Collection, CollectionRollup, Document, DocumentContent
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_TOP_SWOT_ITEMS = int(os.getenv("ROLLUP_TOP_SWOT_ITEMS", "5"))
+ROLLUP_TOP_RISKS = int(os.getenv("ROLLUP_TOP_RISKS", "10"))
+ROLLUP_TOP_KEY_CONCEPTS = int(os.getenv("ROLLUP_TOP_KEY_CONCEPTS", "20"))
+COLLECTION_ROLLUP_CACHE_TTL_SECONDS = float(os.getenv("COLLECTION_ROLLUP_CACHE_TTL_SECONDS", "300"))
+COLLECTION_ROLLUP_CACHE_SIZE = int(os.getenv("COLLECTION_ROLLUP_CACHE_SIZE", "2000"))
+
+IMPACT_RANK = {"high": 3, "medium": 2, "low": 1}
+
+
+def _item_key(text: str) -> str:
+    """Items that differ only in case, punctuation or emoji are merged"""
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+
+def _text(value) -> str:
+    return value.strip() if isinstance(value, str) else ""
+
+
+def document_contributions(analysis: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """What one document adds to a rollup, by section; each item counts once per document"""
+    contributions: Dict[str, Dict[str, Any]] = {section: {} for section in (*SWOT_KEYS, "risks", "key_concepts", "risk_levels")}
+
+    swot = analysis.get("swot_analysis") if isinstance(analysis.get("swot_analysis"), dict) else {}
+    for category in SWOT_KEYS:
+        for item in swot.get(category) or []:
+            title = _text(item.get("title")) if isinstance(item, dict) else ""
+            if title and _item_key(title):
+                contributions[category].setdefault(_item_key(title), {
+                    "title": title,
+                    "description": _text(item.get("description")),
+                    "category": _text(item.get("category")) or None,
+                    "impact": _text(item.get("impact")).lower() or "unknown",
+                })
+
+    for risk in analysis.get("risk_flags") or []:
+        text = _text(risk.get("text")) if isinstance(risk, dict) else _text(risk)
+        text = text.replace("🚩", "").strip()
+        if text and _item_key(text):
+            contributions["risks"].setdefault(_item_key(text), {"text": text})
+
+    for concept in analysis.get("key_concepts") or []:
+        term = _text(concept.get("term")) if isinstance(concept, dict) else _text(concept)
+        if term and _item_key(term):
+            contributions["key_concepts"].setdefault(_item_key(term), {
+                "term": term,
+                "explanation": _text(concept.get("explanation")) if isinstance(concept, dict) else "",
+            })
+
+    impact = analysis.get("impact_analysis") if isinstance(analysis.get("impact_analysis"), dict) else {}
+    for risk_impact in impact.get("risks_impact") or []:
+        # Placeholders generated for display are not risks the analysis found
+        if isinstance(risk_impact, dict) and not risk_impact.get("generated"):
+            level = _text(risk_impact.get("impact_level")).lower() or "unknown"
+            contributions["risk_levels"][level] = contributions["risk_levels"].get(level, 0) + 1
+
+    return contributions
+
+
+def fold(tallies: Dict[str, Any], contributions: Dict[str, Dict[str, Any]], sign: int) -> Dict[str, Any]:
+    """New tallies with a document's contributions added (sign 1) or removed (sign -1).
+    Counts are order-independent; an item's display text is the first one folded in."""
+    folded = dict(tallies)
+    for section, items in contributions.items():
+        entries = dict(folded.get(section) or {})
+        if section == "risk_levels":
+            for level, count in items.items():
+                total = entries.get(level, 0) + sign * count
+                if total > 0:
+                    entries[level] = total
+                else:
+                    entries.pop(level, None)
+        else:
+            for key, item in items.items():
+                current = entries.get(key)
+                documents = (current["documents"] if current else 0) + sign
+                if documents <= 0:
+                    entries.pop(key, None)
+                    continue
+                entry = {name: value for name, value in (current or item).items() if name != "impact"}
+                entry["documents"] = documents
+                if "impact" in item:
+                    impacts = dict(entry.get("impacts") or {})
+                    impacts[item["impact"]] = impacts.get(item["impact"], 0) + sign
+                    entry["impacts"] = {level: count for level, count in impacts.items() if count > 0}
+                entries[key] = entry
+        folded[section] = entries
+    return folded
+
+
+def _dominant_impact(impacts: Dict[str, int]) -> Optional[str]:
+    if not impacts:
+        return None
+    return max(impacts, key=lambda level: (impacts[level], IMPACT_RANK.get(level, 0)))
+
+
+def summarize(collection_id, tallies: Dict[str, Any], document_count: int) -> Dict[str, Any]:
+    """The rollup as served: the most-mentioned items of each section"""
+    def top(section, limit, label):
+        entries = sorted(
+            (tallies.get(section) or {}).values(),
+            key=lambda entry: (-entry["documents"], -IMPACT_RANK.get(_dominant_impact(entry.get("impacts")), 0), entry[label].lower())
+        )
+        return entries[:limit]
+
+    swot = {
+        category: [
+            {
+                "title": entry["title"],
+                "description": entry["description"],
+                "category": entry.get("category"),
+                "impact": _dominant_impact(entry.get("impacts")),
+                "documents": entry["documents"],
+            }
+            for entry in top(category, ROLLUP_TOP_SWOT_ITEMS, "title")
+        ]
+        for category in SWOT_KEYS
+    }
+    return {
+        "collection_id": str(collection_id),
+        "document_count": document_count,
+        "swot_analysis": swot,
+        "top_risks": top("risks", ROLLUP_TOP_RISKS, "text"),
+        "risks_by_impact_level": dict(tallies.get("risk_levels") or {}),
+        "key_concepts": top("key_concepts", ROLLUP_TOP_KEY_CONCEPTS, "term"),
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+class CollectionRollupCache:
+    """Bounded LRU of collection -> rendered rollup JSON, with a fixed TTL"""
+
+    def __init__(self, ttl: float = COLLECTION_ROLLUP_CACHE_TTL_SECONDS, maxsize: int = COLLECTION_ROLLUP_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, collection_id, user_id) -> Optional[bytes]:
+        key = str(collection_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            owner, body, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            if owner != str(user_id):
+                return None
+            self._entries.move_to_end(key)
+            return body
+
+    def put(self, collection_id, user_id, body: bytes):
+        if self.ttl <= 0:
+            return
+        key = str(collection_id)
+        with self._lock:
+            self._entries[key] = (str(user_id), body, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, collection_id: Union[str, uuid.UUID]):
+        with self._lock:
+            self._entries.pop(str(collection_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+rollup_cache = CollectionRollupCache()
+
+
+async def _locked_rollup(db: AsyncSession, collection_id) -> Optional[CollectionRollup]:
+    # Locked whether or not it is stale, so a rebuild waits for documents being added meanwhile
+    return await db.scalar(
+        select(CollectionRollup)
+        .where(CollectionRollup.collection_id == collection_id)
+        .with_for_update()
+    )
+
+
+def empty_rollup(collection_id) -> CollectionRollup:
+    """Rollup row of a new collection"""
+    return CollectionRollup(
+        collection_id=collection_id, document_count=0, tallies={}, summary=summarize(collection_id, {}, 0), stale=False
+    )
+
+
+async def _apply(db: AsyncSession, collection_id, analysis: Dict[str, Any], sign: int):
+    rollup = await _locked_rollup(db, collection_id)
+    if rollup is None:
+        # Waits for a first read's rebuild that has inserted the row but not committed it
+        # yet, then applies on top of it; otherwise leaves a stale row for the next read
+        await db.execute(
+            pg_insert(CollectionRollup)
+            .values(collection_id=collection_id, document_count=0, tallies={}, summary={}, stale=True)
+            .on_conflict_do_nothing()
+        )
+        rollup = await _locked_rollup(db, collection_id)
+    if rollup.stale:
+        return  # Built from the documents on the next read
+    document_count = max(0, rollup.document_count + sign)
+    # Shaped as stored, so what is added matches what is later removed or rebuilt
+    rollup.tallies = fold(rollup.tallies or {}, document_contributions(shape_analysis(analysis)), sign)
+    rollup.summary = summarize(collection_id, rollup.tallies, document_count)
+    rollup.document_count = document_count
+
+
+async def add_document(db: AsyncSession, collection_id, analysis: Dict[str, Any]):
+    """Fold a new document of the collection into its rollup, within the caller's transaction"""
+    await _apply(db, collection_id, analysis, 1)
+
+
+async def remove_document(db: AsyncSession, collection_id, analysis: Dict[str, Any]):
+    """Take a deleted document out of the collection's rollup, within the caller's transaction"""
+    await _apply(db, collection_id, analysis, -1)
+
+
+async def rebuild_rollup(db: AsyncSession, collection_id):
+    """Recompute the rollup from every document of the collection; commits"""
+    await db.execute(
+        pg_insert(CollectionRollup)
+        .values(collection_id=collection_id, document_count=0, tallies={}, summary={}, stale=True)
+        .on_conflict_do_nothing()
+    )
+    rollup = await _locked_rollup(db, collection_id)
+    if rollup.stale:
+        rows = (await db.execute(
+            select(Document.id, DocumentContent.codec, DocumentContent.analysis)
+            .outerjoin(DocumentContent, DocumentContent.document_id == Document.id)
+            .where(Document.collection_id == collection_id)
+        )).all()
+        tallies: Dict[str, Any] = {}
+        for row in rows:
+            # Documents not moved to document_contents yet keep their analysis inline
+            analysis = row.analysis if row.codec is not None else await load_analysis(db, row.id)
+            tallies = fold(tallies, document_contributions(analysis or {}), 1)
+        rollup.tallies = tallies
+        rollup.summary = summarize(collection_id, tallies, len(rows))
+        rollup.document_count = len(rows)
+        rollup.stale = False
+        logger.info(f"📚 Rebuilt rollup of collection {collection_id} from {len(rows)} document(s)")
+    await db.commit()
+
+
+async def load_rollup_json(db: AsyncSession, collection_id, user_id) -> Optional[bytes]:
+    """Rendered rollup of the user's collection (one row read), or None if they have no such collection"""
+    body = rollup_cache.get(collection_id, user_id)
+    if body is not None:
+        return body
+
+    query = (
+        select(Collection.id, CollectionRollup.stale, cast(CollectionRollup.summary, Text).label("summary_json"))
+        .outerjoin(CollectionRollup, CollectionRollup.collection_id == Collection.id)
+        .where(Collection.id == collection_id, Collection.user_id == user_id)
+    )
+    row = (await db.execute(query)).first()
+    if row is None:
+        return None
+    if row.summary_json is None or row.stale:
+        await rebuild_rollup(db, collection_id)
+        row = (await db.execute(query)).first()
+
+    body = row.summary_json.encode("utf-8")
+    rollup_cache.put(collection_id, user_id, body)
+    return body
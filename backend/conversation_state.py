@@ -0,0 +1,463 @@
+"""
+Conversation memory for document chat: a rolling summary of the older exchanges of a
+chat session plus its most recent exchanges verbatim, rendered for the prompt.
+
+Recent exchanges: the newest CONVERSATION_STATE_TURNS exchanges that fit in
+CONVERSATION_RECENT_TOKEN_BUDGET tokens (the newest one is always kept, truncated if
+it alone is over budget). Anything older is folded into the summary.
+
+Summary: stored in conversation_summaries, one row per session, with the sort key of
+the last exchange it covers. After each answer, ConversationSummarizer folds the
+exchanges that dropped out of the recent window into the summary in the background,
+using the cheap summary route, at most CONVERSATION_SUMMARY_BATCH exchanges per
+model call. The summary is
+capped at CONVERSATION_SUMMARY_MAX_TOKENS, so the history part of the prompt stays
+roughly constant however long the conversation runs. Folding is resumable: whatever
+was not folded (worker restart, provider outage) is picked up on the next turn. With
+no summary provider configured, older exchanges simply drop out of the prompt.
+
+State is kept in a bounded per-process LRU: the first turn loads it once, each new
+exchange is appended in place with remember_exchange, and a finished fold updates the
+cached entry. Before a cached state is reused, one indexed query checks that the
+session's newest exchange and summary position are still the ones it holds, so turns
+recorded (or folded, or deleted) by another worker are never missed; steady-state turns
+read that pair instead of the history. Entries expire after
+CONVERSATION_STATE_TTL_SECONDS. Deleting a session, chat history, a document or an
+account invalidates the affected entries.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from datetime import datetime
+from typing import List, Optional, Set, Tuple, Union
+
+import tiktoken
+from sqlalchemy import select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal
+from llm_router import provider_router, track_llm_usage, TASK_SUMMARY
+from models import ChatHistory, ConversationSummary
+from usage_metering import usage_meter
+
+logger = logging.getLogger(__name__)
+
+CONVERSATION_STATE_TURNS = int(os.getenv("CONVERSATION_STATE_TURNS", "4"))
+CONVERSATION_RECENT_TOKEN_BUDGET = int(os.getenv("CONVERSATION_RECENT_TOKEN_BUDGET", "1500"))
+CONVERSATION_SUMMARY_MAX_TOKENS = int(os.getenv("CONVERSATION_SUMMARY_MAX_TOKENS", "400"))
+CONVERSATION_SUMMARY_BATCH = int(os.getenv("CONVERSATION_SUMMARY_BATCH", "10"))
+CONVERSATION_SUMMARY_QUEUE_SIZE = int(os.getenv("CONVERSATION_SUMMARY_QUEUE_SIZE", "1000"))
+CONVERSATION_STATE_TTL_SECONDS = float(os.getenv("CONVERSATION_STATE_TTL_SECONDS", "600"))
+CONVERSATION_STATE_CACHE_SIZE = int(os.getenv("CONVERSATION_STATE_CACHE_SIZE", "5000"))
+
+# Per-exchange cap on what is sent to the summarizer; answers can be long
+SUMMARY_INPUT_CHARS_PER_TURN = 4000
+
+try:
+    _encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
+except Exception:
+    _encoding = None
+
+
+def count_tokens(text: str) -> int:
+    if _encoding is None:
+        # Fallback estimation: roughly 4 characters per token
+        return len(text) // 4
+    return len(_encoding.encode(text))
+
+
+def render_turn(question: str, answer: str) -> str:
+    return f"User: {question}\nAssistant: {answer}\n\n"
+
+
+@dataclass(frozen=True)
+class Turn:
+    id: uuid.UUID
+    timestamp: datetime
+    text: str
+    tokens: int
+
+    @classmethod
+    def from_exchange(cls, chat_id: uuid.UUID, timestamp: datetime, question: str, answer: str) -> "Turn":
+        text = render_turn(question or "", answer or "")
+        return cls(id=chat_id, timestamp=timestamp, text=text, tokens=count_tokens(text))
+
+    @property
+    def key(self) -> Tuple[datetime, uuid.UUID]:
+        return self.timestamp, self.id
+
+
+@dataclass(frozen=True)
+class ConversationState:
+    summary: str = ""
+    summary_tokens: int = 0
+    # Last exchange covered by the summary
+    summarized_through_id: Optional[uuid.UUID] = None
+    # Exchanges not folded into the summary yet, oldest first
+    turns: Tuple[Turn, ...] = ()
+
+    @property
+    def newest_id(self) -> Optional[uuid.UUID]:
+        return self.turns[-1].id if self.turns else None
+
+    def recent_turns(self) -> List[Turn]:
+        """The exchanges sent verbatim, oldest first"""
+        recent: List[Turn] = []
+        tokens = 0
+        for turn in reversed(self.turns):
+            if len(recent) >= CONVERSATION_STATE_TURNS:
+                break
+            if recent and tokens + turn.tokens > CONVERSATION_RECENT_TOKEN_BUDGET:
+                break
+            if turn.tokens > CONVERSATION_RECENT_TOKEN_BUDGET:
+                # The newest exchange alone is over budget: keep its beginning
+                text = turn.text[:CONVERSATION_RECENT_TOKEN_BUDGET * 4] + "...\n\n"
+                turn = replace(turn, text=text, tokens=CONVERSATION_RECENT_TOKEN_BUDGET)
+            recent.append(turn)
+            tokens += turn.tokens
+        recent.reverse()
+        return recent
+
+    @property
+    def needs_folding(self) -> bool:
+        return len(self.turns) > len(self.recent_turns())
+
+    @property
+    def history_text(self) -> str:
+        recent = "".join(turn.text for turn in self.recent_turns())
+        if not self.summary:
+            return recent
+        return f"Summary of the earlier conversation: {self.summary}\n\n{recent}"
+
+    @property
+    def history_tokens(self) -> int:
+        return self.summary_tokens + sum(turn.tokens for turn in self.recent_turns())
+
+    def with_turn(self, turn: Turn) -> "ConversationState":
+        # One exchange past the window is enough to know a fold is due; the rest stay in the database
+        turns = (self.turns + (turn,))[-(CONVERSATION_STATE_TURNS + 1):]
+        return replace(self, turns=turns)
+
+    def with_summary(self, summary: str, through: Tuple[datetime, uuid.UUID]) -> "ConversationState":
+        return ConversationState(
+            summary=summary,
+            summary_tokens=count_tokens(summary),
+            summarized_through_id=through[1],
+            turns=tuple(turn for turn in self.turns if turn.key > through),
+        )
+
+
+class ConversationStateCache:
+    """Bounded LRU of conversation states keyed by (user, session), with a fixed TTL"""
+
+    def __init__(self, ttl: float = CONVERSATION_STATE_TTL_SECONDS, maxsize: int = CONVERSATION_STATE_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[Tuple[str, str], tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(user_id, session_id) -> Tuple[str, str]:
+        return str(user_id), str(session_id)
+
+    def get(self, user_id, session_id) -> Optional[ConversationState]:
+        key = self._key(user_id, session_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            state, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return state
+
+    def put(self, user_id, session_id, state: ConversationState):
+        if self.ttl <= 0:
+            return
+        key = self._key(user_id, session_id)
+        with self._lock:
+            self._entries[key] = (state, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def update(self, user_id, session_id, change) -> Optional[ConversationState]:
+        """Apply change(state) to a cached conversation; uncached ones are loaded on their next turn"""
+        key = self._key(user_id, session_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                return None
+            state = change(entry[0])
+            self._entries[key] = (state, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            return state
+
+    def invalidate(self, user_id, session_id: Optional[Union[str, uuid.UUID]] = None):
+        """Drop one session, or every session of the user"""
+        with self._lock:
+            if session_id is not None:
+                self._entries.pop(self._key(user_id, session_id), None)
+                return
+            user_key = str(user_id)
+            for key in [key for key in self._entries if key[0] == user_key]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+conversation_cache = ConversationStateCache()
+
+
+async def _read_state(db: AsyncSession, session_id):
+    """State from the database; returns it with the summary row (or None)"""
+    current = (await db.execute(
+        select(
+            ConversationSummary.summary,
+            ConversationSummary.summarized_through,
+            ConversationSummary.summarized_through_id,
+        )
+        .where(ConversationSummary.chat_session_id == session_id)
+    )).first()
+
+    query = (
+        select(ChatHistory.id, ChatHistory.question, ChatHistory.answer, ChatHistory.timestamp)
+        .where(ChatHistory.chat_session_id == session_id)
+        .order_by(ChatHistory.timestamp.desc(), ChatHistory.id.desc())
+        .limit(CONVERSATION_STATE_TURNS + 1)
+    )
+    if current is not None:
+        query = query.where(
+            tuple_(ChatHistory.timestamp, ChatHistory.id)
+            > tuple_(current.summarized_through, current.summarized_through_id)
+        )
+    rows = (await db.execute(query)).all()
+
+    summary = current.summary if current is not None else ""
+    state = ConversationState(
+        summary=summary,
+        summary_tokens=count_tokens(summary),
+        summarized_through_id=current.summarized_through_id if current is not None else None,
+    )
+    for row in reversed(rows):
+        state = state.with_turn(Turn.from_exchange(row.id, row.timestamp, row.question, row.answer))
+    return state, current
+
+
+async def _is_current(db: AsyncSession, session_id, state: ConversationState) -> bool:
+    """Whether the session's newest exchange and summary position are still those of the cached state"""
+    newest = (
+        select(ChatHistory.id)
+        .where(ChatHistory.chat_session_id == session_id)
+        .order_by(ChatHistory.timestamp.desc(), ChatHistory.id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    summarized_through = (
+        select(ConversationSummary.summarized_through_id)
+        .where(ConversationSummary.chat_session_id == session_id)
+        .scalar_subquery()
+    )
+    row = (await db.execute(select(newest.label("newest_id"), summarized_through.label("summarized_through_id")))).one()
+    return row.newest_id == state.newest_id and row.summarized_through_id == state.summarized_through_id
+
+
+async def load_conversation_state(db: AsyncSession, user_id, document_id, session_id) -> ConversationState:
+    """Summary and recent exchanges of a chat session, from the cache (when still current) or the database"""
+    state = conversation_cache.get(user_id, session_id)
+    if state is not None and await _is_current(db, session_id, state):
+        return state
+
+    state, _ = await _read_state(db, session_id)
+    conversation_cache.put(user_id, session_id, state)
+    if state.needs_folding:
+        conversation_summarizer.schedule(user_id, document_id, session_id)
+    return state
+
+
+def remember_exchange(
+    user_id, document_id, session_id, chat_id: uuid.UUID, timestamp: datetime, question: str, answer: str
+):
+    """Add a new exchange to the cached session and fold older ones in the background"""
+    turn = Turn.from_exchange(chat_id, timestamp, question, answer)
+    state = conversation_cache.update(user_id, session_id, lambda state: state.with_turn(turn))
+    if state is None or state.needs_folding:
+        conversation_summarizer.schedule(user_id, document_id, session_id)
+
+
+def summary_prompt(summary: str, rows) -> str:
+    exchanges = "".join(
+        render_turn(row.question or "", (row.answer or "")[:SUMMARY_INPUT_CHARS_PER_TURN]) for row in rows
+    )
+    words = int(CONVERSATION_SUMMARY_MAX_TOKENS * 0.6)
+    return f"""You maintain a running summary of a conversation between a user and an assistant about a document.
+
+Current summary:
+{summary or "(none yet)"}
+
+New exchanges:
+{exchanges}
+Rewrite the summary so it also covers the new exchanges. Keep the user's questions and goals, the facts, figures and conclusions given, and anything left open. Drop pleasantries and repetition. Write plain prose, at most {words} words, and return only the summary."""
+
+
+class ConversationSummarizer:
+    """Background worker folding older exchanges into each conversation's rolling summary"""
+
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # (user, document, session) queued and not picked up yet (deduplicates bursts)
+        self._queued: Set[Tuple[uuid.UUID, uuid.UUID, uuid.UUID]] = set()
+
+    def schedule(self, user_id, document_id, session_id) -> bool:
+        """Queue a fold for the session; never blocks. Returns False if dropped."""
+        if not provider_router.has_providers(TASK_SUMMARY):
+            return False
+        key = tuple(uuid.UUID(str(value)) for value in (user_id, document_id, session_id))
+        if key in self._queued:
+            return True
+
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(key)
+        except asyncio.QueueFull:
+            logger.warning("⚠️ Conversation summary queue full, dropping update")
+            return False
+        self._queued.add(key)
+        return True
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        if self._worker is not None and not self._worker.done() and self._loop is loop:
+            return
+        # First use, or the previous loop has gone away (tests, reloads)
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=CONVERSATION_SUMMARY_QUEUE_SIZE)
+        self._queued.clear()
+        self._worker = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            key = await self._queue.get()
+            self._queued.discard(key)
+            try:
+                more = await self.fold(*key)
+            except Exception as e:
+                logger.error(f"❌ Conversation summary failed for chat session {key[2]}: {e}")
+                continue
+            if more:
+                self.schedule(*key)
+
+    async def fold(self, user_id: uuid.UUID, document_id: uuid.UUID, session_id: uuid.UUID) -> bool:
+        """Fold the oldest exchanges outside the recent window into the summary; True if more are waiting"""
+        async with AsyncSessionLocal() as db:
+            state, current = await _read_state(db, session_id)
+            if not state.needs_folding:
+                return False
+
+            query = (
+                select(ChatHistory.id, ChatHistory.question, ChatHistory.answer, ChatHistory.timestamp)
+                .where(
+                    ChatHistory.chat_session_id == session_id,
+                    tuple_(ChatHistory.timestamp, ChatHistory.id) < tuple_(*state.recent_turns()[0].key),
+                )
+                .order_by(ChatHistory.timestamp, ChatHistory.id)
+                .limit(CONVERSATION_SUMMARY_BATCH)
+            )
+            if current is not None:
+                query = query.where(
+                    tuple_(ChatHistory.timestamp, ChatHistory.id)
+                    > tuple_(current.summarized_through, current.summarized_through_id)
+                )
+            rows = (await db.execute(query)).all()
+            if not rows:
+                return False
+            # Release the read snapshot while the model runs
+            await db.rollback()
+
+            with track_llm_usage() as llm_usage:
+                response = await provider_router.complete(
+                    TASK_SUMMARY,
+                    summary_prompt(state.summary, rows),
+                    max_tokens=CONVERSATION_SUMMARY_MAX_TOKENS,
+                    temperature=0.2,
+                )
+            summary = response.text.strip()
+
+            saved = await self._save(db, session_id, current, summary, rows)
+            # Summaries are the app's own overhead: logged for cost reports, not charged to the plan
+            await usage_meter.record(db, user_id, "chat_summary", document_id=document_id, llm_usage=llm_usage)
+
+        if not saved:
+            # History was deleted or another worker folded first
+            return False
+        through = (rows[-1].timestamp, rows[-1].id)
+        conversation_cache.update(user_id, session_id, lambda state: state.with_summary(summary, through))
+        logger.info(f"📝 Folded {len(rows)} exchange(s) into the summary of chat session {session_id}")
+        return len(rows) == CONVERSATION_SUMMARY_BATCH
+
+    @staticmethod
+    async def _save(db: AsyncSession, session_id, current, summary: str, rows) -> bool:
+        """Store the new summary unless the history changed underneath; does not commit"""
+        last = rows[-1]
+        # Key-share lock on the newest folded exchange: a concurrent history delete either
+        # waits for this write (and then deletes the summary too) or has already won
+        still_there = await db.scalar(
+            select(ChatHistory.id).where(ChatHistory.id == last.id).with_for_update(key_share=True)
+        )
+        if still_there is None:
+            return False
+
+        if current is None:
+            result = await db.execute(
+                pg_insert(ConversationSummary)
+                .values(
+                    chat_session_id=session_id,
+                    summary=summary,
+                    summarized_through=last.timestamp,
+                    summarized_through_id=last.id,
+                    turns_summarized=len(rows),
+                )
+                .on_conflict_do_nothing()
+            )
+        else:
+            # Compare-and-set on the previous position, so two workers never fold the same exchanges twice
+            result = await db.execute(
+                update(ConversationSummary)
+                .where(
+                    ConversationSummary.chat_session_id == session_id,
+                    ConversationSummary.summarized_through_id == current.summarized_through_id,
+                )
+                .values(
+                    summary=summary,
+                    summarized_through=last.timestamp,
+                    summarized_through_id=last.id,
+                    turns_summarized=ConversationSummary.turns_summarized + len(rows),
+                )
+            )
+        return result.rowcount == 1
+
+    async def shutdown(self):
+        """Stop the worker; unfinished folds are picked up again on the next turn"""
+        if self._worker is not None and self._loop is asyncio.get_running_loop():
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        self._worker = None
+
+
+# Global conversation summarizer instance
+conversation_summarizer = ConversationSummarizer()
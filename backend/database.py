@@ -1,9 +1,22 @@
 import os
+import orjson
 from dotenv import load_dotenv
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from supabase import create_client, Client  
 
+from db_pool import (
+    InstrumentedAsyncQueuePool,
+    InstrumentedQueuePool,
+    async_pool_metrics,
+    asyncpg_server_settings,
+    instrument_engine,
+    pool_kwargs,
+    psycopg2_connect_args,
+    sync_pool_metrics,
+)
+
 load_dotenv()
 
 # Supabase
@@ -31,18 +44,56 @@ PASSWORD = os.getenv("DB_PASSWORD")
 HOST = os.getenv("DB_HOST")
 PORT = os.getenv("DB_PORT")
 DBNAME = os.getenv("DB_NAME")
+# "require" in production; "disable" for a local Postgres without SSL
+DB_SSLMODE = os.getenv("DB_SSLMODE", "require")
+
+DATABASE_URL = f"postgresql+psycopg2://{USER}:{PASSWORD}@{HOST}:{PORT}/{DBNAME}?sslmode={DB_SSLMODE}"
+ASYNC_DATABASE_URL = f"postgresql+asyncpg://{USER}:{PASSWORD}@{HOST}:{PORT}/{DBNAME}"
 
-DATABASE_URL = f"postgresql+psycopg2://{USER}:{PASSWORD}@{HOST}:{PORT}/{DBNAME}?sslmode=require"
+# One engine of each kind per process; pool settings live in db_pool.py
+# JSON/JSONB columns are encoded and decoded with orjson
+def json_serializer(value) -> str:
+    return orjson.dumps(value).decode()
 
-engine = create_engine(DATABASE_URL)
+# Sync engine: scripts, Alembic and background jobs that run outside the event loop
+engine = create_engine(
+    DATABASE_URL,
+    poolclass=InstrumentedQueuePool,
+    connect_args=psycopg2_connect_args(),
+    json_serializer=json_serializer,
+    json_deserializer=orjson.loads,
+    **pool_kwargs()
+)
 SessionLocal = sessionmaker(bind=engine)
+instrument_engine(engine, sync_pool_metrics)
+
+# Async engine: request handlers, so DB round-trips never block the event loop
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    poolclass=InstrumentedAsyncQueuePool,
+    connect_args={"ssl": DB_SSLMODE, "server_settings": asyncpg_server_settings()},
+    json_serializer=json_serializer,
+    json_deserializer=orjson.loads,
+    **pool_kwargs()
+)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, class_=AsyncSession, expire_on_commit=False)
+instrument_engine(async_engine.sync_engine, async_pool_metrics)
 
 # ✅ Add this to allow import in main.py
 def get_db():
     db = SessionLocal()
     try:
-        print("Connecting to:", DATABASE_URL)
-
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def get_pool_metrics() -> dict:
+    """Pool usage and checkout wait metrics for both engines"""
+    return {
+        "async": async_pool_metrics.snapshot(async_engine.pool),
+        "sync": sync_pool_metrics.snapshot(engine.pool),
+    }
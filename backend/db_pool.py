@@ -0,0 +1,158 @@
+"""
+Connection pool configuration and metrics.
+
+Both engines (sync psycopg2, async asyncpg) are built once per process in database.py
+from the settings below. The pools are instrumented so we can size them under load:
+
+- checkout wait time (how long a request waited for a connection)
+- checkouts that timed out, and checkouts made while overflow connections were open
+- current size / checked-out / overflow from the live pool
+
+Environment:
+    DB_POOL_SIZE              persistent connections per engine (default 10)
+    DB_MAX_OVERFLOW           extra connections allowed under burst (default 10)
+    DB_POOL_TIMEOUT           seconds to wait for a connection before failing (default 30)
+    DB_POOL_RECYCLE           seconds before a connection is replaced (default 1800)
+    DB_POOL_PRE_PING          test connections on checkout (default true)
+    DB_STATEMENT_TIMEOUT_MS   server-side statement_timeout, 0 disables (default 30000)
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+logger = logging.getLogger(__name__)
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
+POOL_METRICS_WINDOW = int(os.getenv("DB_POOL_METRICS_WINDOW", "1000"))
+
+
+class PoolMetrics:
+    """Checkout counters and a rolling window of checkout wait times"""
+
+    def __init__(self, name: str, window: int = POOL_METRICS_WINDOW):
+        self.name = name
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=window)
+        self.checkouts = 0
+        self.checkout_timeouts = 0
+        self.checkouts_during_overflow = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.wait_max = 0.0
+
+    def record_checkout(self, wait: float, overflow: bool = False, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.checkout_timeouts += 1
+            else:
+                self.checkouts += 1
+                if overflow:
+                    self.checkouts_during_overflow += 1
+            self._waits.append(wait)
+            self.wait_max = max(self.wait_max, wait)
+
+    def record_connect(self):
+        with self._lock:
+            self.connects += 1
+
+    def record_invalidation(self):
+        with self._lock:
+            self.invalidations += 1
+
+    def _wait_percentile(self, waits, pct: float) -> float:
+        if not waits:
+            return 0.0
+        return waits[min(len(waits) - 1, int(round(pct * (len(waits) - 1))))]
+
+    def snapshot(self, pool=None) -> dict:
+        with self._lock:
+            waits = sorted(self._waits)
+            data = {
+                "checkouts": self.checkouts,
+                "checkout_timeouts": self.checkout_timeouts,
+                "checkouts_during_overflow": self.checkouts_during_overflow,
+                "connects": self.connects,
+                "invalidations": self.invalidations,
+                "checkout_wait_p50_ms": round(self._wait_percentile(waits, 0.50) * 1000, 2),
+                "checkout_wait_p95_ms": round(self._wait_percentile(waits, 0.95) * 1000, 2),
+                "checkout_wait_max_ms": round(self.wait_max * 1000, 2),
+            }
+        if pool is not None:
+            data.update({
+                "pool_size": pool.size(),
+                "in_use": pool.checkedout(),
+                "idle": pool.checkedin(),
+                # QueuePool.overflow() is negative until the pool itself is full
+                "overflow_in_use": max(0, pool.overflow()),
+                "max_overflow": DB_MAX_OVERFLOW,
+            })
+        return data
+
+
+sync_pool_metrics = PoolMetrics("sync")
+async_pool_metrics = PoolMetrics("async")
+
+
+class _TimedCheckoutMixin:
+    """Times every checkout, including time spent queued behind a full pool"""
+
+    metrics: PoolMetrics
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.metrics.record_checkout(time.perf_counter() - started, timed_out=True)
+            logger.warning(f"⚠️ DB pool ({self.metrics.name}) checkout timed out after {DB_POOL_TIMEOUT}s")
+            raise
+        self.metrics.record_checkout(time.perf_counter() - started, overflow=self.overflow() > 0)
+        return connection
+
+
+class InstrumentedQueuePool(_TimedCheckoutMixin, QueuePool):
+    metrics = sync_pool_metrics
+
+
+class InstrumentedAsyncQueuePool(_TimedCheckoutMixin, AsyncAdaptedQueuePool):
+    metrics = async_pool_metrics
+
+
+def pool_kwargs() -> dict:
+    """Shared create_engine / create_async_engine pool arguments"""
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def psycopg2_connect_args() -> dict:
+    if DB_STATEMENT_TIMEOUT_MS <= 0:
+        return {}
+    return {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+
+
+def asyncpg_server_settings() -> dict:
+    if DB_STATEMENT_TIMEOUT_MS <= 0:
+        return {}
+    return {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}
+
+
+def instrument_engine(sync_engine, metrics: PoolMetrics):
+    """Count new connections and invalidations (e.g. failed pre-pings) for an engine's pool"""
+    event.listen(sync_engine, "connect", lambda dbapi_conn, record: metrics.record_connect())
+    event.listen(sync_engine, "invalidate", lambda dbapi_conn, record, exc: metrics.record_invalidation())
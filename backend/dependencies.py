@@ -1,13 +1,17 @@
 from fastapi import Depends, HTTPException, status, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional
 import json
+import math
 import uuid
 
-from database import get_db
+from database import get_async_db
 from models import User, Usage, UserPlan
-from auth_backend import verify_token
+from identity import request_claims, resolve_user
+from usage_metering import TOKEN_RESERVATION_MARGIN, TokenReservation, usage_meter
+from admission_control import AdmissionRejected, admission_controller
 
 # Security scheme
 security = HTTPBearer()
@@ -46,7 +50,7 @@ PLAN_LIMITS = {
 
 async def get_current_user_from_cookie(
     request: Request,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> User:
     """Get current authenticated user from HTTP-only cookie"""
     credentials_exception = HTTPException(
@@ -61,7 +65,7 @@ async def get_current_user_from_cookie(
             raise credentials_exception
         
         # Verify the token
-        payload = verify_token(access_token)
+        payload = request_claims(request.scope, access_token)
         if payload is None:
             raise credentials_exception
             
@@ -69,8 +73,8 @@ async def get_current_user_from_cookie(
         if user_id is None:
             raise credentials_exception
             
-        # Get user from database
-        user = db.query(User).filter(User.id == user_id).first()
+        # Get user from database (once per request)
+        user = await resolve_user(request.scope, db, user_id)
         if user is None:
             raise credentials_exception
             
@@ -88,8 +92,9 @@ async def get_current_user_from_cookie(
         raise credentials_exception
 
 async def get_current_user(
+    request: Request,
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> User:
     """Get current authenticated user from JWT token"""
     credentials_exception = HTTPException(
@@ -100,7 +105,7 @@ async def get_current_user(
     
     try:
         # Verify the token
-        payload = verify_token(credentials.credentials)
+        payload = request_claims(request.scope, credentials.credentials)
         if payload is None:
             raise credentials_exception
             
@@ -108,8 +113,8 @@ async def get_current_user(
         if user_id is None:
             raise credentials_exception
             
-        # Get user from database
-        user = db.query(User).filter(User.id == user_id).first()
+        # Get user from database (once per request)
+        user = await resolve_user(request.scope, db, user_id)
         if user is None:
             raise credentials_exception
             
@@ -127,7 +132,7 @@ async def get_current_user(
 async def get_current_user_flexible(
     request: Request,
     credentials: Optional[HTTPAuthorizationCredentials] = Depends(HTTPBearer(auto_error=False)),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> User:
     """Get current authenticated user from either cookie or Bearer token"""
     # Try cookie first
@@ -139,7 +144,7 @@ async def get_current_user_flexible(
     # Fall back to Bearer token
     if credentials:
         try:
-            return await get_current_user(credentials, db)
+            return await get_current_user(request, credentials, db)
         except HTTPException:
             pass
     
@@ -160,24 +165,36 @@ async def get_current_active_user(
         )
     return current_user
 
-def get_or_create_usage(user_id: uuid.UUID, db: Session) -> Usage:
+async def get_optional_active_user(
+    request: Request,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(HTTPBearer(auto_error=False)),
+    db: AsyncSession = Depends(get_async_db)
+) -> Optional[User]:
+    """Current active user, or None for a request without valid credentials"""
+    try:
+        current_user = await get_current_user_flexible(request, credentials, db)
+    except HTTPException:
+        return None
+    return await get_current_active_user(current_user)
+
+async def get_or_create_usage(user_id: uuid.UUID, db: AsyncSession) -> Usage:
     """Get or create usage record for user"""
-    usage = db.query(Usage).filter(Usage.user_id == user_id).first()
+    usage = await db.scalar(select(Usage).where(Usage.user_id == user_id))
     if not usage:
         usage = Usage(user_id=user_id)
         db.add(usage)
-        db.commit()
-        db.refresh(usage)
+        await db.commit()
+        await db.refresh(usage)
     return usage
 
 async def check_document_limit(
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> User:
     """Check if user can upload more documents (Free tier has document limits, others only token limits)"""
     # Free tier has document limits, Standard/Pro only have token limits
     if current_user.plan == UserPlan.FREE:
-        usage = get_or_create_usage(current_user.id, db)
+        usage = await usage_meter.counters(db, current_user.id)
         limits = PLAN_LIMITS[current_user.plan]
         
         if usage.docs_used >= limits["doc_limit"]:
@@ -190,12 +207,12 @@ async def check_document_limit(
 
 async def check_chat_limit(
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> User:
     """Check if user can send more chat messages (Free tier has chat limits, others only token limits)"""
     # Free tier has chat limits, Standard/Pro only have token limits
     if current_user.plan == UserPlan.FREE:
-        usage = get_or_create_usage(current_user.id, db)
+        usage = await usage_meter.counters(db, current_user.id)
         limits = PLAN_LIMITS[current_user.plan]
         
         if usage.chats_used >= limits["chat_limit"]:
@@ -208,14 +225,14 @@ async def check_chat_limit(
 
 async def check_token_limit(
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     estimated_tokens: int = 0
 ) -> User:
     """Check if user has enough tokens remaining"""
-    usage = get_or_create_usage(current_user.id, db)
+    usage = await usage_meter.counters(db, current_user.id)
     limits = PLAN_LIMITS[current_user.plan]
     
-    if usage.tokens_used + estimated_tokens > limits["token_limit"]:
+    if usage.tokens_used + usage.tokens_reserved + estimated_tokens > limits["token_limit"]:
         raise HTTPException(
             status_code=status.HTTP_429_TOO_MANY_REQUESTS,
             detail=f"Token limit exceeded. Your {current_user.plan.value} plan allows {limits['token_limit']} tokens per month."
@@ -223,32 +240,77 @@ async def check_token_limit(
     
     return current_user
 
-def increment_document_usage(user_id: uuid.UUID, db: Session):
+async def reserve_tokens(current_user: User, db: AsyncSession, token_budget: int) -> TokenReservation:
+    """Reserve the most an LLM operation can use (prompts plus full responses), with
+    TOKEN_RESERVATION_MARGIN headroom; settle or release it with usage_meter afterwards"""
+    limits = PLAN_LIMITS[current_user.plan]
+    tokens = math.ceil(token_budget * TOKEN_RESERVATION_MARGIN)
+    reservation = await usage_meter.reserve(db, current_user.id, tokens, limits["token_limit"])
+    
+    if reservation is None:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"Token limit exceeded. Your {current_user.plan.value} plan allows {limits['token_limit']} tokens per month."
+        )
+    
+    return reservation
+
+async def _admit(key, plan: UserPlan):
+    """Admission release callback, or 429 + Retry-After when rejected"""
+    try:
+        return await admission_controller.admit(key, plan)
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"{e.reason}. Please retry in {e.retry_after} seconds.",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+async def admit_llm_request(
+    current_user: User = Depends(get_current_active_user)
+):
+    """Admit an LLM request under the user's rate and fair-share limits; holds a model-call slot for the request"""
+    release = await _admit(current_user.id, current_user.plan)
+    try:
+        yield current_user
+    finally:
+        release()
+
+async def admit_optional_user_llm_request(
+    request: Request,
+    current_user: Optional[User] = Depends(get_optional_active_user)
+):
+    """admit_llm_request for routes that also serve anonymous requests; those are limited per client IP at FREE plan rates"""
+    if current_user is not None:
+        release = await _admit(current_user.id, current_user.plan)
+    else:
+        forwarded_for = request.headers.get("X-Forwarded-For")
+        client_ip = forwarded_for.split(",")[0].strip() if forwarded_for else (request.client.host if request.client else "unknown")
+        release = await _admit(f"anonymous:{client_ip}", UserPlan.FREE)
+    try:
+        yield current_user
+    finally:
+        release()
+
+async def increment_document_usage(user_id: uuid.UUID, db: AsyncSession):
     """Increment document usage for user"""
-    usage = get_or_create_usage(user_id, db)
-    usage.docs_used += 1
-    db.commit()
+    await usage_meter.record(db, user_id, "document", docs=1)
 
-def increment_chat_usage(user_id: uuid.UUID, db: Session):
+async def increment_chat_usage(user_id: uuid.UUID, db: AsyncSession):
     """Increment chat usage for user"""
-    usage = get_or_create_usage(user_id, db)
-    if usage is not None:
-        usage.chats_used = (usage.chats_used or 0) + 1
-        db.commit()
+    await usage_meter.record(db, user_id, "chat", chats=1)
 
-def increment_token_usage(user_id: uuid.UUID, tokens: int, db: Session):
+async def increment_token_usage(user_id: uuid.UUID, tokens: int, db: AsyncSession):
     """Increment token usage for user"""
-    usage = get_or_create_usage(user_id, db)
-    usage.tokens_used += tokens
-    db.commit()
+    await usage_meter.record(db, user_id, "tokens", tokens=tokens)
 
 def estimate_tokens(text: str) -> int:
     """Estimate token count from text (rough approximation: 1 token ≈ 4 characters)"""
     return len(text) // 4
 
-def get_user_limits_info(user: User, db: Session) -> dict:
+async def get_user_limits_info(user: User, db: AsyncSession) -> dict:
     """Get user's current usage and limits"""
-    usage = get_or_create_usage(user.id, db)
+    usage = await usage_meter.counters(db, user.id)
     limits = PLAN_LIMITS[user.plan]
     
     return {
@@ -272,7 +334,7 @@ def get_user_limits_info(user: User, db: Session) -> dict:
         }
     }
 
-def get_current_user_optional(request: Request, db: Session) -> Optional[User]:
+async def get_current_user_optional(request: Request, db: AsyncSession) -> Optional[User]:
     """Get current user without raising exception if not authenticated"""
     try:
         # Try to get token from request
@@ -291,7 +353,7 @@ def get_current_user_optional(request: Request, db: Session) -> Optional[User]:
             return None
             
         # Verify the token
-        payload = verify_token(token)
+        payload = request_claims(request.scope, token)
         if payload is None:
             return None
         
@@ -299,8 +361,7 @@ def get_current_user_optional(request: Request, db: Session) -> Optional[User]:
         if not user_id:
             return None
             
-        user = db.query(User).filter(User.id == user_id).first()
-        return user
+        return await resolve_user(request.scope, db, user_id)
         
     except Exception:
         return None 
\ No newline at end of file
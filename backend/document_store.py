@@ -0,0 +1,256 @@
+"""
+Storage for the heavy part of a document: extracted text and analysis payloads.
+
+These live in document_contents, one row per document, so the documents table holds
+only the small columns that listings and ownership checks read. The payload is read
+on demand, by the routes that need it.
+
+- Text is compressed here with zstd (when the optional zstandard package is
+  installed) or gzip.
+- Analysis is JSONB, already in the shape the API returns (shape_analysis), so reads
+  need no parsing or re-validation: load_analysis_json has Postgres render it as JSON
+  text that goes into the response body as-is, and JSON path queries can run over it
+  server-side (GIN jsonb_path_ops index). Postgres TOAST-compresses large values.
+
+Documents created before the split keep their payload inline in the (now deferred)
+documents columns until backfill_document_contents.py moves it; the loaders read
+either layout, so the backfill can run while the app is live.
+"""
+import gzip
+import json
+import logging
+import os
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import orjson
+from sqlalchemy import Text, cast, func, literal_column, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Document, DocumentContent
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_COMPRESSION = os.getenv("DOCUMENT_COMPRESSION", "zstd" if zstandard else "gzip")
+DOCUMENT_COMPRESSION_LEVEL = int(os.getenv("DOCUMENT_COMPRESSION_LEVEL", "6"))
+
+# Legacy inline analysis columns on documents; problem_context is a string, the rest JSON text
+ANALYSIS_FIELDS = (
+    "problem_context",
+    "key_points",
+    "risk_flags",
+    "key_concepts",
+    "swot_analysis",
+    "recommendations",
+    "impact",
+)
+
+SWOT_KEYS = ("strengths", "weaknesses", "opportunities", "threats")
+
+
+@dataclass
+class DocumentPayload:
+    document_text: str
+    # shape_analysis() output
+    analysis: Dict[str, Any] = field(default_factory=dict)
+
+
+def compress(data: bytes, codec: str = DOCUMENT_COMPRESSION) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required for zstd compression (pip install zstandard)")
+        return zstandard.ZstdCompressor(level=DOCUMENT_COMPRESSION_LEVEL).compress(data)
+    return gzip.compress(data, compresslevel=DOCUMENT_COMPRESSION_LEVEL)
+
+
+def decompress(data: Optional[bytes], codec: str) -> bytes:
+    if not data:
+        return b""
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd-compressed documents (pip install zstandard)")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def _generated_impact(key_points: List, risk_flags: List) -> Dict[str, List]:
+    """Impact analysis for documents analyzed before it existed, derived from key points and risks.
+    Entries are placeholders for display, marked "generated" so insights and rollups do not count them."""
+    insights_impact = []
+    risks_impact = []
+
+    for point in key_points[:3]:  # Limit to first 3 for performance
+        point_text = point.get("text", "") if isinstance(point, dict) else point if isinstance(point, str) else ""
+        if point_text:
+            insights_impact.append({
+                "insight_point": point_text[:100] + "..." if len(point_text) > 100 else point_text,
+                "impact_description": "This insight could have significant implications for business operations and decision-making processes",
+                "impacted_organization": "Business Operations Team",
+                "affected_areas": ["Operations", "Strategy", "Decision Making"],
+                "impact_level": "medium",
+                "timeline": "medium-term",
+                "action_required": "Review and incorporate this insight into relevant business processes and strategic planning",
+                "generated": True
+            })
+
+    for risk in risk_flags[:3]:  # Limit to first 3 for performance
+        risk_text = risk.get("text", "") if isinstance(risk, dict) else risk if isinstance(risk, str) else ""
+        if risk_text:
+            # Remove emoji from risk text for cleaner display
+            clean_risk_text = risk_text.replace("🚩", "").strip()
+            risks_impact.append({
+                "risk_point": clean_risk_text[:100] + "..." if len(clean_risk_text) > 100 else clean_risk_text,
+                "impact_description": "If this risk materializes, it could negatively affect operations and require immediate attention",
+                "impacted_organization": "Operations and Management Team",
+                "affected_areas": ["Operations", "Risk Management", "Compliance"],
+                "impact_level": "medium",
+                "timeline": "short-term",
+                "action_required": "Implement risk mitigation strategies and monitor for potential issues",
+                "generated": True
+            })
+
+    return {"insights_impact": insights_impact, "risks_impact": risks_impact}
+
+
+def shape_analysis(values: Dict[str, Any]) -> Dict[str, Any]:
+    """Analysis fields in exactly the shape the API returns them"""
+    def of_type(key, default):
+        value = values.get(key)
+        return value if isinstance(value, type(default)) else default
+
+    key_points = of_type("key_points", [])
+    risk_flags = of_type("risk_flags", [])
+    swot = of_type("swot_analysis", {})
+    impact = of_type("impact_analysis", {})
+    impact_analysis = {
+        "insights_impact": impact.get("insights_impact", []),
+        "risks_impact": impact.get("risks_impact", [])
+    }
+    if not impact_analysis["insights_impact"] and not impact_analysis["risks_impact"]:
+        impact_analysis = _generated_impact(key_points, risk_flags)
+
+    return {
+        "problem_context": values.get("problem_context") if isinstance(values.get("problem_context"), str) else None,
+        "key_points": key_points,
+        "risk_flags": risk_flags,
+        "key_concepts": of_type("key_concepts", []),
+        "swot_analysis": {key: swot.get(key, []) for key in SWOT_KEYS},
+        "recommendations": of_type("recommendations", {}),
+        "impact_analysis": impact_analysis,
+    }
+
+
+def build_content(document_id: uuid.UUID, text: str, analysis: Dict[str, Any]) -> DocumentContent:
+    """document_contents row; analysis must already be shaped"""
+    codec = DOCUMENT_COMPRESSION
+    text_data = compress((text or "").encode("utf-8"), codec)
+    return DocumentContent(
+        document_id=document_id,
+        codec=codec,
+        text_data=text_data,
+        analysis=analysis,
+        text_length=len(text or ""),
+        stored_bytes=len(text_data) + len(orjson.dumps(analysis)),
+    )
+
+
+def add_payload(db: AsyncSession, document: Document, text: str, analysis: Dict[str, Any]):
+    """Attach the text and analysis result of a new document; committed with the document"""
+    if document.id is None:
+        document.id = uuid.uuid4()
+    db.add(document)
+    db.add(build_content(document.id, text, shape_analysis(analysis)))
+
+
+def _legacy_values(row) -> Dict[str, Any]:
+    values = {"problem_context": row.problem_context}
+    for column in ANALYSIS_FIELDS[1:]:
+        key = "impact_analysis" if column == "impact" else column
+        try:
+            values[key] = json.loads(getattr(row, column)) if getattr(row, column) else None
+        except (json.JSONDecodeError, TypeError):
+            values[key] = None
+    return values
+
+
+def _payload_query(document_id: uuid.UUID, *columns):
+    return (
+        select(
+            DocumentContent.codec,
+            DocumentContent.text_data,
+            *columns,
+            Document.document_text,
+            Document.summary,
+            *(getattr(Document, column) for column in ANALYSIS_FIELDS)
+        )
+        .select_from(Document)
+        .outerjoin(DocumentContent, DocumentContent.document_id == Document.id)
+        .where(Document.id == document_id)
+    )
+
+
+def _text(row) -> str:
+    if row.codec is not None:
+        return decompress(row.text_data, row.codec).decode("utf-8")
+    return row.document_text or ""
+
+
+async def load_payload(db: AsyncSession, document_id: uuid.UUID) -> DocumentPayload:
+    """Text and shaped analysis of a document, from document_contents or the legacy inline columns"""
+    row = (await db.execute(_payload_query(document_id, DocumentContent.analysis))).first()
+    if row is None:
+        return DocumentPayload(document_text="", analysis=shape_analysis({}))
+    if row.codec is not None:
+        return DocumentPayload(document_text=_text(row), analysis=row.analysis or shape_analysis({}))
+    # Not backfilled yet: inline columns
+    return DocumentPayload(document_text=_text(row), analysis=shape_analysis(_legacy_values(row)))
+
+
+async def load_analysis(db: AsyncSession, document_id: uuid.UUID) -> Dict[str, Any]:
+    """Shaped analysis of a document, without reading its text"""
+    row = (await db.execute(
+        select(DocumentContent.codec, DocumentContent.analysis, *(getattr(Document, column) for column in ANALYSIS_FIELDS))
+        .select_from(Document)
+        .outerjoin(DocumentContent, DocumentContent.document_id == Document.id)
+        .where(Document.id == document_id)
+    )).first()
+    if row is None:
+        return shape_analysis({})
+    if row.codec is not None:
+        return row.analysis or shape_analysis({})
+    return shape_analysis(_legacy_values(row))
+
+
+async def load_analysis_json(db: AsyncSession, document_id: uuid.UUID) -> Tuple[str, bytes]:
+    """Document text and the analysis (with summary) as JSON bytes, rendered by Postgres"""
+    analysis_json = cast(
+        func.jsonb_build_object(literal_column("'summary'"), Document.summary).op("||")(DocumentContent.analysis),
+        Text
+    ).label("analysis_json")
+    row = (await db.execute(_payload_query(document_id, analysis_json))).first()
+    if row is not None and row.codec is not None and row.analysis_json is not None:
+        return _text(row), row.analysis_json.encode("utf-8")
+
+    if row is None:
+        return "", orjson.dumps({"summary": None, **shape_analysis({})})
+    # Not backfilled yet (inline columns), or a content row without analysis (analysis_json is NULL then)
+    analysis = shape_analysis(_legacy_values(row)) if row.codec is None else shape_analysis({})
+    return _text(row), orjson.dumps({"summary": row.summary, **analysis})
+
+
+def legacy_payload_row(document_row) -> Tuple[DocumentContent, int]:
+    """document_contents row for a not-yet-backfilled document; returns it with its inline size"""
+    content = build_content(
+        document_row.id, document_row.document_text or "", shape_analysis(_legacy_values(document_row))
+    )
+    inline_bytes = sum(
+        len((getattr(document_row, column) or "").encode("utf-8"))
+        for column in ("document_text",) + ANALYSIS_FIELDS
+    )
+    return content, inline_bytes
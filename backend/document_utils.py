@@ -5,47 +5,18 @@ from typing import Dict, List
 import pdfplumber
 from docx import Document
 from fastapi import HTTPException
-import anthropic
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
-# Anthropic configuration
-anthropic_api_key = os.getenv("ANTHROPIC_API_KEY")
+from llm_router import provider_router, TASK_ANALYSIS, TASK_CHUNK_ANALYSIS
 
-# Initialize Anthropic client with better error handling
-client = None
-if anthropic_api_key:
-    try:
-        # Try basic initialization first
-        import anthropic
-        client = anthropic.Anthropic(api_key=anthropic_api_key)
-        print("✅ Anthropic client initialized successfully")
-    except TypeError as e:
-        if "proxies" in str(e):
-            print(f"⚠️  Anthropic client proxy error, trying alternative initialization: {e}")
-            try:
-                # Alternative: Try initializing with minimal parameters
-                import httpx
-                http_client = httpx.Client()
-                client = anthropic.Anthropic(
-                    api_key=anthropic_api_key,
-                    http_client=http_client
-                )
-                print("✅ Anthropic client initialized with custom http client")
-            except Exception as e2:
-                print(f"❌ Alternative Anthropic initialization also failed: {e2}")
-                client = None
-        else:
-            print(f"❌ Anthropic client initialization failed: {e}")
-            client = None
-    except Exception as e:
-        print(f"❌ Anthropic client initialization failed: {e}")
-        client = None
-else:
-    print("⚠️  ANTHROPIC_API_KEY not found in environment variables")
-    client = None
+# Per analysis call: document characters sent, instructions/JSON template around them
+# (the first-attempt prompt, ~10k characters), and the response cap
+ANALYSIS_INPUT_CHARS = 8000
+ANALYSIS_PROMPT_TOKENS = 3000
+ANALYSIS_MAX_TOKENS = 4000
 
 def count_words(text: str) -> int:
     """Count words in text"""
@@ -168,10 +139,10 @@ def extract_text_from_docx(file_bytes: bytes) -> str:
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error reading DOCX: {str(e)}")
 
-async def analyze_document_with_claude(text: str, retry_count: int = 0) -> dict:
-    """Send text to Anthropic Claude for analysis"""
-    if not client:
-        raise HTTPException(status_code=500, detail="Anthropic API key not configured")
+async def analyze_document_with_claude(text: str, retry_count: int = 0, task: str = TASK_ANALYSIS) -> dict:
+    """Send text to the LLM provider router for analysis"""
+    if not provider_router.has_providers(task):
+        raise HTTPException(status_code=500, detail="No LLM provider configured")
     
     # Adjust prompt based on retry count
     if retry_count == 0:
@@ -411,7 +382,7 @@ Use this exact JSON structure:
 }}
 
 Document text:
-{text[:8000]}"""
+{text[:ANALYSIS_INPUT_CHARS]}"""
     else:
         # Simplified prompt for retry - still enforce 3-5 items per category
         prompt = f"""Analyze this document and return ONLY valid JSON. 
@@ -476,17 +447,15 @@ IMPORTANT: Each SWOT category MUST have 3-5 items (minimum 3, maximum 5).
 Document: {text[:4000]}"""
     
     try:
-        response = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=4000,  # Increased for impact analysis
-            temperature=0.3,
-            messages=[
-                {"role": "user", "content": prompt}
-            ]
+        response = await provider_router.complete(
+            task,
+            prompt,
+            max_tokens=ANALYSIS_MAX_TOKENS,  # Increased for impact analysis
+            temperature=0.3
         )
         
         # Get the raw response content
-        content = response.content[0].text.strip()
+        content = response.text.strip()
         
         # Try to find and extract JSON from the response
         json_start = content.find('{')
@@ -538,7 +507,7 @@ Document: {text[:4000]}"""
             return get_fallback_response_with_minimum_swot()
         
         # If this is the first attempt, try again with a simpler prompt
-        return await analyze_document_with_claude(text, retry_count + 1)
+        return await analyze_document_with_claude(text, retry_count + 1, task)
 
 
 def ensure_minimum_swot_items(swot_analysis: dict) -> dict:
@@ -631,6 +600,16 @@ def get_fallback_response_with_minimum_swot() -> dict:
         }
     }
 
+def analysis_token_budget(text: str) -> int:
+    """Most tokens analyze_document_with_chunking can use on text: every model call's prompt plus its full response"""
+    chunks = split_text_into_chunks(text) if should_chunk_document(text) else []
+    if len(chunks) <= 1:
+        chunks = [text]
+    return sum(
+        ANALYSIS_PROMPT_TOKENS + len(chunk[:ANALYSIS_INPUT_CHARS]) // 4 + ANALYSIS_MAX_TOKENS
+        for chunk in chunks
+    )
+
 async def analyze_document_with_chunking(text: str, enable_synthesis: bool = True) -> dict:
     """
     Analyze a document with automatic chunking for long documents.
@@ -647,11 +626,11 @@ async def analyze_document_with_chunking(text: str, enable_synthesis: bool = Tru
     if len(chunks) == 1:
         return await analyze_document_with_claude(text)
     
-    # Analyze each chunk
+    # Analyze each chunk (per-chunk pre-analysis is routed to cheaper models)
     chunk_analyses = []
     for i, chunk in enumerate(chunks):
         try:
-            analysis = await analyze_document_with_claude(chunk)
+            analysis = await analyze_document_with_claude(chunk, task=TASK_CHUNK_ANALYSIS)
             chunk_analyses.append(analysis)
         except Exception as e:
             # Continue with other chunks
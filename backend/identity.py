@@ -0,0 +1,169 @@
+"""
+Authenticated identity: a per-request identity context plus a short-TTL process cache
+of user principals.
+
+Token claims are verified at most once per request (request_claims), on top of the
+process-wide verified-claims cache in auth_backend.
+
+A principal is the small, read-mostly slice of a user that middleware needs (id, plan,
+is_active, timezone, last IP). The auth dependencies do the one users-table lookup per
+request and record the result on the request; the auto-refresh and timezone middleware
+read principals instead of querying the table again.
+
+Cached principals are invalidated whenever a flushed User changes one of those fields
+(plan changes in stripe_routes, email activation, timezone updates) or is deleted.
+Changes made by another process, such as subscription_checker, are bounded by the TTL.
+"""
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Union
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from starlette.types import Scope
+
+from auth_backend import verify_token
+from models import User, UserPlan
+
+logger = logging.getLogger(__name__)
+
+USER_PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("USER_PRINCIPAL_CACHE_TTL_SECONDS", "60"))
+USER_PRINCIPAL_CACHE_SIZE = int(os.getenv("USER_PRINCIPAL_CACHE_SIZE", "10000"))
+
+IDENTITY_SCOPE_KEY = "digestgpt.identity"
+PRINCIPAL_FIELDS = ("plan", "is_active", "timezone", "last_ip_address")
+
+
+@dataclass(frozen=True)
+class UserPrincipal:
+    id: uuid.UUID
+    plan: UserPlan
+    is_active: bool
+    timezone: Optional[str]
+    last_ip_address: Optional[str]
+
+    @classmethod
+    def from_user(cls, user: User) -> "UserPrincipal":
+        return cls(
+            id=user.id,
+            plan=user.plan,
+            is_active=bool(user.is_active),
+            timezone=user.timezone,
+            last_ip_address=user.last_ip_address,
+        )
+
+
+class PrincipalCache:
+    """Bounded LRU of principals with a fixed TTL"""
+
+    def __init__(self, ttl: float = USER_PRINCIPAL_CACHE_TTL_SECONDS, maxsize: int = USER_PRINCIPAL_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: Union[str, uuid.UUID]) -> Optional[UserPrincipal]:
+        key = str(user_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            principal, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return principal
+
+    def put(self, principal: UserPrincipal):
+        if self.ttl <= 0:
+            return
+        key = str(principal.id)
+        with self._lock:
+            self._entries[key] = (principal, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: Union[str, uuid.UUID]):
+        with self._lock:
+            self._entries.pop(str(user_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+principal_cache = PrincipalCache()
+
+
+def request_identity(scope: Scope) -> dict:
+    """Per-request identity context, shared by the dependencies and inner middleware"""
+    return scope.setdefault(IDENTITY_SCOPE_KEY, {})
+
+
+def request_claims(scope: Scope, token: Optional[str], token_type: str = "access") -> Optional[dict]:
+    """
+    Verified claims for a token, resolved once per request and shared by the
+    middleware and the auth dependencies
+    """
+    if not token:
+        return None
+    resolved = request_identity(scope).setdefault("claims", {})
+    key = (token_type, token)
+    if key not in resolved:
+        resolved[key] = verify_token(token, token_type=token_type)
+    return resolved[key]
+
+
+def remember_user(scope: Scope, user: User):
+    """Record the user resolved for this request and refresh its cached principal"""
+    principal = UserPrincipal.from_user(user)
+    identity = request_identity(scope)
+    identity["user_id"] = str(user.id)
+    identity["principal"] = principal
+    principal_cache.put(principal)
+
+
+async def resolve_user(scope: Scope, db: AsyncSession, user_id: Union[str, uuid.UUID]) -> Optional[User]:
+    """The request's user, loaded at most once per request"""
+    identity = request_identity(scope)
+    user = identity.get("user")
+    if user is not None and str(user.id) == str(user_id):
+        return user
+
+    user = await db.scalar(select(User).where(User.id == user_id))
+    if user is not None:
+        remember_user(scope, user)
+        identity["user"] = user
+    return user
+
+
+async def load_principal(db: AsyncSession, user_id: Union[str, uuid.UUID]) -> Optional[UserPrincipal]:
+    """Principal from the cache, falling back to one users-table query"""
+    principal = principal_cache.get(user_id)
+    if principal is not None:
+        return principal
+
+    user = await db.scalar(select(User).where(User.id == user_id))
+    if user is None:
+        return None
+    principal = UserPrincipal.from_user(user)
+    principal_cache.put(principal)
+    return principal
+
+
+@event.listens_for(Session, "after_flush")
+def _invalidate_changed_principals(session, flush_context):
+    for user in list(session.dirty) + list(session.deleted):
+        if not isinstance(user, User):
+            continue
+        state = inspect(user)
+        if user in session.deleted or any(state.attrs[field].history.has_changes() for field in PRINCIPAL_FIELDS):
+            principal_cache.invalidate(user.id)
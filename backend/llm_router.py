@@ -0,0 +1,486 @@
+"""
+Provider router for LLM calls.
+
+Every model call in the app goes through `provider_router.complete(task, prompt)`.
+Each task maps to an ordered list of (provider, model) candidates. The router keeps
+rolling latency/error statistics per provider+model, demotes unhealthy candidates,
+hedges to the next candidate when the current one runs past its p95 latency and
+fails over immediately on errors.
+
+Routes can be overridden per task with env vars, e.g.
+    LLM_ROUTE_CHAT="anthropic:claude-sonnet-4-20250514,openrouter:google/gemini-2.5-pro"
+
+Set LLM_MOCK_PROVIDERS=true to run against local mock providers (no network).
+
+Provider-reported token usage of every successful call is added to the current
+`track_llm_usage()` tally, if any, so callers can bill the tokens actually sent and
+received without threading responses through every helper.
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Task names used by callers
+TASK_ANALYSIS = "analysis"            # Full single-document analysis
+TASK_CHUNK_ANALYSIS = "chunk_analysis"  # Per-chunk pre-analysis of long documents (cheap)
+TASK_CHAT = "chat"                    # Chat about a document
+TASK_CASUAL = "casual"                # Casual Q&A (cheap)
+TASK_SUMMARY = "summary"              # Rolling summaries of chat conversations (cheap)
+
+# Default routes: first entry is the primary, the rest are hedge/failover targets
+DEFAULT_ROUTES: Dict[str, List[Tuple[str, str]]] = {
+    TASK_ANALYSIS: [
+        ("anthropic", "claude-sonnet-4-20250514"),
+        ("openrouter", "anthropic/claude-sonnet-4"),
+    ],
+    TASK_CHUNK_ANALYSIS: [
+        ("anthropic", "claude-3-5-haiku-20241022"),
+        ("openrouter", "google/gemini-2.5-flash"),
+        ("anthropic", "claude-sonnet-4-20250514"),
+    ],
+    TASK_CHAT: [
+        ("anthropic", "claude-sonnet-4-20250514"),
+        ("openrouter", "google/gemini-2.5-pro"),
+    ],
+    TASK_CASUAL: [
+        ("openrouter", "google/gemini-2.5-flash"),
+        ("anthropic", "claude-3-5-haiku-20241022"),
+    ],
+    TASK_SUMMARY: [
+        ("anthropic", "claude-3-5-haiku-20241022"),
+        ("openrouter", "google/gemini-2.5-flash"),
+    ],
+}
+
+# Hedging / health configuration
+HEDGE_DEFAULT_SECONDS = float(os.getenv("LLM_HEDGE_DEFAULT_SECONDS", "30"))
+HEDGE_MIN_SECONDS = float(os.getenv("LLM_HEDGE_MIN_SECONDS", "2"))
+HEDGE_MAX_SECONDS = float(os.getenv("LLM_HEDGE_MAX_SECONDS", "60"))
+ATTEMPT_TIMEOUT_SECONDS = float(os.getenv("LLM_ATTEMPT_TIMEOUT_SECONDS", "120"))
+STATS_WINDOW = int(os.getenv("LLM_STATS_WINDOW", "200"))
+STATS_MIN_SAMPLES = int(os.getenv("LLM_STATS_MIN_SAMPLES", "10"))
+UNHEALTHY_ERROR_RATE = float(os.getenv("LLM_UNHEALTHY_ERROR_RATE", "0.5"))
+
+
+class LLMProviderError(Exception):
+    """Raised when no provider could serve a request"""
+
+
+@dataclass
+class LLMResponse:
+    """Normalized result of a model call"""
+    text: str
+    provider: str
+    model: str
+    input_tokens: int = 0
+    output_tokens: int = 0
+    latency: float = 0.0
+
+
+@dataclass
+class LLMCallUsage:
+    """Provider-reported usage of one model call"""
+    task: str
+    provider: str
+    model: str
+    input_tokens: int
+    output_tokens: int
+
+
+@dataclass
+class LLMUsageTally:
+    """Usage of all model calls made inside one track_llm_usage() block"""
+    calls: List[LLMCallUsage] = field(default_factory=list)
+
+    def add(self, task: str, response: LLMResponse):
+        self.calls.append(LLMCallUsage(
+            task=task,
+            provider=response.provider,
+            model=response.model,
+            input_tokens=response.input_tokens,
+            output_tokens=response.output_tokens,
+        ))
+
+    @property
+    def input_tokens(self) -> int:
+        return sum(call.input_tokens for call in self.calls)
+
+    @property
+    def output_tokens(self) -> int:
+        return sum(call.output_tokens for call in self.calls)
+
+    @property
+    def total_tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+
+_usage_tally: ContextVar[Optional[LLMUsageTally]] = ContextVar("llm_usage_tally", default=None)
+
+
+@contextmanager
+def track_llm_usage() -> Iterator[LLMUsageTally]:
+    """Collect provider-reported usage of the model calls made inside the block"""
+    tally = LLMUsageTally()
+    token = _usage_tally.set(tally)
+    try:
+        yield tally
+    finally:
+        _usage_tally.reset(token)
+
+
+@dataclass
+class LatencyStats:
+    """Rolling window of (latency, ok) samples for one provider+model"""
+    window: int = STATS_WINDOW
+    samples: deque = field(default_factory=deque)
+
+    def record(self, latency: float, ok: bool):
+        self.samples.append((latency, ok))
+        while len(self.samples) > self.window:
+            self.samples.popleft()
+
+    def _percentile(self, pct: float) -> Optional[float]:
+        latencies = sorted(latency for latency, ok in self.samples if ok)
+        if not latencies:
+            return None
+        index = min(len(latencies) - 1, int(round(pct * (len(latencies) - 1))))
+        return latencies[index]
+
+    @property
+    def count(self) -> int:
+        return len(self.samples)
+
+    @property
+    def p50(self) -> Optional[float]:
+        return self._percentile(0.50)
+
+    @property
+    def p95(self) -> Optional[float]:
+        return self._percentile(0.95)
+
+    @property
+    def error_rate(self) -> float:
+        if not self.samples:
+            return 0.0
+        return sum(1 for _, ok in self.samples if not ok) / len(self.samples)
+
+    def snapshot(self) -> dict:
+        return {
+            "samples": self.count,
+            "p50": self.p50,
+            "p95": self.p95,
+            "error_rate": round(self.error_rate, 4),
+        }
+
+
+class BaseProvider:
+    """A single upstream LLM API"""
+    name = "base"
+
+    def is_configured(self) -> bool:
+        return True
+
+    async def complete(self, model: str, prompt: str, max_tokens: int, temperature: float) -> LLMResponse:
+        raise NotImplementedError
+
+
+class AnthropicProvider(BaseProvider):
+    name = "anthropic"
+
+    def __init__(self, api_key: Optional[str] = None):
+        self.client = None
+        api_key = api_key or os.getenv("ANTHROPIC_API_KEY")
+        if not api_key:
+            logger.warning("⚠️  ANTHROPIC_API_KEY not found, anthropic provider disabled")
+            return
+        try:
+            import anthropic
+            try:
+                self.client = anthropic.AsyncAnthropic(api_key=api_key)
+            except TypeError as e:
+                if "proxies" not in str(e):
+                    raise
+                # Same proxy workaround as the sync client: pass our own http client
+                import httpx
+                self.client = anthropic.AsyncAnthropic(api_key=api_key, http_client=httpx.AsyncClient())
+            logger.info("✅ Anthropic provider initialized")
+        except Exception as e:
+            logger.error(f"❌ Anthropic provider initialization failed: {e}")
+            self.client = None
+
+    def is_configured(self) -> bool:
+        return self.client is not None
+
+    async def complete(self, model: str, prompt: str, max_tokens: int, temperature: float) -> LLMResponse:
+        response = await self.client.messages.create(
+            model=model,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            messages=[{"role": "user", "content": prompt}],
+        )
+        usage = getattr(response, "usage", None)
+        return LLMResponse(
+            text=response.content[0].text,
+            provider=self.name,
+            model=model,
+            input_tokens=getattr(usage, "input_tokens", 0) or 0,
+            output_tokens=getattr(usage, "output_tokens", 0) or 0,
+        )
+
+
+class OpenRouterProvider(BaseProvider):
+    name = "openrouter"
+
+    def __init__(self, api_key: Optional[str] = None):
+        self.client = None
+        api_key = api_key or os.getenv("OPENROUTER_API_KEY")
+        if not api_key:
+            logger.warning("⚠️  OPENROUTER_API_KEY not found, openrouter provider disabled")
+            return
+        try:
+            from openai import AsyncOpenAI
+            self.client = AsyncOpenAI(base_url="https://openrouter.ai/api/v1", api_key=api_key)
+            logger.info("✅ OpenRouter provider initialized")
+        except Exception as e:
+            logger.error(f"❌ OpenRouter provider initialization failed: {e}")
+            self.client = None
+
+    def is_configured(self) -> bool:
+        return self.client is not None
+
+    async def complete(self, model: str, prompt: str, max_tokens: int, temperature: float) -> LLMResponse:
+        response = await self.client.chat.completions.create(
+            model=model,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            messages=[{"role": "user", "content": [{"type": "text", "text": prompt}]}],
+        )
+        usage = getattr(response, "usage", None)
+        return LLMResponse(
+            text=response.choices[0].message.content or "",
+            provider=self.name,
+            model=model,
+            input_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+            output_tokens=getattr(usage, "completion_tokens", 0) or 0,
+        )
+
+
+class MockProvider(BaseProvider):
+    """
+    Local provider for offline benchmarking and development.
+    Latency is drawn from a log-normal around `median_latency`; a fraction of calls are
+    "slow" (tail_multiplier x) and a fraction fail outright.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        median_latency: float = 0.05,
+        tail_probability: float = 0.05,
+        tail_multiplier: float = 10.0,
+        error_rate: float = 0.0,
+        response_text: str = "Mock response.",
+        seed: Optional[int] = None,
+    ):
+        self.name = name
+        self.median_latency = median_latency
+        self.tail_probability = tail_probability
+        self.tail_multiplier = tail_multiplier
+        self.error_rate = error_rate
+        self.response_text = response_text
+        self.calls = 0
+        self._random = random.Random(seed)
+
+    async def complete(self, model: str, prompt: str, max_tokens: int, temperature: float) -> LLMResponse:
+        self.calls += 1
+        latency = self.median_latency * self._random.lognormvariate(0, 0.25)
+        if self._random.random() < self.tail_probability:
+            latency *= self.tail_multiplier
+        await asyncio.sleep(latency)
+        if self._random.random() < self.error_rate:
+            raise LLMProviderError(f"{self.name} mock failure")
+        return LLMResponse(
+            text=self.response_text,
+            provider=self.name,
+            model=model,
+            input_tokens=len(prompt) // 4,
+            output_tokens=len(self.response_text) // 4,
+        )
+
+
+def _parse_route(value: str) -> List[Tuple[str, str]]:
+    """Parse 'provider:model,provider:model' into a route list"""
+    route = []
+    for item in value.split(","):
+        item = item.strip()
+        if not item or ":" not in item:
+            continue
+        provider, model = item.split(":", 1)
+        route.append((provider.strip(), model.strip()))
+    return route
+
+
+class ProviderRouter:
+    def __init__(self, providers: Dict[str, BaseProvider], routes: Optional[Dict[str, List[Tuple[str, str]]]] = None):
+        self.providers = providers
+        self.routes = {task: list(route) for task, route in (routes or DEFAULT_ROUTES).items()}
+        for task in list(self.routes):
+            override = os.getenv(f"LLM_ROUTE_{task.upper()}")
+            if override:
+                parsed = _parse_route(override)
+                if parsed:
+                    self.routes[task] = parsed
+        self.stats: Dict[Tuple[str, str], LatencyStats] = {}
+
+    def has_providers(self, task: Optional[str] = None) -> bool:
+        """True if at least one configured provider can serve the task (or any task)"""
+        if task is None:
+            return any(provider.is_configured() for provider in self.providers.values())
+        return bool(self._candidates(task))
+
+    def _stats_for(self, provider: str, model: str) -> LatencyStats:
+        key = (provider, model)
+        if key not in self.stats:
+            self.stats[key] = LatencyStats()
+        return self.stats[key]
+
+    def _is_healthy(self, provider: str, model: str) -> bool:
+        stats = self.stats.get((provider, model))
+        if not stats or stats.count < STATS_MIN_SAMPLES:
+            return True
+        return stats.error_rate < UNHEALTHY_ERROR_RATE
+
+    def _candidates(self, task: str) -> List[Tuple[str, str]]:
+        """Configured candidates for a task, healthy ones first (route order preserved)"""
+        route = self.routes.get(task) or self.routes[TASK_CHAT]
+        configured = [
+            (provider, model) for provider, model in route
+            if provider in self.providers and self.providers[provider].is_configured()
+        ]
+        healthy = [c for c in configured if self._is_healthy(*c)]
+        unhealthy = [c for c in configured if c not in healthy]
+        return healthy + unhealthy
+
+    def _hedge_delay(self, provider: str, model: str) -> float:
+        """How long to wait on a candidate before starting the next one"""
+        stats = self.stats.get((provider, model))
+        if not stats or stats.count < STATS_MIN_SAMPLES or stats.p95 is None:
+            return HEDGE_DEFAULT_SECONDS
+        return min(HEDGE_MAX_SECONDS, max(HEDGE_MIN_SECONDS, stats.p95))
+
+    async def _attempt(self, provider: str, model: str, prompt: str, max_tokens: int, temperature: float) -> LLMResponse:
+        started = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(
+                self.providers[provider].complete(model, prompt, max_tokens, temperature),
+                timeout=ATTEMPT_TIMEOUT_SECONDS,
+            )
+        except asyncio.CancelledError:
+            # Lost a hedge race; not a provider failure
+            raise
+        except Exception:
+            self._stats_for(provider, model).record(time.perf_counter() - started, ok=False)
+            raise
+        response.latency = time.perf_counter() - started
+        self._stats_for(provider, model).record(response.latency, ok=True)
+        return response
+
+    async def complete(
+        self,
+        task: str,
+        prompt: str,
+        max_tokens: int = 1000,
+        temperature: float = 0.3,
+        hedge: bool = True,
+    ) -> LLMResponse:
+        """
+        Run a prompt for a task. Starts the first candidate; if it has not answered
+        within its hedge delay the next candidate is started as well and the first
+        successful answer wins. Errors fail over to the next candidate immediately.
+        """
+        candidates = self._candidates(task)
+        if not candidates:
+            raise LLMProviderError(f"No LLM provider configured for task '{task}'")
+
+        pending = set()
+        errors = []
+        next_index = 0
+
+        def launch():
+            nonlocal next_index
+            provider, model = candidates[next_index]
+            next_index += 1
+            pending.add(asyncio.ensure_future(
+                self._attempt(provider, model, prompt, max_tokens, temperature)
+            ))
+
+        launch()
+        try:
+            while pending:
+                timeout = None
+                if hedge and next_index < len(candidates):
+                    timeout = self._hedge_delay(*candidates[next_index - 1])
+
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    logger.info(f"⏱️ LLM hedge for task '{task}': starting {candidates[next_index]}")
+                    launch()
+                    continue
+
+                for finished in done:
+                    pending.discard(finished)
+                    if finished.exception() is None:
+                        response = finished.result()
+                        tally = _usage_tally.get()
+                        if tally is not None:
+                            tally.add(task, response)
+                        return response
+                    errors.append(finished.exception())
+                    logger.warning(f"⚠️ LLM attempt failed for task '{task}': {finished.exception()}")
+
+                if not pending and next_index < len(candidates):
+                    launch()
+        finally:
+            for attempt in pending:
+                attempt.cancel()
+
+        raise LLMProviderError(f"All LLM providers failed for task '{task}': {errors[-1] if errors else 'unknown error'}")
+
+    def snapshot(self) -> dict:
+        """Rolling latency/error statistics per provider and model"""
+        return {
+            f"{provider}:{model}": stats.snapshot()
+            for (provider, model), stats in self.stats.items()
+        }
+
+
+def build_default_router() -> ProviderRouter:
+    if os.getenv("LLM_MOCK_PROVIDERS", "false").lower() == "true":
+        providers = {
+            "anthropic": MockProvider("anthropic", median_latency=0.05),
+            "openrouter": MockProvider("openrouter", median_latency=0.03),
+        }
+    else:
+        providers = {
+            "anthropic": AnthropicProvider(),
+            "openrouter": OpenRouterProvider(),
+        }
+    return ProviderRouter(providers)
+
+
+# Global provider router instance
+provider_router = build_default_router()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Load test: sync Session inside async routes vs AsyncSession.
+
+Runs the document-listing query (page of documents + total count) behind two routes
+served by one uvicorn worker:
+
+    /sync   - the old pattern: `async def` route using the psycopg2 Session, so every
+              query blocks the event loop
+    /async  - the current pattern: AsyncSession on asyncpg
+
+Keep --concurrency below DB_POOL_SIZE + DB_MAX_OVERFLOW to get numbers for /sync at
+all: above it the blocked loop cannot run the threadpool teardown that returns
+connections, so checkouts stall until the 30 s pool timeout and requests fail.
+
+Needs a reachable Postgres configured through the usual DB_* variables (set
+DB_SSLMODE=disable for a local server). Seeds a throwaway user with documents and
+removes it afterwards. --db-latency-ms adds a server-side pg_sleep per request to
+approximate the round trip to a hosted database.
+
+Usage:
+    python loadtest_async_db.py --requests 2000 --concurrency 10 --db-latency-ms 5
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+import uuid
+
+# Add the backend directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi import Depends, FastAPI
+from sqlalchemy import func, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, get_async_db, get_db
+from models import Document, User
+
+LOADTEST_USER_ID = os.getenv("LOADTEST_USER_ID")
+DB_LATENCY_SECONDS = float(os.getenv("LOADTEST_DB_LATENCY_MS", "0")) / 1000
+
+app = FastAPI()
+
+
+@app.get("/sync")
+async def list_documents_sync(db: Session = Depends(get_db)):
+    if DB_LATENCY_SECONDS:
+        db.execute(text("SELECT pg_sleep(:s)"), {"s": DB_LATENCY_SECONDS})
+    documents = (
+        db.query(Document)
+        .filter(Document.user_id == LOADTEST_USER_ID)
+        .order_by(Document.uploaded_at.desc())
+        .limit(10)
+        .all()
+    )
+    total = db.query(Document).filter(Document.user_id == LOADTEST_USER_ID).count()
+    return {"documents": len(documents), "total": total}
+
+
+@app.get("/async")
+async def list_documents_async(db: AsyncSession = Depends(get_async_db)):
+    if DB_LATENCY_SECONDS:
+        await db.execute(text("SELECT pg_sleep(:s)"), {"s": DB_LATENCY_SECONDS})
+    documents = (await db.scalars(
+        select(Document)
+        .where(Document.user_id == LOADTEST_USER_ID)
+        .order_by(Document.uploaded_at.desc())
+        .limit(10)
+    )).all()
+    total = await db.scalar(
+        select(func.count()).select_from(Document).where(Document.user_id == LOADTEST_USER_ID)
+    )
+    return {"documents": len(documents), "total": total}
+
+
+def seed(documents: int) -> uuid.UUID:
+    db = SessionLocal()
+    try:
+        user = User(email=f"loadtest-{uuid.uuid4().hex[:12]}@example.com", name="Load Test", is_active=True)
+        db.add(user)
+        db.flush()
+        db.add_all([
+            Document(user_id=user.id, filename=f"doc-{i}.pdf", summary="Summary " * 50, word_count=500)
+            for i in range(documents)
+        ])
+        db.commit()
+        return user.id
+    finally:
+        db.close()
+
+
+def cleanup(user_id: uuid.UUID):
+    db = SessionLocal()
+    try:
+        db.query(Document).filter(Document.user_id == user_id).delete(synchronize_session=False)
+        db.query(User).filter(User.id == user_id).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(pct * (len(values) - 1))))]
+
+
+async def drive(base_url: str, path: str, total: int, concurrency: int) -> dict:
+    import httpx
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        # Warm up pools on both sides
+        await asyncio.gather(*(client.get(path) for _ in range(concurrency)), return_exceptions=True)
+
+        async def one():
+            nonlocal failures
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await client.get(path)
+                except httpx.HTTPError:
+                    failures += 1
+                    return
+                if response.status_code == 200:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    failures += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "rps": total / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "failures": failures,
+    }
+
+
+def wait_for_server(base_url: str, timeout: float = 20.0):
+    import httpx
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            httpx.get(f"{base_url}/docs", timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError("uvicorn did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--documents", type=int, default=200)
+    parser.add_argument("--db-latency-ms", type=float, default=5.0)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    user_id = seed(args.documents)
+    base_url = f"http://127.0.0.1:{args.port}"
+    env = dict(os.environ, LOADTEST_USER_ID=str(user_id), LOADTEST_DB_LATENCY_MS=str(args.db_latency_ms))
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "loadtest_async_db:app", "--port", str(args.port), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_server(base_url)
+        results = {
+            "sync Session (before)": asyncio.run(drive(base_url, "/sync", args.requests, args.concurrency)),
+            "AsyncSession (after)": asyncio.run(drive(base_url, "/async", args.requests, args.concurrency)),
+        }
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            # A stalled /sync event loop does not handle SIGTERM promptly
+            server.kill()
+        cleanup(user_id)
+
+    print(f"\n{args.requests} requests, concurrency {args.concurrency}, {args.db_latency_ms} ms simulated DB latency")
+    print(f"{'mode':<24}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'failed':>8}")
+    for mode, r in results.items():
+        print(f"{mode:<24}{r['rps']:>10.1f}{r['p50_ms']:>10.1f}{r['p99_ms']:>10.1f}{r['failures']:>8}")
+
+
+if __name__ == "__main__":
+    main()
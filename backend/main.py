@@ -1,5 +1,6 @@
 import os
 import io
+import logging
 import uuid
 import tempfile
 from datetime import datetime, timedelta
@@ -10,14 +11,12 @@ from auth_backend import create_access_token, verify_token
 from dependencies import get_access_token_from_cookie, get_refresh_token_from_cookie
 from fastapi.responses import FileResponse
 from pydantic import BaseModel
-import anthropic
 from dotenv import load_dotenv
 from sqlalchemy import text
-from sqlalchemy.orm import Session
-from database import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db, get_pool_metrics
 from models import Base, User, UserPlan
 from database import engine
-from starlette.middleware.base import BaseHTTPMiddleware
 # Import route modules
 from routes.auth import router as auth_router
 from routes.documents import router as documents_router
@@ -28,11 +27,22 @@ from routes.stripe_routes import router as stripe_router
 from routes.feedback import router as feedback_router
 from middleware.auth_middleware import AutoTokenRefreshMiddleware
 from middleware.timezone_middleware import TimezoneMiddleware
+from middleware.request_logging import RequestLoggingMiddleware
 from auth_helpers import get_current_user_with_auto_refresh
+from llm_router import provider_router
+from timezone_detector import timezone_detector
+from conversation_state import conversation_summarizer
+from public_shares import share_view_recorder
+from account_deletion import account_deleter
 
 # Load environment variables
 load_dotenv()
 
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s %(message)s",
+)
+
 # Base.metadata.drop_all(bind=engine)
 
 # Create database tables
@@ -44,20 +54,8 @@ app = FastAPI(
     version="2.0.0"
 )
 
-class SimpleTestMiddleware(BaseHTTPMiddleware):
-    """Simple test middleware to see if middleware system is working"""
-    
-    async def dispatch(self, request: Request, call_next):
-        print(f"🧪 SIMPLE MIDDLEWARE START: {request.method} {request.url.path}")
-        print(f"🧪 About to call next middleware (should be AutoTokenRefreshMiddleware)")
-        
-        response = await call_next(request)
-        
-        print(f"🧪 SIMPLE MIDDLEWARE END: {request.url.path}")
-        print(f"🧪 Response from next middleware received")
-        return response
-
-print("🔧 Adding CORS middleware...")
+# Middleware, innermost first (each add_middleware call wraps the stack so far).
+# All layers are pure ASGI: no per-layer task or response-stream wrapping.
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[
@@ -72,58 +70,37 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["Set-Cookie"],
+    expose_headers=["Set-Cookie", "Retry-After"],
 )
 
-
-print("🔧 Adding SimpleTestMiddleware...")
-app.add_middleware(SimpleTestMiddleware)
-
-print("🔧 Adding TimezoneMiddleware...")
 app.add_middleware(TimezoneMiddleware)
 
-print("🔧 Adding AutoTokenRefreshMiddleware...")
-try:
-    app.add_middleware(
-        AutoTokenRefreshMiddleware,
-        excluded_paths=[
-            # "/",
-            "/health",
-            "/docs", 
-            "/redoc",
-            "/openapi.json",
-            "/favicon.ico",
-            "/auth/login",
-            "/auth/register",
-            "/auth/google",
-            "/auth/refresh", 
-            "/auth/logout",
-            "/convert-docx-to-pdf",
-            "/pdf/",
-            "/chat/public-share/",
-            "/debug/test-middleware",
-            "/debug/force-expire-token",
-            "/debug/test-cookie-setting"
-            # NOTE: /debug/protected-simple is NOT excluded
-        ]
-    )
-    print("✅ AutoTokenRefreshMiddleware added successfully")
-except Exception as e:
-    print(f"❌ ERROR adding AutoTokenRefreshMiddleware: {e}")
-    import traceback
-    print(f"❌ Traceback: {traceback.format_exc()}")
-
-print("🔧 Adding security headers middleware...")
-@app.middleware("http")
-async def add_security_headers(request, call_next):
-    print(f"🔒 SECURITY MIDDLEWARE: {request.url.path}")
-    response = await call_next(request)
-    response.headers["Cross-Origin-Opener-Policy"] = "same-origin-allow-popups"
-    response.headers["Cross-Origin-Embedder-Policy"] = "unsafe-none"
-    print(f"🔒 SECURITY MIDDLEWARE COMPLETE: {request.url.path}")
-    return response
+app.add_middleware(
+    AutoTokenRefreshMiddleware,
+    excluded_paths=[
+        # "/",
+        "/health",
+        "/docs", 
+        "/redoc",
+        "/openapi.json",
+        "/favicon.ico",
+        "/auth/login",
+        "/auth/register",
+        "/auth/google",
+        "/auth/refresh", 
+        "/auth/logout",
+        "/convert-docx-to-pdf",
+        "/pdf/",
+        "/chat/public-share/",
+        "/debug/test-middleware",
+        "/debug/force-expire-token",
+        "/debug/test-cookie-setting"
+        # NOTE: /debug/protected-simple is NOT excluded
+    ]
+)
 
-print("🔧 All middleware setup complete!")
+# Outermost: security headers and sampled, structured access logging
+app.add_middleware(RequestLoggingMiddleware)
 
 # Include routers
 app.include_router(auth_router)
@@ -133,41 +110,31 @@ app.include_router(usage_router)
 app.include_router(collections_router)
 app.include_router(stripe_router)   
 app.include_router(feedback_router)
-# Anthropic configuration
-anthropic_api_key = os.getenv("ANTHROPIC_API_KEY")
 
-# Initialize Anthropic client with better error handling
-client = None
-if anthropic_api_key:
-    try:
-        # Try basic initialization first
-        import anthropic
-        client = anthropic.Anthropic(api_key=anthropic_api_key)
-        print("✅ Anthropic client initialized successfully in main.py")
-    except TypeError as e:
-        if "proxies" in str(e):
-            print(f"⚠️  Anthropic client proxy error in main.py, trying alternative initialization: {e}")
-            try:
-                # Alternative: Try initializing with minimal parameters
-                import httpx
-                http_client = httpx.Client()
-                client = anthropic.Anthropic(
-                    api_key=anthropic_api_key,
-                    http_client=http_client
-                )
-                print("✅ Anthropic client initialized with custom http client in main.py")
-            except Exception as e2:
-                print(f"❌ Alternative Anthropic initialization also failed in main.py: {e2}")
-                client = None
-        else:
-            print(f"❌ Anthropic client initialization failed in main.py: {e}")
-            client = None
-    except Exception as e:
-        print(f"❌ Anthropic client initialization failed in main.py: {e}")
-        client = None
-else:
-    print("⚠️  ANTHROPIC_API_KEY not found in environment variables for main.py")
-    client = None
+@app.on_event("startup")
+async def resume_account_deletions():
+    """Continue the delete-all jobs that were interrupted"""
+    await account_deleter.resume()
+
+@app.on_event("shutdown")
+async def stop_account_deletions():
+    """Stop deleting and release the jobs, so the next start resumes them"""
+    await account_deleter.shutdown()
+
+@app.on_event("shutdown")
+async def flush_timezone_updates():
+    """Write timezone detections that are resolved but not yet saved"""
+    await timezone_detector.shutdown()
+
+@app.on_event("shutdown")
+async def flush_share_views():
+    """Write public share views that are counted but not yet saved"""
+    await share_view_recorder.shutdown()
+
+@app.on_event("shutdown")
+async def stop_conversation_summarizer():
+    """Stop folding chat exchanges into conversation summaries"""
+    await conversation_summarizer.shutdown()
 
 @app.get("/")
 async def root():
@@ -185,20 +152,24 @@ async def root():
     }
 
 @app.get("/health")
-async def health_check(db: Session = Depends(get_db)):
+async def health_check(db: AsyncSession = Depends(get_async_db)):
     """Health check with database connectivity"""
     try:
-        result = db.execute(text("SELECT 1")).fetchone()
+        result = (await db.execute(text("SELECT 1"))).fetchone()
         return {
             "status": "healthy",
             "database": "connected",
-            "anthropic_configured": client is not None
+            "anthropic_configured": provider_router.providers["anthropic"].is_configured(),
+            "llm_configured": provider_router.has_providers(),
+            "llm_providers": provider_router.snapshot(),
+            "db_pool": get_pool_metrics()
         }
     except Exception as e:
         return {
             "status": "unhealthy",
             "database": "disconnected",
-            "error": str(e)
+            "error": str(e),
+            "db_pool": get_pool_metrics()
         }
 
 # PDF conversion endpoint (legacy support)
@@ -0,0 +1,88 @@
+# middleware/request_logging.py
+import json
+import logging
+import os
+import random
+import time
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger("digestgpt.requests")
+
+# Share of fast, successful requests that get an access-log line (0 disables, 1 logs all)
+REQUEST_LOG_SAMPLE_RATE = float(os.getenv("REQUEST_LOG_SAMPLE_RATE", "0.05"))
+# Requests slower than this are always logged
+REQUEST_LOG_SLOW_MS = float(os.getenv("REQUEST_LOG_SLOW_MS", "1000"))
+
+SECURITY_HEADERS = [
+    (b"cross-origin-opener-policy", b"same-origin-allow-popups"),
+    (b"cross-origin-embedder-policy", b"unsafe-none"),
+]
+
+
+class RequestLoggingMiddleware:
+    """
+    Outermost pure-ASGI layer: adds the security headers and writes one structured
+    (JSON) access-log line per request.
+
+    Server errors and slow requests are always logged; other requests are sampled at
+    REQUEST_LOG_SAMPLE_RATE. Nothing is formatted unless the logger is enabled for the
+    level, and tokens, cookies and query strings are never logged.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        sample_rate: float = REQUEST_LOG_SAMPLE_RATE,
+        slow_ms: float = REQUEST_LOG_SLOW_MS,
+    ):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_headers(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = MutableHeaders(scope=message)
+                for key, value in SECURITY_HEADERS:
+                    headers.raw.append((key, value))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            self._log(scope, status_code, (time.perf_counter() - started) * 1000)
+
+    def _log(self, scope: Scope, status_code: int, duration_ms: float):
+        if status_code >= 500:
+            level = logging.ERROR
+        elif duration_ms >= self.slow_ms:
+            level = logging.WARNING
+        elif random.random() < self.sample_rate:
+            level = logging.INFO
+        else:
+            return
+
+        if not logger.isEnabledFor(level):
+            return
+
+        client = scope.get("client")
+        logger.log(level, json.dumps({
+            "event": "request",
+            "method": scope["method"],
+            "path": scope["path"],
+            "status": status_code,
+            "duration_ms": round(duration_ms, 1),
+            "client": client[0] if client else None,
+            "sampled": level == logging.INFO,
+        }))
@@ -1,28 +1,32 @@
-from starlette.middleware.base import BaseHTTPMiddleware
 from fastapi import Request
-from sqlalchemy.orm import Session
-from database import get_db
-from models import User
-from timezone_service import timezone_service
-from dependencies import get_current_user_optional
+from starlette.types import ASGIApp, Receive, Scope, Send
+from database import AsyncSessionLocal
+from timezone_detector import timezone_detector
+from dependencies import get_access_token_from_cookie
+from identity import UserPrincipal, load_principal, request_claims, request_identity
+from typing import Optional
 import logging
 
 logger = logging.getLogger(__name__)
 
-class TimezoneMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        # Process the request first
-        response = await call_next(request)
+class TimezoneMiddleware:
+    # Skip timezone detection for static files, docs, etc.
+    skip_paths = ["/docs", "/openapi.json", "/static", "/favicon.ico", "/health"]
+    
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        # Process the request first; the response has been sent by the time this returns
+        await self.app(scope, receive, send)
         
-        # Skip timezone detection for static files, docs, etc.
-        path = request.url.path
-        skip_paths = ["/docs", "/openapi.json", "/static", "/favicon.ico", "/health"]
+        if scope["type"] != "http":
+            return
         
         # Only detect timezone for authenticated users on main endpoints
-        if not any(path.startswith(skip_path) for skip_path in skip_paths):
-            await self.detect_and_update_timezone(request)
-        
-        return response
+        path = scope["path"]
+        if not any(path.startswith(skip_path) for skip_path in self.skip_paths):
+            await self.detect_and_update_timezone(Request(scope))
     
     async def detect_and_update_timezone(self, request: Request):
         try:
@@ -31,21 +35,42 @@ class TimezoneMiddleware(BaseHTTPMiddleware):
             
             # For local development, keep the local IP - the timezone service will handle it
             if not client_ip or client_ip in ['127.0.0.1', 'localhost', '::1']:
-                print(f"🏠 Local development detected, timezone service will use system timezone")
+                logger.debug("🏠 Local development detected, timezone service will use system timezone")
                 client_ip = "127.0.0.1"  # Let timezone service handle local detection
             
-            # Get current user if authenticated
-            db: Session = next(get_db())
-            try:
-                user = get_current_user_optional(request, db)
-                if user and client_ip:
-                    self.update_user_timezone(user, client_ip, db)
-            finally:
-                db.close()
+            # Anonymous requests never need a DB session
+            if not (request.headers.get("Authorization") or get_access_token_from_cookie(request)):
+                return
+            
+            # Get current user principal if authenticated
+            principal = await self.get_principal(request)
+            if principal and client_ip:
+                await self.update_user_timezone(principal, client_ip)
                 
         except Exception as e:
             logger.error(f"❌ Timezone middleware error: {e}")
     
+    async def get_principal(self, request: Request) -> Optional[UserPrincipal]:
+        # Reuse the identity the auth dependencies resolved for this request
+        principal = request_identity(request.scope).get("principal")
+        if principal:
+            return principal
+        
+        token = None
+        authorization = request.headers.get("Authorization")
+        if authorization and authorization.startswith("Bearer "):
+            token = authorization.replace("Bearer ", "")
+        if not token:
+            token = get_access_token_from_cookie(request)
+        
+        payload = request_claims(request.scope, token)
+        user_id = payload.get("sub") if payload else None
+        if not user_id:
+            return None
+        
+        async with AsyncSessionLocal() as db:
+            return await load_principal(db, user_id)
+    
     def get_client_ip(self, request: Request) -> str:
         # Check for forwarded IP (from load balancers, proxies)
         forwarded_for = request.headers.get("X-Forwarded-For")
@@ -58,26 +83,11 @@ class TimezoneMiddleware(BaseHTTPMiddleware):
         
         return client_ip
     
-    def update_user_timezone(self, user: User, client_ip: str, db: Session):
-        try:
-            # Only update if IP has changed or timezone is not set
-            if user.last_ip_address == client_ip and user.timezone and user.timezone != 'UTC':
-                return
-            
-            print(f"🌍 Detecting timezone for user {user.email} from IP {client_ip}")
-            
-            # Detect timezone from IP
-            detected_timezone = timezone_service.get_user_timezone_from_ip(client_ip)
-            
-            if detected_timezone and detected_timezone != 'UTC':
-                print(f"🌍 Updating timezone for user {user.email}: {user.timezone} -> {detected_timezone}")
-                user.timezone = detected_timezone
-                user.last_ip_address = client_ip
-                db.commit()
-                print(f"✅ Timezone updated successfully")
-            else:
-                print(f"⚠️ No timezone detected or got UTC, keeping current: {user.timezone}")
-                
-        except Exception as e:
-            logger.error(f"❌ Error updating user timezone: {e}")
-            db.rollback()
\ No newline at end of file
+    async def update_user_timezone(self, principal: UserPrincipal, client_ip: str):
+        # Only update if IP has changed or timezone is not set
+        if principal.last_ip_address == client_ip and principal.timezone and principal.timezone != 'UTC':
+            return
+        
+        # Detection and the database write happen off the request path
+        logger.debug(f"🌍 Scheduling timezone detection for user {principal.id} from IP {client_ip}")
+        timezone_detector.schedule(principal.id, client_ip)
@@ -2,10 +2,12 @@
 
 import uuid
 from sqlalchemy import (
-    Column, String, Float, Boolean, DateTime, ForeignKey, Text, Enum, Integer
+    Column, String, Float, Boolean, DateTime, ForeignKey, Text, Enum, Integer, Index, Date, BigInteger,
+    LargeBinary
 )
-from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.sql import func
+from sqlalchemy.dialects.postgresql import JSONB, UUID
+from sqlalchemy.orm import deferred
+from sqlalchemy.sql import func, text
 from sqlalchemy.ext.declarative import declarative_base
 import enum
 
@@ -58,21 +60,65 @@ class Document(Base):
     collection_id = Column(UUID(as_uuid=True), ForeignKey("collections.id"), nullable=True)
     filename = Column(String)
     filesize = Column(Integer)
-    document_text = Column(Text)
+    # Legacy inline payload: new documents keep text and analysis in DocumentContent and
+    # backfill_document_contents.py moves old rows there. Deferred; read via document_store.
+    document_text = deferred(Column(Text), group="payload")
     summary = Column(Text)
-    problem_context = Column(Text)
-    key_points = Column(Text)
-    risk_flags = Column(Text)
-    swot_analysis = Column(Text)
-    key_concepts = Column(Text)
+    problem_context = deferred(Column(Text), group="payload")
+    key_points = deferred(Column(Text), group="payload")
+    risk_flags = deferred(Column(Text), group="payload")
+    swot_analysis = deferred(Column(Text), group="payload")
+    key_concepts = deferred(Column(Text), group="payload")
     word_count = Column(Integer)
     analysis_method = Column(String)
-    recommendations = Column(Text)
-    impact = Column(Text)
+    recommendations = deferred(Column(Text), group="payload")
+    impact = deferred(Column(Text), group="payload")
     file_url = Column(String, nullable=True)  # Add file URL for PDF viewing
+    content_hash = Column(String(64), nullable=True)  # SHA-256 of uploaded bytes / pasted text, for request coalescing
     uploaded_at = Column(DateTime(timezone=True), server_default=func.now())
 
-# 3. Chat history
+    __table_args__ = (
+        Index("ix_documents_user_id_content_hash", "user_id", "content_hash"),
+        Index("ix_documents_user_id_uploaded_at_id", "user_id", "uploaded_at", "id"),
+        # A collection's documents, newest first; also what collection deletes look up
+        Index("ix_documents_collection_id_uploaded_at", "collection_id", "uploaded_at"),
+    )
+
+# 2b. Document contents (compressed extracted text and JSONB analysis, loaded only when needed)
+class DocumentContent(Base):
+    __tablename__ = "document_contents"
+
+    document_id = Column(UUID(as_uuid=True), ForeignKey("documents.id", ondelete="CASCADE"), primary_key=True)
+    codec = Column(String(8), nullable=False)  # "zstd" or "gzip"
+    text_data = Column(LargeBinary)  # Compressed UTF-8 document text
+    analysis = Column(JSONB)  # Analysis pre-shaped for responses (TOAST-compressed by Postgres)
+    text_length = Column(Integer)
+    stored_bytes = Column(Integer)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_document_contents_analysis", "analysis", postgresql_using="gin", postgresql_ops={"analysis": "jsonb_path_ops"}),
+    )
+
+# 3. Chat sessions: separate conversations about the same document
+class ChatSession(Base):
+    __tablename__ = "chat_sessions"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
+    document_id = Column(UUID(as_uuid=True), ForeignKey("documents.id", ondelete="CASCADE"), nullable=False)
+    title = Column(String, nullable=True)
+    message_count = Column(Integer, nullable=False, default=0)  # Maintained on every exchange
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    last_message_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)  # Creation time until the first message
+
+    __table_args__ = (
+        # A user's sessions for a document, most recently active first
+        Index("ix_chat_sessions_user_id_document_id_last_message_at", "user_id", "document_id", "last_message_at"),
+    )
+
+
+# 3a. Chat history
 class ChatHistory(Base):
     __tablename__ = "chat_history"
 
@@ -82,7 +128,29 @@ class ChatHistory(Base):
     question = Column(Text)
     answer = Column(Text)
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
-    chat_session_id = Column(UUID(as_uuid=True), nullable=True, index=True)
+    chat_session_id = Column(UUID(as_uuid=True), ForeignKey("chat_sessions.id", ondelete="CASCADE"), nullable=True)  # Document chat only
+
+    __table_args__ = (
+        # Per-session history in order (session pages, chat context, public shares)
+        Index("ix_chat_history_chat_session_id_timestamp_id", "chat_session_id", "timestamp", "id"),
+        # Per-document history, newest first (history pages across sessions)
+        Index("ix_chat_history_document_id_user_id_timestamp", "document_id", "user_id", "timestamp"),
+        # Per-user rollup of chatted documents (GET /chat/history)
+        Index("ix_chat_history_user_id_document_id_timestamp", "user_id", "document_id", "timestamp"),
+    )
+
+
+# 3b. Rolling summary of a chat session, up to a point in its history
+class ConversationSummary(Base):
+    __tablename__ = "conversation_summaries"
+
+    chat_session_id = Column(UUID(as_uuid=True), ForeignKey("chat_sessions.id", ondelete="CASCADE"), primary_key=True)
+    summary = Column(Text, nullable=False)
+    # Sort key (timestamp, id) of the newest exchange folded into the summary
+    summarized_through = Column(DateTime(timezone=True), nullable=False)
+    summarized_through_id = Column(UUID(as_uuid=True), nullable=False)
+    turns_summarized = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
 
 # 4. Usage
@@ -94,8 +162,61 @@ class Usage(Base):
     docs_used = Column(Integer, default=0)
     chats_used = Column(Integer, default=0)
     tokens_used = Column(Integer, default=0)
+    tokens_reserved = Column(Integer, nullable=False, default=0, server_default="0")  # Held by open UsageReservations
     last_reset = Column(DateTime(timezone=True), server_default=func.now())
 
+# 4b. Usage events (append-only metering log; Usage holds the running totals)
+class UsageEvent(Base):
+    __tablename__ = "usage_events"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
+    document_id = Column(UUID(as_uuid=True), nullable=True)  # No FK: events outlive deleted documents
+    operation = Column(String, nullable=False)  # e.g. "document_analysis", "chat", "casual_chat", "reset"
+    docs = Column(Integer, nullable=False, default=0)
+    chats = Column(Integer, nullable=False, default=0)
+    tokens = Column(Integer, nullable=False, default=0)  # Tokens charged against the plan
+    input_tokens = Column(Integer, nullable=False, default=0, server_default="0")  # Provider-reported
+    output_tokens = Column(Integer, nullable=False, default=0, server_default="0")  # Provider-reported
+    cost_usd = Column(Float, nullable=False, default=0, server_default="0")
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_usage_events_user_id_created_at", "user_id", "created_at"),
+    )
+
+# 4d. Daily LLM cost rollup per user, operation and model (kept up to date by usage metering)
+class UsageCostDaily(Base):
+    __tablename__ = "usage_cost_daily"
+
+    day = Column(Date, primary_key=True)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), primary_key=True)
+    operation = Column(String, primary_key=True)
+    provider = Column(String, primary_key=True)
+    model = Column(String, primary_key=True)
+    calls = Column(Integer, nullable=False, default=0)
+    input_tokens = Column(BigInteger, nullable=False, default=0)
+    output_tokens = Column(BigInteger, nullable=False, default=0)
+    cost_usd = Column(Float, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_usage_cost_daily_day_operation", "day", "operation"),
+    )
+
+# 4c. Token reservations (budget held for in-flight LLM calls until settled, released or expired)
+class UsageReservation(Base):
+    __tablename__ = "usage_reservations"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
+    tokens = Column(Integer, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (
+        Index("ix_usage_reservations_user_id_expires_at", "user_id", "expires_at"),
+    )
+
 # 5. SubscriptionPlan
 class SubscriptionPlan(Base):
     __tablename__ = "subscription_plans"
@@ -157,7 +278,24 @@ class Collection(Base):
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
     name = Column(String, nullable=False)
     description = Column(Text)
+    document_count = Column(Integer, nullable=False, default=0, server_default="0")  # Maintained by document create/delete
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        # A user's collections, newest first (GET /collections)
+        Index("ix_collections_user_id_created_at", "user_id", "created_at"),
+    )
+
+# 9b. Collection rollup: merged SWOT, top risks and key concepts across a collection's documents
+class CollectionRollup(Base):
+    __tablename__ = "collection_rollups"
+
+    collection_id = Column(UUID(as_uuid=True), ForeignKey("collections.id", ondelete="CASCADE"), primary_key=True)
+    document_count = Column(Integer, nullable=False, default=0)  # Documents folded into the rollup
+    tallies = Column(JSONB, nullable=False, default=dict)  # Documents per merged item, so a document can be added or removed alone
+    summary = Column(JSONB, nullable=False, default=dict)  # Response of GET /collections/{id}/rollup, derived from tallies
+    stale = Column(Boolean, nullable=False, default=False)  # Rebuilt from the documents on the next read
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     
 #10. Payments
 class Payment(Base):
@@ -177,7 +315,7 @@ class PublicChatShare(Base):
     
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, index=True)
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
-    chat_session_id = Column(UUID(as_uuid=True), nullable=False, index=True)  # Links to ChatHistory
+    chat_session_id = Column(UUID(as_uuid=True), nullable=False, index=True)  # The shared ChatSession
     document_id = Column(UUID(as_uuid=True), ForeignKey("documents.id"), nullable=True)  # Optional: link to document
     
     # Public sharing details
@@ -206,7 +344,7 @@ class PublicChatView(Base):
     __tablename__ = "public_chat_views"
     
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, index=True)
-    share_id = Column(UUID(as_uuid=True), ForeignKey("public_chat_shares.id"), nullable=False)
+    share_id = Column(UUID(as_uuid=True), ForeignKey("public_chat_shares.id"), nullable=False, index=True)
     
     # Viewer information (anonymous)
     ip_address = Column(String, nullable=True)  # For basic analytics
@@ -218,3 +356,38 @@ class PublicChatView(Base):
     viewed_at = Column(DateTime(timezone=True), server_default=func.now())
     session_duration = Column(Integer, nullable=True)  # How long they stayed (seconds)
 
+
+# 6. NEW: Background deletion of all of a user's data (resumable; see account_deletion.py)
+class AccountDeletionJob(Base):
+    __tablename__ = "account_deletion_jobs"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
+    status = Column(String(16), nullable=False, default="pending")  # pending, running, completed, failed
+    step = Column(String(32), nullable=True)  # Kind of data being deleted
+    totals = Column(JSONB)  # Deletion preview when the job was created
+    progress = Column(JSONB, nullable=False, default=dict)  # Rows and files deleted so far, per kind
+    last_error = Column(Text, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    # Lease: the worker running the job, renewed with every batch
+    runner_id = Column(UUID(as_uuid=True), nullable=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    completed_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index("ix_account_deletion_jobs_user_id_created_at", "user_id", "created_at"),
+        # At most one unfinished job per user
+        Index(
+            "uq_account_deletion_jobs_active_user", "user_id",
+            unique=True, postgresql_where=text("status IN ('pending', 'running')")
+        ),
+    )
+
+class AnalysisLease(Base):
+    __tablename__ = "analysis_leases"
+
+    # lease_id_for() of the coalescing key (user, collection, content hash)
+    lease_id = Column(BigInteger, primary_key=True)
+    owner = Column(UUID(as_uuid=True), nullable=False)  # Worker request running the analysis
+    expires_at = Column(DateTime(timezone=True), nullable=False)
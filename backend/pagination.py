@@ -0,0 +1,70 @@
+"""
+Keyset (cursor) pagination helpers for list endpoints.
+
+A cursor is an opaque URL-safe token encoding the sort key of the last row returned,
+(timestamp, id). The next page is read with a row-value comparison against that key,
+so with a matching composite index every page costs the same however deep it is,
+unlike OFFSET which reads and discards every skipped row.
+
+Counts are optional: "exact" counts all matching rows (an index-only scan with the
+composite index), "estimated" counts exactly up to COUNT_ESTIMATE_CAP rows and above
+that reports the planner's row estimate, and "none" skips the count.
+"""
+import base64
+import json
+import os
+import uuid
+from datetime import datetime
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import func, select, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Select
+
+COUNT_ESTIMATE_CAP = int(os.getenv("COUNT_ESTIMATE_CAP", "1000"))
+COUNT_MODES = ("exact", "estimated", "none")
+
+
+def encode_cursor(timestamp: datetime, row_id: uuid.UUID) -> str:
+    payload = json.dumps({"t": timestamp.isoformat(), "i": str(row_id)}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, uuid.UUID]:
+    """Sort key from a cursor; 400 if it is not one we issued"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(payload["t"]), uuid.UUID(payload["i"])
+    except Exception:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
+
+async def count_rows(db: AsyncSession, statement: Select, mode: str = "exact") -> Tuple[Optional[int], bool]:
+    """Count the rows `statement` selects; returns (count, is_estimate)"""
+    if mode == "none":
+        return None, False
+
+    if mode == "exact":
+        return await db.scalar(select(func.count()).select_from(statement.order_by(None).subquery())), False
+
+    capped = await db.scalar(
+        select(func.count()).select_from(statement.order_by(None).limit(COUNT_ESTIMATE_CAP + 1).subquery())
+    )
+    if capped <= COUNT_ESTIMATE_CAP:
+        return capped, False
+
+    # Large result: the planner's estimate is good enough for a page counter
+    compiled = statement.order_by(None).compile(
+        dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+    )
+    plan = await db.scalar(text(f"EXPLAIN (FORMAT JSON) {compiled}"))
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    estimated = int(plan[0]["Plan"]["Plan Rows"])
+    return max(estimated, capped), True
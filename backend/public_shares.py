@@ -0,0 +1,274 @@
+"""
+Public share pages: a render cache, and buffered view analytics.
+
+Render cache: the public page of a share (conversation, document overview and analysis)
+is rendered once into JSON bytes and kept in a bounded LRU, by token, for
+PUBLIC_SHARE_CACHE_TTL_SECONDS and at most PUBLIC_SHARE_CACHE_MAX_BYTES in total. The
+body, view_count included, is fixed for the life of the entry and the weak ETag is a
+hash of it, so repeat visitors get 304s until the entry is re-rendered. Local
+changes invalidate entries straight away (a new exchange in the shared session,
+deleting the session, its history, the document or all user data); changes made by
+another worker are picked up when the entry expires.
+
+View analytics: a view no longer writes to the database before the response.
+ShareViewRecorder buffers the per-share view counts and PublicChatView rows and a
+background task writes them every SHARE_VIEW_FLUSH_SECONDS, or sooner once
+SHARE_VIEW_BATCH_SIZE views are waiting: one batched UPDATE of the counters and one
+multi-row INSERT of the views. Counts that fail to write are kept for the next flush.
+The view count shown on a page is the count at render time, so it may trail by up to the
+cache TTL; the max_views check adds the views this worker has served since.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Union
+
+from sqlalchemy import bindparam, func, insert, select, update
+
+from database import AsyncSessionLocal
+from models import PublicChatShare, PublicChatView
+
+logger = logging.getLogger(__name__)
+
+PUBLIC_SHARE_CACHE_TTL_SECONDS = float(os.getenv("PUBLIC_SHARE_CACHE_TTL_SECONDS", "60"))
+PUBLIC_SHARE_CACHE_MAX_BYTES = int(os.getenv("PUBLIC_SHARE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+SHARE_VIEW_FLUSH_SECONDS = float(os.getenv("SHARE_VIEW_FLUSH_SECONDS", "5"))
+SHARE_VIEW_BATCH_SIZE = int(os.getenv("SHARE_VIEW_BATCH_SIZE", "500"))
+# Analytics rows held at most while the database is unreachable; counts are always kept
+SHARE_VIEW_BUFFER_MAX = int(os.getenv("SHARE_VIEW_BUFFER_MAX", "10000"))
+
+ENTITY_TAG = re.compile(r'\s*(?:W/)?("[^"]*")\s*(?:,|$)')
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match check: "*" or any listed entity tag equal to etag, weak or not"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque_tag = etag[2:] if etag.startswith("W/") else etag
+    return any(match.group(1) == opaque_tag for match in ENTITY_TAG.finditer(if_none_match))
+
+
+@dataclass
+class RenderedShare:
+    share_id: uuid.UUID
+    user_id: uuid.UUID
+    chat_session_id: uuid.UUID
+    # JSON object of the page, with view_count at render time
+    body: bytes
+    expires_at: Optional[datetime]
+    max_views: Optional[int]
+    # view_count at render time; served counts the views of this entry since
+    view_count: int
+    etag: str = ""
+    served: int = 0
+
+    def __post_init__(self):
+        if not self.etag:
+            self.etag = f'W/"{hashlib.blake2b(self.body, digest_size=16).hexdigest()}"'
+
+    @property
+    def views(self) -> int:
+        return self.view_count + self.served
+
+
+class ShareRenderCache:
+    """Bounded LRU of rendered share pages, by token, with a fixed TTL and a total size cap"""
+
+    def __init__(self, ttl: float = PUBLIC_SHARE_CACHE_TTL_SECONDS, max_bytes: int = PUBLIC_SHARE_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, share_token: str) -> Optional[RenderedShare]:
+        with self._lock:
+            entry = self._entries.get(share_token)
+            if entry is None:
+                return None
+            rendered, expires_at = entry
+            if expires_at <= time.monotonic():
+                self._drop(share_token)
+                return None
+            self._entries.move_to_end(share_token)
+            return rendered
+
+    def put(self, share_token: str, rendered: RenderedShare):
+        if self.ttl <= 0 or len(rendered.body) > self.max_bytes:
+            return
+        with self._lock:
+            self._drop(share_token)
+            self._entries[share_token] = (rendered, time.monotonic() + self.ttl)
+            self._bytes += len(rendered.body)
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def add_view(self, rendered: RenderedShare):
+        """Count a view served from the entry, for the max_views check"""
+        with self._lock:
+            rendered.served += 1
+
+    def _drop(self, share_token: str):
+        entry = self._entries.pop(share_token, None)
+        if entry is not None:
+            self._bytes -= len(entry[0].body)
+
+    def invalidate(
+        self,
+        chat_session_id: Optional[Union[str, uuid.UUID]] = None,
+        user_id: Optional[Union[str, uuid.UUID]] = None,
+    ):
+        """Drop the pages of a shared session, or of every share of a user"""
+        with self._lock:
+            stale = [
+                share_token
+                for share_token, (rendered, _) in self._entries.items()
+                if (chat_session_id is not None and str(rendered.chat_session_id) == str(chat_session_id))
+                or (user_id is not None and str(rendered.user_id) == str(user_id))
+            ]
+            for share_token in stale:
+                self._drop(share_token)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+share_render_cache = ShareRenderCache()
+
+
+@dataclass
+class _PendingViews:
+    count: int = 0
+    last_viewed_at: Optional[datetime] = None
+    rows: List[dict] = field(default_factory=list)
+
+
+class ShareViewRecorder:
+    """Buffers share views and writes them in batches from a background task"""
+
+    def __init__(self):
+        self._pending: Dict[uuid.UUID, _PendingViews] = {}
+        self._buffered_rows = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def record(
+        self,
+        share_id: uuid.UUID,
+        ip_address: Optional[str] = None,
+        user_agent: Optional[str] = None,
+        referrer: Optional[str] = None,
+    ):
+        """Count a view; never blocks or touches the database"""
+        self._ensure_worker()
+        viewed_at = datetime.now(timezone.utc)
+        pending = self._pending.setdefault(share_id, _PendingViews())
+        pending.count += 1
+        pending.last_viewed_at = viewed_at
+        if self._buffered_rows < SHARE_VIEW_BUFFER_MAX:
+            pending.rows.append({
+                "id": uuid.uuid4(),
+                "share_id": share_id,
+                "ip_address": ip_address,
+                "user_agent": user_agent[:512] if user_agent else None,
+                "referrer": referrer[:512] if referrer else None,
+                "viewed_at": viewed_at,
+            })
+            self._buffered_rows += 1
+        if self._buffered_rows >= SHARE_VIEW_BATCH_SIZE:
+            self._wakeup.set()
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        if self._worker is not None and not self._worker.done() and self._loop is loop:
+            return
+        # First use, or the previous loop has gone away (tests, reloads)
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        self._worker = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=SHARE_VIEW_FLUSH_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Add the buffered views to the share counters and write the view rows"""
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        self._buffered_rows = 0
+
+        shares = PublicChatShare.__table__
+        try:
+            async with AsyncSessionLocal() as db:
+                # Shares deleted since the views were counted are skipped
+                existing = set((await db.scalars(
+                    select(PublicChatShare.id).where(PublicChatShare.id.in_(list(batch)))
+                )).all())
+                if existing:
+                    await db.execute(
+                        update(shares)
+                        .where(shares.c.id == bindparam("share"))
+                        .values(
+                            view_count=func.coalesce(shares.c.view_count, 0) + bindparam("views"),
+                            last_accessed=bindparam("viewed_at"),
+                        ),
+                        [
+                            {"share": share_id, "views": pending.count, "viewed_at": pending.last_viewed_at}
+                            for share_id, pending in batch.items()
+                            if share_id in existing
+                        ],
+                    )
+                    rows = [row for share_id in existing for row in batch[share_id].rows]
+                    if rows:
+                        await db.execute(insert(PublicChatView), rows)
+                await db.commit()
+        except Exception as e:
+            logger.error(f"❌ Error writing share views: {e}")
+            self._merge_back(batch)
+            return
+
+        logger.info(f"👀 Recorded {sum(p.count for p in batch.values())} view(s) of {len(existing)} share(s)")
+
+    def _merge_back(self, batch: Dict[uuid.UUID, _PendingViews]):
+        for share_id, failed in batch.items():
+            pending = self._pending.setdefault(share_id, _PendingViews())
+            pending.count += failed.count
+            if pending.last_viewed_at is None or failed.last_viewed_at > pending.last_viewed_at:
+                pending.last_viewed_at = failed.last_viewed_at
+            room = max(0, SHARE_VIEW_BUFFER_MAX - self._buffered_rows)
+            pending.rows[:0] = failed.rows[:room]
+            self._buffered_rows += min(room, len(failed.rows))
+
+    async def shutdown(self):
+        """Stop the worker and write the buffered views"""
+        if self._worker is not None and self._loop is asyncio.get_running_loop():
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            await self.flush()
+        self._worker = None
+
+
+# Global share view recorder instance
+share_view_recorder = ShareViewRecorder()
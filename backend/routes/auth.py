@@ -1,17 +1,17 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Response, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.responses import RedirectResponse
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel, EmailStr, validator
 from typing import Optional
 from uuid import UUID
 import uuid, jwt
 import os
-from sqlalchemy import func
+from sqlalchemy import func, select
 import httpx
 from google.auth.transport import requests
 from google.oauth2 import id_token
-from database import get_db
+from database import get_async_db
 from models import User, UserPlan
 from auth_backend import hash_password, verify_password, create_access_token, create_refresh_token, verify_token
 from dependencies import get_current_active_user, get_user_limits_info, get_access_token_from_cookie, get_refresh_token_from_cookie
@@ -130,13 +130,13 @@ def verify_short_lived_token(token: str) -> dict:
 
 # TRADITIONAL REGISTRATION
 @router.post("/register")
-async def register(user: UserRegister, response: Response, db: Session = Depends(get_db)):
+async def register(user: UserRegister, response: Response, db: AsyncSession = Depends(get_async_db)):
     """Register a new user with traditional email/password"""
     try:
         normalized_email = user.email.lower() 
         
         # Check if user already exists
-        existing_user = db.query(User).filter(func.lower(User.email) == normalized_email).first()
+        existing_user = await db.scalar(select(User).where(func.lower(User.email) == normalized_email))
         if existing_user:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -161,8 +161,8 @@ async def register(user: UserRegister, response: Response, db: Session = Depends
         )
         
         db.add(new_user)
-        db.commit()
-        db.refresh(new_user)
+        await db.commit()
+        await db.refresh(new_user)
         
         # Send verification email
         send_verification_email(normalized_email, verification_token)
@@ -173,7 +173,7 @@ async def register(user: UserRegister, response: Response, db: Session = Depends
         raise
     
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"❌ Registration error: {str(e)}")
         import traceback
         print(f"❌ Traceback: {traceback.format_exc()}")
@@ -184,14 +184,14 @@ async def register(user: UserRegister, response: Response, db: Session = Depends
 
 # TRADITIONAL LOGIN
 @router.post("/login", response_model=Token)
-async def login(user_credentials: UserLogin, response: Response, db: Session = Depends(get_db)):
+async def login(user_credentials: UserLogin, response: Response, db: AsyncSession = Depends(get_async_db)):
     """Login user with email and password"""
     print(f"\n🔐 === LOGIN ENDPOINT CALLED ===")
     print(f"🔐 Email: {user_credentials.email}")
     
     normalized_email = user_credentials.email.lower()
     
-    user = db.query(User).filter(User.email == normalized_email).first()
+    user = await db.scalar(select(User).where(User.email == normalized_email))
 
     if not user:
         print("❌ User not found")
@@ -234,7 +234,7 @@ async def login(user_credentials: UserLogin, response: Response, db: Session = D
 
 # PASSWORDLESS MAGIC LINK
 @router.post("/send-magic-link")
-async def send_magic_link(request: EmailLoginRequest, db: Session = Depends(get_db)):
+async def send_magic_link(request: EmailLoginRequest, db: AsyncSession = Depends(get_async_db)):
     """Send magic link for passwordless login/signup"""
     print(f"\n🔗 === MAGIC LINK REQUEST ===")
     print(f"📧 Email: {request.email}")
@@ -243,7 +243,7 @@ async def send_magic_link(request: EmailLoginRequest, db: Session = Depends(get_
         normalized_email = request.email.lower()
         
         # Check if user exists
-        user = db.query(User).filter(func.lower(User.email) == normalized_email).first()
+        user = await db.scalar(select(User).where(func.lower(User.email) == normalized_email))
         
         if user:
             print(f"✅ Existing user found: {user.email}")
@@ -266,10 +266,10 @@ async def send_magic_link(request: EmailLoginRequest, db: Session = Depends(get_
             )
             db.add(user)
         
-        db.commit()
-        db.refresh(user)
+        await db.commit()
+        await db.refresh(user)
         
-        print(f"🔗 Generated magic link token: {user.verification_token}")
+        print(f"🔗 Generated magic link token for: {normalized_email}")
         
         # Send magic link email
         send_magic_link_email(normalized_email, user.verification_token)
@@ -280,7 +280,7 @@ async def send_magic_link(request: EmailLoginRequest, db: Session = Depends(get_
         }
     
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"❌ Magic link error: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -288,13 +288,13 @@ async def send_magic_link(request: EmailLoginRequest, db: Session = Depends(get_
         )
 
 @router.get("/magic-login")
-async def magic_login_simple(token: str, response: Response, db: Session = Depends(get_db)):
+async def magic_login_simple(token: str, response: Response, db: AsyncSession = Depends(get_async_db)):
     """Simple magic login with short-lived URL token (no database needed)"""
     print(f"\n🔗 === SIMPLE MAGIC LOGIN ===")
     
     try:
         # Verify magic link token (same validation as before)
-        user = db.query(User).filter(User.verification_token == token).first()
+        user = await db.scalar(select(User).where(User.verification_token == token))
         
         if not user:
             return RedirectResponse(
@@ -306,7 +306,7 @@ async def magic_login_simple(token: str, response: Response, db: Session = Depen
         if user.verification_token_expires_at and datetime.now() > user.verification_token_expires_at:
             user.verification_token = None
             user.verification_token_expires_at = None
-            db.commit()
+            await db.commit()
             return RedirectResponse(
                 url=f"{BASE_FRONTEND_URL}/signin?error=link_expired",
                 status_code=302
@@ -318,7 +318,7 @@ async def magic_login_simple(token: str, response: Response, db: Session = Depen
         user.is_active = True
         user.verification_token = None
         user.verification_token_expires_at = None
-        db.commit()
+        await db.commit()
         
         # Create auth tokens
         access_token = create_access_token(data={"sub": str(user.id)})
@@ -339,7 +339,7 @@ async def magic_login_simple(token: str, response: Response, db: Session = Depen
         return RedirectResponse(url=redirect_url, status_code=302)
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"❌ Magic login error: {str(e)}")
         return RedirectResponse(
             url=f"{BASE_FRONTEND_URL}/signin?error=login_failed",
@@ -427,13 +427,13 @@ async def debug_check_cookies(request: Request):
 
 # EMAIL VERIFICATION (for traditional registration)
 @router.get("/verify-email")
-async def verify_email(token: str, db: Session = Depends(get_db)):
+async def verify_email(token: str, db: AsyncSession = Depends(get_async_db)):
     """Verify user's email with expiration check"""
-    print(f"🔍 VERIFICATION START - Token: '{token}'")
+    print(f"🔍 VERIFICATION START")
     
     try:
         # Search for user
-        user = db.query(User).filter(User.verification_token == token).first()
+        user = await db.scalar(select(User).where(User.verification_token == token))
         
         if not user:
             print(f"❌ No user found with token")
@@ -454,7 +454,7 @@ async def verify_email(token: str, db: Session = Depends(get_db)):
             # Clear expired token
             user.verification_token = None
             user.verification_token_expires_at = None
-            db.commit()
+            await db.commit()
             
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST, 
@@ -475,7 +475,7 @@ async def verify_email(token: str, db: Session = Depends(get_db)):
         user.verification_token = None  # Clear token
         user.verification_token_expires_at = None  # Clear expiration
         
-        db.commit()
+        await db.commit()
         print(f"✅ User verified successfully")
         
         return {"message": "Email verified successfully! Your account is now active. You can log in."}
@@ -484,7 +484,7 @@ async def verify_email(token: str, db: Session = Depends(get_db)):
         raise
     
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"❌ Unexpected error: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -495,7 +495,7 @@ async def verify_email(token: str, db: Session = Depends(get_db)):
 @router.post("/resend-verification")
 async def resend_verification_email(
     request: ResendVerificationRequest, 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Resend verification email for unverified users"""
     print(f"\n📧 === RESEND VERIFICATION REQUEST ===")
@@ -505,7 +505,7 @@ async def resend_verification_email(
         normalized_email = request.email.lower()
         
         # Find user by email
-        user = db.query(User).filter(func.lower(User.email) == normalized_email).first()
+        user = await db.scalar(select(User).where(func.lower(User.email) == normalized_email))
         
         if not user:
             print(f"❌ User not found: {normalized_email}")
@@ -527,17 +527,14 @@ async def resend_verification_email(
             }
         
         # Generate new verification token (important for security)
-        old_token = user.verification_token
         user.verification_token = str(uuid.uuid4())
         user.verification_token_expires_at = datetime.now() + timedelta(hours=24)
         
         # DON'T VERIFY THE USER HERE - JUST UPDATE THE TOKEN!
         
-        print(f"🔄 Updating verification token:")
-        print(f"   - Old token: {old_token}")
-        print(f"   - New token: {user.verification_token}")
+        print(f"🔄 Updating verification token for: {normalized_email}")
         
-        db.commit()
+        await db.commit()
         print(f"✅ New token saved to database")
         
         # Send new verification email with the NEW token
@@ -549,7 +546,7 @@ async def resend_verification_email(
         }
     
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"❌ Resend verification error: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -558,7 +555,7 @@ async def resend_verification_email(
 
 # GOOGLE OAUTH
 @router.post("/google", response_model=Token)
-async def google_auth(google_request: GoogleTokenRequest, response: Response, db: Session = Depends(get_db)):
+async def google_auth(google_request: GoogleTokenRequest, response: Response, db: AsyncSession = Depends(get_async_db)):
     """Authenticate user with Google ID token"""
     if not GOOGLE_CLIENT_ID:
         raise HTTPException(
@@ -604,26 +601,26 @@ async def google_auth(google_request: GoogleTokenRequest, response: Response, db
         profile_picture = idinfo.get('picture', '')
         
         # Check if user already exists by Google ID
-        existing_user = db.query(User).filter(User.google_id == google_id).first()
+        existing_user = await db.scalar(select(User).where(User.google_id == google_id))
         
         if existing_user:
             user = existing_user
             # Update profile picture if changed
             if profile_picture and user.profile_picture != profile_picture:
                 user.profile_picture = profile_picture
-                db.commit()
+                await db.commit()
         else:
             # Normalize the incoming Google email
             normalized_email = email.lower()
 
             # Check if user exists by email (case-insensitive match)
-            existing_email_user = db.query(User).filter(func.lower(User.email) == normalized_email).first()
+            existing_email_user = await db.scalar(select(User).where(func.lower(User.email) == normalized_email))
             
             if existing_email_user:
                 # Link the Google account to existing email user
                 existing_email_user.google_id = google_id
                 existing_email_user.profile_picture = profile_picture
-                db.commit()
+                await db.commit()
                 user = existing_email_user
             else:
                 # Create new user with Google OAuth
@@ -640,8 +637,8 @@ async def google_auth(google_request: GoogleTokenRequest, response: Response, db
                 )
                 
                 db.add(new_user)
-                db.commit()
-                db.refresh(new_user)
+                await db.commit()
+                await db.refresh(new_user)
                 user = new_user
         
         # Create JWT tokens
@@ -668,7 +665,7 @@ async def refresh_token(
     request: Request, 
     response: Response, 
     token_data: TokenRefresh = None, 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Refresh access token using refresh token from cookie or body"""
     # Get client identifier for rate limiting (IP address as fallback)
@@ -708,7 +705,7 @@ async def refresh_token(
         )
     
     # Get user from database
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.scalar(select(User).where(User.id == user_id))
     if not user or not user.is_active:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -729,16 +726,16 @@ async def refresh_token(
 @router.get("/me", response_model=UserProfileWithUsage)
 async def get_current_user_profile(
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get current user's profile and usage information"""
-    usage_info = get_user_limits_info(current_user, db)
+    usage_info = await get_user_limits_info(current_user, db)
     
     # Get subscription data from UserSubscription table
     from models import UserSubscription
-    user_subscription = db.query(UserSubscription).filter(
+    user_subscription = await db.scalar(select(UserSubscription).where(
         UserSubscription.user_id == current_user.id
-    ).first()
+    ))
     
     return UserProfileWithUsage(
         id=current_user.id,
@@ -784,7 +781,6 @@ def send_verification_email(to_email, token):
     """Send verification email for traditional registration"""
     print(f"\n📧 === SENDING VERIFICATION EMAIL ===")
     print(f"📧 To: {to_email}")
-    print(f"📧 Token: {token}")
 
     verification_url = f"{BASE_FRONTEND_URL}/verify-email?token={token}"
     print(f"📧 Verification URL: {verification_url}")
@@ -847,7 +843,6 @@ def send_magic_link_email(to_email, token):
     """Send magic link email for passwordless authentication"""
     print(f"\n📧 === SENDING MAGIC LINK ===")
     print(f"📧 To: {to_email}")
-    print(f"📧 Token: {token}")
 
     # Magic link URL (goes directly to backend)
     magic_url = f"{BASE_BACKEND_URL}/auth/magic-login?token={token}"
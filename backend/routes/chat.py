@@ -1,10 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from sqlalchemy import select, delete, update, func, and_, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
-from datetime import datetime
-import anthropic, openai
-from openai import OpenAI
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 import os
 import uuid
@@ -12,61 +12,42 @@ import tiktoken
 import re
 import secrets
 import json
+import logging
+import orjson
 
-from database import get_db
-from models import User, Document, ChatHistory, PublicChatShare, PublicChatView
+from database import get_async_db
+from models import User, Document, ChatHistory, ChatSession, PublicChatShare
 from dependencies import (
     get_current_active_user,
     check_chat_limit,
-    check_token_limit,
-    get_user_limits_info,
-    increment_chat_usage,
-    increment_token_usage,
+    admit_llm_request,
+    admit_optional_user_llm_request,
+    reserve_tokens,
     estimate_tokens,
 )
+from llm_router import provider_router, track_llm_usage, LLMProviderError, TASK_CHAT, TASK_CASUAL
+from usage_metering import billable_tokens, usage_meter
+from document_store import load_payload
+from conversation_state import ConversationState, conversation_cache, load_conversation_state, remember_exchange
+from pagination import decode_cursor, encode_cursor
+from public_shares import RenderedShare, etag_matches, share_render_cache, share_view_recorder
+from user_stats import user_stats_cache
 
 load_dotenv()
 
-# Import Anthropic client configuration
-anthropic_api_key = os.getenv("ANTHROPIC_API_KEY")
-
-# Initialize Anthropic client with better error handling
-client = None
-if anthropic_api_key:
-    try:
-        # Try basic initialization first
-        import anthropic
-        client = anthropic.Anthropic(api_key=anthropic_api_key)
-        print("✅ Anthropic client initialized successfully in chat.py")
-    except TypeError as e:
-        if "proxies" in str(e):
-            print(f"⚠️  Anthropic client proxy error in chat.py, trying alternative initialization: {e}")
-            try:
-                # Alternative: Try initializing with minimal parameters
-                import httpx
-                http_client = httpx.Client()
-                client = anthropic.Anthropic(
-                    api_key=anthropic_api_key,
-                    http_client=http_client
-                )
-                print("✅ Anthropic client initialized with custom http client in chat.py")
-            except Exception as e2:
-                print(f"❌ Alternative Anthropic initialization also failed in chat.py: {e2}")
-                client = None
-        else:
-            print(f"❌ Anthropic client initialization failed in chat.py: {e}")
-            client = None
-    except Exception as e:
-        print(f"❌ Anthropic client initialization failed in chat.py: {e}")
-        client = None
-else:
-    print("⚠️  ANTHROPIC_API_KEY not found in environment variables for chat.py")
-    client = None
-
-openai_client = OpenAI(
-    base_url="https://openrouter.ai/api/v1", api_key=os.getenv("OPENROUTER_API_KEY")
-)
 router = APIRouter(prefix="/chat", tags=["chat"])
+logger = logging.getLogger(__name__)
+
+# Response cap for document chat; also reserved up front from the user's token budget
+CHAT_MAX_RESPONSE_TOKENS = 1000
+# Prompt size for document chat: document context + message + history, with room left for the response
+CHAT_MAX_CONTEXT_TOKENS = 8000  # Conservative limit for Claude
+CHAT_RESPONSE_BUFFER_TOKENS = 2000
+# Instructions and section headers around the document context
+CHAT_PROMPT_OVERHEAD_TOKENS = 200
+
+# Attempts at a fresh share token before giving up (a collision needs 2^128 tokens to be likely)
+SHARE_TOKEN_ATTEMPTS = 3
 
 
 class CasualChatRequest(BaseModel):
@@ -81,6 +62,8 @@ class CasualChatResponse(BaseModel):
 # Pydantic models
 class ChatRequest(BaseModel):
     document_id: Optional[uuid.UUID] = None
+    # Continue this session; without it, the document's most recent session (or a new one)
+    session_id: Optional[uuid.UUID] = None
     message: str
 
 
@@ -90,6 +73,21 @@ class ChatResponse(BaseModel):
     user_message: str
     ai_response: str
     timestamp: str
+    session_id: Optional[uuid.UUID] = None
+
+
+class ChatSessionCreate(BaseModel):
+    document_id: uuid.UUID
+    title: Optional[str] = None
+
+
+class ChatSessionResponse(BaseModel):
+    id: uuid.UUID
+    document_id: uuid.UUID
+    title: Optional[str]
+    message_count: int
+    created_at: str
+    last_message_at: str
 
 
 class ChatHistoryItem(BaseModel):
@@ -104,10 +102,13 @@ class ChatHistoryResponse(BaseModel):
     filename: str
     chat_history: List[ChatHistoryItem]
     total: int
+    next_cursor: Optional[str] = None
 
 
 class CreatePublicShareRequest(BaseModel):
     document_id: uuid.UUID
+    # Session to share; defaults to the document's most recent session
+    session_id: Optional[uuid.UUID] = None
     title: str
     description: Optional[str] = None
 
@@ -235,32 +236,66 @@ def find_relevant_chunks(chunks: List[Dict[str, Any]], query: str, top_k: int =
     return [item['chunk'] for item in chunk_scores[:top_k]]
 
 
+def session_response(session) -> ChatSessionResponse:
+    return ChatSessionResponse(
+        id=session.id,
+        document_id=session.document_id,
+        title=session.title,
+        message_count=session.message_count,
+        created_at=session.created_at.isoformat(),
+        last_message_at=session.last_message_at.isoformat(),
+    )
+
+
+async def find_chat_session(
+    db: AsyncSession, user_id: uuid.UUID, document_id: uuid.UUID, session_id: Optional[uuid.UUID] = None
+) -> Optional[ChatSession]:
+    """The given session of the user's document, or the document's most recently active one"""
+    query = select(ChatSession).where(ChatSession.user_id == user_id, ChatSession.document_id == document_id)
+    if session_id is not None:
+        return await db.scalar(query.where(ChatSession.id == session_id))
+    # Served from ix_chat_sessions_user_id_document_id_last_message_at
+    return await db.scalar(
+        query.order_by(ChatSession.last_message_at.desc()).limit(1)
+    )
+
+
+def chat_context_tokens(user_message: str, conversation: ConversationState) -> int:
+    """Tokens left for document content once the message, chat history and response buffer are counted"""
+    reserved_tokens = estimate_tokens_tiktoken(user_message) + CHAT_RESPONSE_BUFFER_TOKENS
+    # Chat history: summary plus recent exchanges, rendered and counted once per turn
+    reserved_tokens += conversation.history_tokens
+    return CHAT_MAX_CONTEXT_TOKENS - reserved_tokens
+
+
+def chat_token_budget(document_text: str, user_message: str, conversation: ConversationState) -> int:
+    """Most tokens chat_about_document can use: the prompt it builds plus the full response"""
+    # The document goes in whole if it fits, otherwise as relevant chunks filling the available context
+    document_tokens = min(
+        estimate_tokens_tiktoken(document_text), max(0, chat_context_tokens(user_message, conversation))
+    )
+    return (
+        document_tokens
+        + estimate_tokens_tiktoken(user_message)
+        + conversation.history_tokens
+        + CHAT_PROMPT_OVERHEAD_TOKENS
+        + CHAT_MAX_RESPONSE_TOKENS
+    )
+
+
 async def chat_about_document(
-    document: Document, user_message: str, chat_history: List
+    document_text: str, user_message: str, conversation: ConversationState
 ) -> str:
-    """Enhanced chat with Claude about a specific document using chunking"""
-    if not client:
+    """Enhanced chat about a specific document using chunking"""
+    if not provider_router.has_providers(TASK_CHAT):
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Anthropic API key not configured",
+            detail="No LLM provider configured",
         )
 
-    document_text = document.document_text
-    
     # Calculate available tokens for document content
-    max_context_tokens = 8000  # Conservative limit for Claude
-    
-    # Reserve tokens for user message and chat history
-    reserved_tokens = estimate_tokens_tiktoken(user_message) + 2000  # 2000 for response buffer
-    
-    # Add chat history tokens
-    history_text = ""
-    if chat_history:
-        for chat in chat_history[-5:]:  # Include last 5 exchanges
-            history_text += f"User: {chat.question}\nAssistant: {chat.answer}\n\n"
-    reserved_tokens += estimate_tokens_tiktoken(history_text)
-    
-    available_tokens = max_context_tokens - reserved_tokens
+    available_tokens = chat_context_tokens(user_message, conversation)
+    history_text = conversation.history_text
     
     # Check if document fits in available context
     document_tokens = estimate_tokens_tiktoken(document_text)
@@ -305,14 +340,14 @@ User question: {user_message}
 Please respond naturally and refer to specific parts of the document when relevant."""
 
     try:
-        response = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=1000,
+        response = await provider_router.complete(
+            TASK_CHAT,
+            prompt,
+            max_tokens=CHAT_MAX_RESPONSE_TOKENS,
             temperature=0.3,
-            messages=[{"role": "user", "content": prompt}],
         )
 
-        ai_response = response.content[0].text
+        ai_response = response.text
         
         # Add contextual note if we used chunking
         if document_tokens > available_tokens:
@@ -326,35 +361,41 @@ Please respond naturally and refer to specific parts of the document when releva
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Anthropic API error: {str(e)}",
+            detail=f"LLM provider error: {str(e)}",
         )
 
 
-@router.post("/casual-chat", response_model=CasualChatResponse)
-async def casual_chat(
-    chat_request: CasualChatRequest,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db),
-):
-    if not client:
-        raise HTTPException(status_code=500, detail="Anthropic not configured")
+async def casual_answer(message: str):
+    """Answer a casual message with the casual-chat models; returns the answer and the usage tally"""
+    if not provider_router.has_providers(TASK_CASUAL):
+        raise HTTPException(status_code=500, detail="No LLM provider configured")
 
     prompt = f"""This is a casual Q&A with the assistant. Please answer naturally.
 
-User: {chat_request.message}
+User: {message}
 Assistant:"""
 
-    try:
-        response = client.messages.create(
-            model="claude-sonnet-4-20250514",
+    with track_llm_usage() as llm_usage:
+        response = await provider_router.complete(
+            TASK_CASUAL,
+            prompt,
             max_tokens=1000,
             temperature=0.7,
-            messages=[{"role": "user", "content": prompt}],
         )
 
-        ai_response = response.content[0].text
+    logger.debug(f"🤖 Casual chat answered by {response.provider}/{response.model} ({len(response.text)} chars)")
+    return response.text, llm_usage
 
-        print(f"AI response: {ai_response}")
+
+@router.post("/casual-chat", response_model=CasualChatResponse, dependencies=[Depends(admit_llm_request)])
+async def casual_chat(
+    chat_request: CasualChatRequest,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Casual Q&A, routed to the cheaper casual-chat models"""
+    try:
+        ai_response, llm_usage = await casual_answer(chat_request.message)
 
         # Store chat in ChatHistory
         chat_entry = ChatHistory(
@@ -364,74 +405,58 @@ Assistant:"""
             answer=ai_response,
         )
 
-        print(f"Chat entry: {chat_entry}")
-
         db.add(chat_entry)
-        db.commit()
-        db.refresh(chat_entry)
+        await db.commit()
+        await db.refresh(chat_entry)
+        user_stats_cache.invalidate(current_user.id)
 
         # Usage tracking
-        print(
-            f"Current user ID: {current_user.id}",
-            increment_chat_usage(current_user.id, db),
-        )
         total_text = chat_request.message + ai_response
         estimated_tokens = estimate_tokens(total_text)
-        increment_token_usage(current_user.id, estimated_tokens, db)
-
-        get_user_limits_info(current_user, db)
-
-        print(
-            f"Current user ID: {current_user.id}",
-            get_user_limits_info(current_user, db),
+        await usage_meter.record(
+            db, current_user.id, "casual_chat",
+            chats=1, tokens=billable_tokens(llm_usage, estimated_tokens), llm_usage=llm_usage
         )
 
         return CasualChatResponse(
             ai_response=ai_response, timestamp=chat_entry.timestamp.isoformat()
         )
+    except HTTPException:
+        raise
+    except LLMProviderError as e:
+        raise HTTPException(status_code=503, detail=f"LLM provider error: {str(e)}")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Anthropic error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Casual chat error: {str(e)}")
 
 
 @router.post("/casual-chat-gemini", response_model=CasualChatResponse)
-async def casual_chat_gemini(chat_request: CasualChatRequest):
-    if not openai_client:
-        raise HTTPException(status_code=500, detail="OpenAI API key not configured")
+async def casual_chat_gemini(
+    chat_request: CasualChatRequest,
+    current_user: Optional[User] = Depends(admit_optional_user_llm_request),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Kept for existing clients. Signed-in users get the routed casual chat (history and usage
+    included); anonymous requests are still answered, without either, rate-limited per client IP."""
+    if current_user is not None:
+        return await casual_chat(chat_request, current_user, db)
 
     try:
-        print("Sending request to OpenRouter...")
-        print(f"OpenRouter API key is set: {bool(os.getenv('OPENROUTER_API_KEY'))}")
-        print("Chat message:", chat_request.message)
-
-        response = openai_client.chat.completions.create(
-            model="google/gemini-2.5-pro",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [{"type": "text", "text": chat_request.message}],
-                }
-            ],
-           
-        )
-
-        print(f"Response: {response}")
-
-        ai_response = response.choices[0].message.content  # Fixed attribute access
-        print(f"AI response: {ai_response}")
-
-        return CasualChatResponse(
-            ai_response=ai_response, timestamp=datetime.utcnow().isoformat()
-        )
-
+        ai_response, _ = await casual_answer(chat_request.message)
+    except HTTPException:
+        raise
+    except LLMProviderError as e:
+        raise HTTPException(status_code=503, detail=f"LLM provider error: {str(e)}")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"OpenAI error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Casual chat error: {str(e)}")
+
+    return CasualChatResponse(ai_response=ai_response, timestamp=datetime.now(timezone.utc).isoformat())
 
 
-@router.post("/", response_model=ChatResponse)
+@router.post("/", response_model=ChatResponse, dependencies=[Depends(admit_llm_request)])
 async def chat_with_document(
     chat_request: ChatRequest,
     current_user: User = Depends(check_chat_limit),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Chat about a previously analyzed document with chunking support"""
     print(
@@ -447,12 +472,11 @@ async def chat_with_document(
         )
     
     # Get the document
-    document = (
-        db.query(Document)
-        .filter(
+    document = await db.scalar(
+        select(Document)
+        .where(
             Document.id == chat_request.document_id, Document.user_id == current_user.id
         )
-        .first()
     )
 
     print(f"Document: {document}")
@@ -462,54 +486,82 @@ async def chat_with_document(
             status_code=status.HTTP_404_NOT_FOUND, detail="Document not found"
         )
 
-    try:
-        # Get existing chat history for context
-        chat_history = (
-            db.query(ChatHistory)
-            .filter(
-                ChatHistory.document_id == chat_request.document_id,
-                ChatHistory.user_id == current_user.id,
-            )
-            .order_by(ChatHistory.timestamp.desc())
-            .limit(10)
-            .all()
+    session = await find_chat_session(db, current_user.id, document.id, chat_request.session_id)
+    if session is None and chat_request.session_id is not None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Chat session not found"
         )
 
-        # Estimate tokens for the user message (AI response tokens will be estimated after)
-        estimated_input_tokens = estimate_tokens(chat_request.message + (document.document_text or "")[:2000])  # Sample of document for estimation
-        
-        # Check if user has enough tokens before making AI call
-        await check_token_limit(current_user, db, estimated_input_tokens)
+    try:
+        if session is not None:
+            session_id = session.id
+            # Conversation so far: rolling summary plus the recent exchanges of this session
+            conversation = await load_conversation_state(db, current_user.id, document.id, session_id)
+        else:
+            # First exchange about this document: the session is stored with its first message,
+            # so a failed answer leaves no empty session behind (reserving tokens commits)
+            session_id = uuid.uuid4()
+            conversation = ConversationState()
+
+        # Document text is stored apart from the document row
+        document_text = (await load_payload(db, document.id)).document_text
         
-        # Get AI response using enhanced chunking approach
-        ai_response = await chat_about_document(
-            document, chat_request.message, chat_history
+        # Reserve budget for the exchange (the whole prompt + longest possible response) before the AI call
+        reservation = await reserve_tokens(
+            current_user, db, chat_token_budget(document_text, chat_request.message, conversation)
         )
+        try:
+            # Get AI response using enhanced chunking approach, collecting provider-reported usage
+            with track_llm_usage() as llm_usage:
+                ai_response = await chat_about_document(
+                    document_text, chat_request.message, conversation
+                )
 
-        print(f"AI response: {ai_response}")
+            logger.debug(f"🤖 Document chat answered ({len(ai_response)} chars)")
 
-        # Store chat exchange in history
-        chat_entry = ChatHistory(
-            user_id=current_user.id,
-            document_id=chat_request.document_id,
-            question=chat_request.message,
-            answer=ai_response,
-        )
-
-        db.add(chat_entry)
-        db.commit()
-        db.refresh(chat_entry)
-        
-        # Store timestamp immediately after refresh to avoid connection issues
-        timestamp_iso = chat_entry.timestamp.isoformat()
+            if session is None:
+                db.add(ChatSession(id=session_id, user_id=current_user.id, document_id=document.id))
+                await db.flush()
 
-        # Update usage tracking
-        increment_chat_usage(current_user.id, db)
+            # Store chat exchange in history
+            chat_entry = ChatHistory(
+                user_id=current_user.id,
+                document_id=chat_request.document_id,
+                chat_session_id=session_id,
+                question=chat_request.message,
+                answer=ai_response,
+            )
 
-        # Estimate tokens used (user message + AI response)
-        total_text = chat_request.message + ai_response
-        estimated_tokens = estimate_tokens(total_text)
-        increment_token_usage(current_user.id, estimated_tokens, db)
+            db.add(chat_entry)
+            await db.execute(
+                update(ChatSession)
+                .where(ChatSession.id == session_id)
+                .values(message_count=ChatSession.message_count + 1, last_message_at=func.now())
+            )
+            await db.commit()
+            await db.refresh(chat_entry)
+        
+            # Store timestamp immediately after refresh to avoid connection issues
+            timestamp_iso = chat_entry.timestamp.isoformat()
+            remember_exchange(
+                current_user.id, chat_request.document_id, session_id, chat_entry.id, chat_entry.timestamp,
+                chat_request.message, ai_response
+            )
+            share_render_cache.invalidate(chat_session_id=session_id)
+            user_stats_cache.invalidate(current_user.id)
+
+            # Update usage tracking (estimate of user message + AI response if the provider reported nothing)
+            total_text = chat_request.message + ai_response
+            estimated_tokens = estimate_tokens(total_text)
+            await usage_meter.settle(
+                db, reservation, "chat",
+                tokens=billable_tokens(llm_usage, estimated_tokens), chats=1,
+                document_id=chat_request.document_id, llm_usage=llm_usage
+            )
+        except BaseException:
+            # Nothing was charged; hand the reserved budget back
+            await usage_meter.release(reservation)
+            raise
 
         return ChatResponse(
             success=True,
@@ -517,6 +569,7 @@ async def chat_with_document(
             user_message=chat_request.message,
             ai_response=ai_response,
             timestamp=timestamp_iso,
+            session_id=session_id,
         )
 
     except HTTPException:
@@ -536,45 +589,67 @@ async def chat_with_document(
 async def get_chat_history(
     document_id: uuid.UUID,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db),
-    skip: int = 0,
-    limit: int = 50,
+    db: AsyncSession = Depends(get_async_db),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=100),
+    cursor: Optional[str] = None,
+    session_id: Optional[uuid.UUID] = None,
 ):
-    """Get chat history for a document"""
+    """Get chat history for a document (all sessions, or one with session_id), a page at a time
+    from the latest exchange back. Each page is oldest first; pass next_cursor back as cursor
+    to load the earlier page."""
     # Verify document belongs to user
-    document = (
-        db.query(Document)
-        .filter(Document.id == document_id, Document.user_id == current_user.id)
-        .first()
-    )
+    document = (await db.execute(
+        select(Document.id, Document.filename)
+        .where(Document.id == document_id, Document.user_id == current_user.id)
+    )).first()
 
     if not document:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Document not found"
         )
 
-    # Get chat history
-    chat_history = (
-        db.query(ChatHistory)
-        .filter(
+    total = None
+    if session_id is not None:
+        session = await find_chat_session(db, current_user.id, document_id, session_id)
+        if session is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Chat session not found"
+            )
+        # Served from ix_chat_history_chat_session_id_timestamp_id; the session keeps its own count
+        document_chats = (ChatHistory.chat_session_id == session_id,)
+        total = session.message_count
+    else:
+        document_chats = (
             ChatHistory.document_id == document_id,
             ChatHistory.user_id == current_user.id,
         )
-        .order_by(ChatHistory.timestamp.desc())
-        .offset(skip)
-        .limit(limit)
-        .all()
+
+    # Get chat history
+    query = (
+        select(ChatHistory.id, ChatHistory.question, ChatHistory.answer, ChatHistory.timestamp)
+        .where(*document_chats)
+        .order_by(ChatHistory.timestamp.desc(), ChatHistory.id.desc())
+        .limit(limit + 1)
     )
+    if cursor:
+        # Keyset: exchanges older than the previous page, served from ix_chat_history_document_id_user_id_timestamp
+        timestamp, chat_id = decode_cursor(cursor)
+        query = query.where(tuple_(ChatHistory.timestamp, ChatHistory.id) < tuple_(timestamp, chat_id))
+    elif skip:
+        query = query.offset(skip)
+
+    chat_history = (await db.execute(query)).all()
+    has_more = len(chat_history) > limit
+    chat_history = chat_history[:limit]
 
     # Get total count
-    total = (
-        db.query(ChatHistory)
-        .filter(
-            ChatHistory.document_id == document_id,
-            ChatHistory.user_id == current_user.id,
+    if total is None:
+        total = await db.scalar(
+            select(func.count())
+            .select_from(ChatHistory)
+            .where(*document_chats)
         )
-        .count()
-    )
 
     chat_items = [
         ChatHistoryItem(
@@ -591,68 +666,84 @@ async def get_chat_history(
         filename=document.filename,
         chat_history=chat_items,
         total=total,
+        next_cursor=encode_cursor(chat_history[-1].timestamp, chat_history[-1].id) if has_more else None,
     )
 
 
 @router.get("/history", response_model=List[ChatHistoryResponse])
 async def get_all_chat_history(
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     skip: int = 0,
     limit: int = 10,
 ):
-    """Get chat history for all user's documents"""
-    # Get user's documents that have chat history
-    documents_with_chats = (
-        db.query(Document)
-        .join(ChatHistory, Document.id == ChatHistory.document_id)
-        .filter(Document.user_id == current_user.id)
-        .distinct()
+    """Get chat history for all user's documents, most recently active first (one query)"""
+    # Page of documents with per-document totals
+    page = (
+        select(
+            ChatHistory.document_id,
+            func.count().label("total"),
+            func.max(ChatHistory.timestamp).label("last_at"),
+        )
+        .join(Document, Document.id == ChatHistory.document_id)
+        .where(Document.user_id == current_user.id, ChatHistory.user_id == current_user.id)
+        .group_by(ChatHistory.document_id)
+        .order_by(func.max(ChatHistory.timestamp).desc(), ChatHistory.document_id)
         .offset(skip)
         .limit(limit)
-        .all()
+        .cte("page")
     )
-
-    result = []
-    for document in documents_with_chats:
-        # Get recent chat history for this document
-        recent_chats = (
-            db.query(ChatHistory)
-            .filter(
-                ChatHistory.document_id == document.id,
-                ChatHistory.user_id == current_user.id,
-            )
-            .order_by(ChatHistory.timestamp.desc())
-            .limit(5)  # Show only recent chats in summary
-            .all()
+    # Latest chats of each of those documents, numbered newest first
+    ranked = (
+        select(
+            ChatHistory.id,
+            ChatHistory.document_id,
+            ChatHistory.question,
+            ChatHistory.answer,
+            ChatHistory.timestamp,
+            func.row_number().over(
+                partition_by=ChatHistory.document_id,
+                order_by=ChatHistory.timestamp.desc(),
+            ).label("position"),
         )
-
-        # Get total count for this document
-        total_chats = (
-            db.query(ChatHistory)
-            .filter(
-                ChatHistory.document_id == document.id,
-                ChatHistory.user_id == current_user.id,
-            )
-            .count()
+        .where(
+            ChatHistory.user_id == current_user.id,
+            ChatHistory.document_id.in_(select(page.c.document_id)),
+        )
+        .cte("ranked")
+    )
+    rows = (await db.execute(
+        select(
+            page.c.document_id,
+            page.c.total,
+            Document.filename,
+            ranked.c.id,
+            ranked.c.question,
+            ranked.c.answer,
+            ranked.c.timestamp,
         )
+        .join(Document, Document.id == page.c.document_id)
+        .join(ranked, and_(ranked.c.document_id == page.c.document_id, ranked.c.position <= 5))  # Show only recent chats in summary
+        .order_by(page.c.last_at.desc(), page.c.document_id, ranked.c.timestamp.asc())
+    )).all()
 
-        chat_items = [
-            ChatHistoryItem(
-                id=chat.id,
-                user_message=chat.question,
-                ai_response=chat.answer,
-                timestamp=chat.timestamp.isoformat(),
+    result = []
+    for row in rows:
+        if not result or result[-1].document_id != row.document_id:
+            result.append(
+                ChatHistoryResponse(
+                    document_id=row.document_id,
+                    filename=row.filename,
+                    chat_history=[],
+                    total=row.total,
+                )
             )
-            for chat in reversed(recent_chats)
-        ]
-
-        result.append(
-            ChatHistoryResponse(
-                document_id=document.id,
-                filename=document.filename,
-                chat_history=chat_items,
-                total=total_chats,
+        result[-1].chat_history.append(
+            ChatHistoryItem(
+                id=row.id,
+                user_message=row.question,
+                ai_response=row.answer,
+                timestamp=row.timestamp.isoformat(),
             )
         )
 
@@ -663,14 +754,13 @@ async def get_all_chat_history(
 async def delete_chat_history(
     document_id: uuid.UUID,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Delete all chat history for a document"""
     # Verify document belongs to user
-    document = (
-        db.query(Document)
-        .filter(Document.id == document_id, Document.user_id == current_user.id)
-        .first()
+    document = await db.scalar(
+        select(Document.id)
+        .where(Document.id == document_id, Document.user_id == current_user.id)
     )
 
     if not document:
@@ -679,36 +769,119 @@ async def delete_chat_history(
         )
 
     # Delete chat history
-    deleted_count = (
-        db.query(ChatHistory)
-        .filter(
+    deleted_count = (await db.execute(
+        delete(ChatHistory)
+        .where(
             ChatHistory.document_id == document_id,
             ChatHistory.user_id == current_user.id,
         )
-        .delete()
+    )).rowcount
+    # Sessions go too (their summaries cascade)
+    session_ids = (await db.scalars(
+        delete(ChatSession)
+        .where(ChatSession.document_id == document_id, ChatSession.user_id == current_user.id)
+        .returning(ChatSession.id)
+    )).all()
+
+    await db.commit()
+    user_stats_cache.invalidate(current_user.id)
+    for session_id in session_ids:
+        conversation_cache.invalidate(current_user.id, session_id)
+        share_render_cache.invalidate(chat_session_id=session_id)
+
+    return {"message": f"Deleted {deleted_count} chat messages"}
+
+
+@router.post("/sessions", response_model=ChatSessionResponse)
+async def create_chat_session(
+    session_request: ChatSessionCreate,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Start a new conversation about a document; chats without a session_id continue it"""
+    document = await db.scalar(
+        select(Document.id)
+        .where(Document.id == session_request.document_id, Document.user_id == current_user.id)
     )
 
-    db.commit()
+    if not document:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Document not found"
+        )
 
-    return {"message": f"Deleted {deleted_count} chat messages"}
+    session = ChatSession(
+        user_id=current_user.id,
+        document_id=session_request.document_id,
+        title=session_request.title,
+    )
+    db.add(session)
+    await db.commit()
+    await db.refresh(session)
+    user_stats_cache.invalidate(current_user.id)
+
+    return session_response(session)
+
+
+@router.get("/sessions", response_model=List[ChatSessionResponse])
+async def get_chat_sessions(
+    document_id: uuid.UUID,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db),
+    limit: int = Query(20, ge=1, le=100),
+):
+    """Get the user's chat sessions about a document, most recently active first"""
+    sessions = (await db.scalars(
+        select(ChatSession)
+        .where(ChatSession.user_id == current_user.id, ChatSession.document_id == document_id)
+        .order_by(ChatSession.last_message_at.desc())
+        .limit(limit)
+    )).all()
+
+    return [session_response(session) for session in sessions]
+
+
+@router.delete("/sessions/{session_id}")
+async def delete_chat_session(
+    session_id: uuid.UUID,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Delete a chat session and its messages"""
+    # Messages and summary cascade
+    deleted = await db.scalar(
+        delete(ChatSession)
+        .where(ChatSession.id == session_id, ChatSession.user_id == current_user.id)
+        .returning(ChatSession.message_count)
+    )
+
+    if deleted is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Chat session not found"
+        )
+
+    await db.commit()
+    conversation_cache.invalidate(current_user.id, session_id)
+    share_render_cache.invalidate(chat_session_id=session_id)
+    user_stats_cache.invalidate(current_user.id)
+
+    return {"message": f"Deleted {deleted} chat messages"}
 
 
 @router.post("/create-public-share", response_model=CreatePublicShareResponse)
 async def create_public_share(
     share_request: CreatePublicShareRequest,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Create a public share link for a document's chat conversation"""
     
     # Verify document belongs to user
-    document = (
-        db.query(Document)
-        .filter(
+    document = await db.scalar(
+        select(Document.id)
+        .where(
             Document.id == share_request.document_id, 
             Document.user_id == current_user.id
         )
-        .first()
     )
 
     if not document:
@@ -717,48 +890,49 @@ async def create_public_share(
             detail="Document not found"
         )
 
-    # Check if document has any chat history
-    chat_history_exists = (
-        db.query(ChatHistory)
-        .filter(
-            ChatHistory.document_id == share_request.document_id,
-            ChatHistory.user_id == current_user.id,
+    session = await find_chat_session(db, current_user.id, share_request.document_id, share_request.session_id)
+
+    if session is None and share_request.session_id is not None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Chat session not found"
         )
-        .first()
-    )
 
-    if not chat_history_exists:
+    if session is None or not session.message_count:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Cannot share a conversation with no chat history"
         )
 
-    # Generate unique share token and chat session ID
-    share_token = secrets.token_urlsafe(32)
-    chat_session_id = uuid.uuid4()
-    
-    # Ensure token is unique (very unlikely to collide, but be safe)
-    while db.query(PublicChatShare).filter(PublicChatShare.share_token == share_token).first():
-        share_token = secrets.token_urlsafe(32)
-
     try:
-        # Create the public share record
-        public_share = PublicChatShare(
-            user_id=current_user.id,
-            document_id=share_request.document_id,
-            chat_session_id=chat_session_id,
-            share_token=share_token,
-            title=share_request.title,
-            description=share_request.description,
-            is_active=True,
-            allow_download=False,  # Default to false for simple implementation
-            password_protected=False,  # Default to false for simple implementation
-            view_count=0
-        )
+        # Create the public share record; the unique index on share_token settles collisions
+        for _ in range(SHARE_TOKEN_ATTEMPTS):
+            share_token = secrets.token_urlsafe(32)
+            created_at = await db.scalar(
+                pg_insert(PublicChatShare)
+                .values(
+                    id=uuid.uuid4(),
+                    user_id=current_user.id,
+                    document_id=share_request.document_id,
+                    chat_session_id=session.id,
+                    share_token=share_token,
+                    title=share_request.title,
+                    description=share_request.description,
+                    is_active=True,
+                    allow_download=False,  # Default to false for simple implementation
+                    password_protected=False,  # Default to false for simple implementation
+                    view_count=0
+                )
+                .on_conflict_do_nothing(index_elements=[PublicChatShare.share_token])
+                .returning(PublicChatShare.created_at)
+            )
+            if created_at is not None:
+                break
+        else:
+            raise RuntimeError("could not generate a unique share token")
 
-        db.add(public_share)
-        db.commit()
-        db.refresh(public_share)
+        await db.commit()
+        user_stats_cache.invalidate(current_user.id)
 
         # Construct the public URL (you may want to make this configurable)
         base_url = os.getenv("BASE_FRONTEND_URL")
@@ -770,32 +944,26 @@ async def create_public_share(
             share_url=share_url,
             title=share_request.title,
             description=share_request.description,
-            created_at=public_share.created_at.isoformat()
+            created_at=created_at.isoformat()
         )
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to create public share: {str(e)}"
         )
 
 
-@router.get("/public-share/{share_token}", response_model=PublicShareData)
-async def get_public_share(
-    share_token: str,
-    db: Session = Depends(get_db),
-):
-    """Get public share data by share token (accessible without authentication)"""
-    
+async def render_public_share(db: AsyncSession, share_token: str) -> RenderedShare:
+    """Public page of an active share, rendered to JSON once for the render cache"""
     # Find the public share
-    public_share = (
-        db.query(PublicChatShare)
-        .filter(
+    public_share = await db.scalar(
+        select(PublicChatShare)
+        .where(
             PublicChatShare.share_token == share_token,
             PublicChatShare.is_active == True
         )
-        .first()
     )
 
     if not public_share:
@@ -804,26 +972,11 @@ async def get_public_share(
             detail="Shared conversation not found or no longer available"
         )
 
-    # Check if share has expired (if expiration is set)
-    if public_share.expires_at and datetime.utcnow() > public_share.expires_at:
-        raise HTTPException(
-            status_code=status.HTTP_410_GONE,
-            detail="This shared conversation has expired"
-        )
-
-    # Check view limits (if set)
-    if public_share.max_views and public_share.view_count >= public_share.max_views:
-        raise HTTPException(
-            status_code=status.HTTP_410_GONE,
-            detail="This shared conversation has reached its view limit"
-        )
-
     # Get the document
-    document = (
-        db.query(Document)
-        .filter(Document.id == public_share.document_id)
-        .first()
-    )
+    document = (await db.execute(
+        select(Document.id, Document.filename, Document.summary, Document.file_url)
+        .where(Document.id == public_share.document_id)
+    )).first()
 
     if not document:
         raise HTTPException(
@@ -831,106 +984,90 @@ async def get_public_share(
             detail="Associated document not found"
         )
 
-    # Get chat history for this document
-    chat_history = (
-        db.query(ChatHistory)
-        .filter(
-            ChatHistory.document_id == public_share.document_id,
-            ChatHistory.user_id == public_share.user_id,
-        )
-        .order_by(ChatHistory.timestamp.asc())  # Chronological order for public view
-        .all()
+    # Get the shared session's chat history
+    chat_history = (await db.execute(
+        select(ChatHistory.id, ChatHistory.question, ChatHistory.answer, ChatHistory.timestamp)
+        .where(ChatHistory.chat_session_id == public_share.chat_session_id)
+        .order_by(ChatHistory.timestamp.asc(), ChatHistory.id.asc())  # Chronological order for public view
+    )).all()
+
+    # Document analysis data for public viewing
+    payload = await load_payload(db, document.id)
+
+    # Same fields as PublicShareData
+    body = orjson.dumps({
+        "view_count": public_share.view_count or 0,
+        "title": public_share.title,
+        "description": public_share.description,
+        "document_filename": document.filename,
+        "chat_history": [
+            {
+                "id": chat.id,
+                "user_message": chat.question,
+                "ai_response": chat.answer,
+                "timestamp": chat.timestamp.isoformat(),
+            }
+            for chat in chat_history
+        ],
+        "created_at": public_share.created_at.isoformat(),
+        "overview": document.summary or None,  # Use 'summary' field not 'overview'
+        "key_concepts": payload.analysis["key_concepts"],
+        "key_points": payload.analysis["key_points"],
+        "risk_flags": payload.analysis["risk_flags"],
+        "swot_analysis": payload.analysis["swot_analysis"],
+        "extracted_text": payload.document_text or None,
+        "file_url": document.file_url or None,
+    }, default=str)  # asyncpg's UUID type is not a uuid.UUID to orjson
+
+    return RenderedShare(
+        share_id=public_share.id,
+        user_id=public_share.user_id,
+        chat_session_id=public_share.chat_session_id,
+        body=body,
+        expires_at=public_share.expires_at,
+        max_views=public_share.max_views,
+        view_count=public_share.view_count or 0,
     )
 
-    # Convert to response format
-    chat_items = [
-        ChatHistoryItem(
-            id=chat.id,
-            user_message=chat.question,
-            ai_response=chat.answer,
-            timestamp=chat.timestamp.isoformat(),
+
+@router.get("/public-share/{share_token}", response_model=PublicShareData)
+async def get_public_share(
+    share_token: str,
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Get public share data by share token (accessible without authentication).
+    Served from the render cache; send If-None-Match with the ETag to get a 304."""
+    rendered = share_render_cache.get(share_token)
+    if rendered is None:
+        rendered = await render_public_share(db, share_token)
+        share_render_cache.put(share_token, rendered)
+
+    # Check if share has expired (if expiration is set)
+    if rendered.expires_at and datetime.now(timezone.utc) > rendered.expires_at:
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail="This shared conversation has expired"
         )
-        for chat in chat_history
-    ]
 
-    # Parse document analysis data for public viewing
-    overview = document.summary if document.summary else None  # Use 'summary' field not 'overview'
-    extracted_text = document.document_text if document.document_text else None  # Use 'document_text' field
-    file_url = document.file_url if document.file_url else None
-    
-    # Parse key concepts
-    key_concepts = []
-    if document.key_concepts:
-        try:
-            key_concepts = json.loads(document.key_concepts)
-            if not isinstance(key_concepts, list):
-                key_concepts = []
-        except (json.JSONDecodeError, TypeError):
-            key_concepts = []
-    
-    # Parse key points
-    key_points = []
-    if document.key_points:
-        try:
-            key_points = json.loads(document.key_points)
-            if not isinstance(key_points, list):
-                key_points = []
-        except (json.JSONDecodeError, TypeError):
-            key_points = []
-    
-    # Parse risk flags
-    risk_flags = []
-    if document.risk_flags:
-        try:
-            risk_flags = json.loads(document.risk_flags)
-            if not isinstance(risk_flags, list):
-                risk_flags = []
-        except (json.JSONDecodeError, TypeError):
-            risk_flags = []
-    
-    # Parse SWOT analysis
-    swot_analysis = {}
-    if document.swot_analysis:
-        try:
-            parsed_swot = json.loads(document.swot_analysis)
-            if isinstance(parsed_swot, dict):
-                swot_analysis = {
-                    "strengths": parsed_swot.get("strengths", []),
-                    "weaknesses": parsed_swot.get("weaknesses", []),
-                    "opportunities": parsed_swot.get("opportunities", []),
-                    "threats": parsed_swot.get("threats", [])
-                }
-        except (json.JSONDecodeError, TypeError):
-            swot_analysis = {}
-
-    # Increment view count and log the view
-    try:
-        public_share.view_count += 1
-        public_share.last_accessed = datetime.utcnow()
-        
-        # Log the view for analytics (optional: could extract IP, user agent from request)
-        view_log = PublicChatView(
-            share_id=public_share.id,
-            viewed_at=datetime.utcnow()
+    # Check view limits (if set)
+    if rendered.max_views and rendered.views >= rendered.max_views:
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail="This shared conversation has reached its view limit"
         )
-        db.add(view_log)
-        db.commit()
-    except Exception as e:
-        print(f"Warning: Failed to update view count: {e}")
-        db.rollback()
 
-    return PublicShareData(
-        title=public_share.title,
-        description=public_share.description,
-        document_filename=document.filename,
-        chat_history=chat_items,
-        view_count=public_share.view_count,
-        created_at=public_share.created_at.isoformat(),
-        overview=overview,
-        key_concepts=key_concepts,
-        key_points=key_points,
-        risk_flags=risk_flags,
-        swot_analysis=swot_analysis,
-        extracted_text=extracted_text,
-        file_url=file_url
-    )
\ No newline at end of file
+    # Count the view; the counters and analytics row are written in the background
+    share_render_cache.add_view(rendered)
+    forwarded_for = request.headers.get("X-Forwarded-For")
+    share_view_recorder.record(
+        rendered.share_id,
+        ip_address=forwarded_for.split(",")[0].strip() if forwarded_for else (request.client.host if request.client else None),
+        user_agent=request.headers.get("User-Agent"),
+        referrer=request.headers.get("Referer"),
+    )
+
+    headers = {"ETag": rendered.etag, "Cache-Control": "public, no-cache"}
+    if etag_matches(request.headers.get("If-None-Match"), rendered.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=rendered.body, media_type="application/json", headers=headers)
@@ -1,36 +1,54 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
 from typing import List, Optional
 import uuid
 from datetime import datetime
 
-from database import get_db
+from database import get_async_db
 from models import User, Collection, Document
 from dependencies import get_current_active_user
+from user_stats import user_stats_cache
+from collection_rollups import empty_rollup, load_rollup_json, rollup_cache
+
+# Characters of each document summary shown in collection listings
+SUMMARY_PREVIEW_LENGTH = 200
+
+async def add_to_document_count(db: AsyncSession, collection_id: uuid.UUID, user_id: uuid.UUID, delta: int) -> bool:
+    """Adjust a collection's document_count within the caller's transaction; False if the user has no such collection"""
+    result = await db.execute(
+        update(Collection)
+        .where(Collection.id == collection_id, Collection.user_id == user_id)
+        .values(document_count=Collection.document_count + delta)
+    )
+    return result.rowcount > 0
+
+async def require_collection(db: AsyncSession, collection_id: uuid.UUID, user_id: uuid.UUID):
+    """404 unless the user owns the collection; check before doing work destined for it"""
+    owned = await db.scalar(
+        select(Collection.id).where(Collection.id == collection_id, Collection.user_id == user_id)
+    )
+    if owned is None:
+        raise HTTPException(status_code=404, detail="Collection not found")
 
 # Helper function to check and delete empty collections
-def check_and_delete_empty_collection(db: Session, collection_id: uuid.UUID, user_id: uuid.UUID):
-    """Check if a collection is empty and delete it if so"""
-    remaining_documents_count = db.query(Document).filter(
-        Document.collection_id == collection_id,
-        Document.user_id == user_id
-    ).count()
-    
-    print(f"Collection {collection_id} has {remaining_documents_count} remaining documents")
-    
-    if remaining_documents_count == 0:
-        # Delete the empty collection
-        collection_to_delete = db.query(Collection).filter(
+async def check_and_delete_empty_collection(db: AsyncSession, collection_id: uuid.UUID, user_id: uuid.UUID):
+    """Delete the collection if it has no documents left"""
+    # One statement, so a document added meanwhile keeps the collection
+    deleted = (await db.execute(
+        delete(Collection).where(
             Collection.id == collection_id,
-            Collection.user_id == user_id
-        ).first()
-        
-        if collection_to_delete:
-            db.delete(collection_to_delete)
-            db.commit()
-            print(f"Deleted empty collection {collection_id}")
-            return True
+            Collection.user_id == user_id,
+            Collection.document_count <= 0
+        )
+    )).rowcount
+    await db.commit()
+
+    if deleted:
+        user_stats_cache.invalidate(user_id)
+        print(f"Deleted empty collection {collection_id}")
+        return True
     
     return False
 
@@ -59,7 +77,7 @@ class CollectionWithDocuments(BaseModel):
 async def create_collection(
     collection_data: CollectionCreate,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Create a new collection"""
     
@@ -71,8 +89,11 @@ async def create_collection(
     )
     
     db.add(new_collection)
-    db.commit()
-    db.refresh(new_collection)
+    await db.flush()
+    db.add(empty_rollup(new_collection.id))
+    await db.commit()
+    await db.refresh(new_collection)
+    user_stats_cache.invalidate(current_user.id)
     
     return CollectionResponse(
         id=new_collection.id,
@@ -85,44 +106,30 @@ async def create_collection(
 @router.get("/", response_model=List[CollectionResponse])
 async def get_user_collections(
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     skip: int = 0,
     limit: int = 50
 ):
     """Get user's collections with document counts"""
-    from sqlalchemy import func
-    
-    # Get collections with document counts
-    collections_query = (
-        db.query(
-            Collection,
-            func.count(Document.id).label('document_count')
-        )
-        .outerjoin(Document, Collection.id == Document.collection_id)
-        .filter(Collection.user_id == current_user.id)
-        .group_by(Collection.id)
+    # document_count is kept on the collection; no join over documents
+    collections = (await db.scalars(
+        select(Collection)
+        .where(Collection.user_id == current_user.id)
         .order_by(Collection.created_at.desc())
         .offset(skip)
         .limit(limit)
-    )
-    
-    results = collections_query.all()
-    
-    print("Results:", results)
+    )).all()
     
     collection_responses = []
-    for collection, doc_count in results:
+    for collection in collections:
         collection_responses.append(CollectionResponse(
             id=collection.id,
             name=collection.name,
             description=collection.description,
             created_at=collection.created_at.isoformat(),
-            document_count=doc_count or 0
+            document_count=collection.document_count
         ))
         
-        print("Collection:", collection)
-        print("Doc count:", doc_count)
-        
     print("Collection responses:", collection_responses)
     
     return collection_responses
@@ -131,15 +138,14 @@ async def get_user_collections(
 async def get_collection_with_documents(
     collection_id: uuid.UUID,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get a specific collection with its documents"""
     
     # Get collection
-    collection = (
-        db.query(Collection)
-        .filter(Collection.id == collection_id, Collection.user_id == current_user.id)
-        .first()
+    collection = await db.scalar(
+        select(Collection)
+        .where(Collection.id == collection_id, Collection.user_id == current_user.id)
     )
     
     if not collection:
@@ -149,12 +155,19 @@ async def get_collection_with_documents(
         )
     
     # Get documents in this collection
-    documents = (
-        db.query(Document)
-        .filter(Document.collection_id == collection_id, Document.user_id == current_user.id)
+    documents = (await db.execute(
+        select(
+            Document.id,
+            Document.filename,
+            Document.filesize,
+            Document.word_count,
+            # Only the preview is returned; never read the full summary (or the document text)
+            func.substr(Document.summary, 1, SUMMARY_PREVIEW_LENGTH + 1).label("summary"),
+            Document.uploaded_at
+        )
+        .where(Document.collection_id == collection_id, Document.user_id == current_user.id)
         .order_by(Document.uploaded_at.desc())
-        .all()
-    )
+    )).all()
     
     print("Documents:", documents)
     
@@ -165,7 +178,7 @@ async def get_collection_with_documents(
             "filename": doc.filename,
             "filesize": doc.filesize,
             "word_count": doc.word_count,
-            "summary": doc.summary[:200] + "..." if doc.summary and len(doc.summary) > 200 else doc.summary,
+            "summary": doc.summary[:SUMMARY_PREVIEW_LENGTH] + "..." if doc.summary and len(doc.summary) > SUMMARY_PREVIEW_LENGTH else doc.summary,
             "uploaded_at": doc.uploaded_at.isoformat()
         })
     
@@ -177,20 +190,34 @@ async def get_collection_with_documents(
         documents=document_list
     )
 
+@router.get("/{collection_id}/rollup")
+async def get_collection_rollup(
+    collection_id: uuid.UUID,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Merged SWOT, top risks and key concepts across the collection's documents, with document counts"""
+    body = await load_rollup_json(db, collection_id, current_user.id)
+    if body is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Collection not found"
+        )
+    return Response(content=body, media_type="application/json")
+
 @router.put("/{collection_id}", response_model=CollectionResponse)
 async def update_collection(
     collection_id: uuid.UUID,
     collection_data: CollectionCreate,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Update a collection"""
     
     # Get collection
-    collection = (
-        db.query(Collection)
-        .filter(Collection.id == collection_id, Collection.user_id == current_user.id)
-        .first()
+    collection = await db.scalar(
+        select(Collection)
+        .where(Collection.id == collection_id, Collection.user_id == current_user.id)
     )
     
     if not collection:
@@ -203,25 +230,22 @@ async def update_collection(
     collection.name = collection_data.name.strip()
     collection.description = collection_data.description.strip() if collection_data.description else None
     
-    db.commit()
-    db.refresh(collection)
-    
-    # Get document count
-    document_count = db.query(Document).filter(Document.collection_id == collection_id).count()
+    await db.commit()
+    await db.refresh(collection)
     
     return CollectionResponse(
         id=collection.id,
         name=collection.name,
         description=collection.description,
         created_at=collection.created_at.isoformat(),
-        document_count=document_count
+        document_count=collection.document_count
     )
 
 @router.post("/delete")
 async def delete_collection(
     collection_id: str,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Delete a collection and optionally its documents"""
     try:
@@ -230,10 +254,9 @@ async def delete_collection(
         raise HTTPException(status_code=400, detail="Invalid collection ID format")
     
     # Get collection
-    collection = (
-        db.query(Collection)
-        .filter(Collection.id == collection_uuid, Collection.user_id == current_user.id)
-        .first()
+    collection = await db.scalar(
+        select(Collection)
+        .where(Collection.id == collection_uuid, Collection.user_id == current_user.id)
     )
     
     if not collection:
@@ -244,14 +267,17 @@ async def delete_collection(
     
     # Remove collection_id from all documents in this collection
     # (This keeps the documents but removes them from the collection)
-    db.query(Document).filter(
-        Document.collection_id == collection_uuid,
-        Document.user_id == current_user.id
-    ).update({"collection_id": None})
+    await db.execute(
+        update(Document)
+        .where(Document.collection_id == collection_uuid, Document.user_id == current_user.id)
+        .values(collection_id=None)
+    )
     
-    # Delete the collection
-    db.delete(collection)
-    db.commit()
+    # Delete the collection (and its rollup)
+    await db.delete(collection)
+    await db.commit()
+    user_stats_cache.invalidate(current_user.id)
+    rollup_cache.invalidate(collection_uuid)
     
     return {"message": "Collection deleted successfully"}
 
@@ -259,16 +285,15 @@ async def delete_collection(
 async def get_collection_by_document(
     document_id: uuid.UUID,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get collection that contains a specific document"""
     
     # Get document to find its collection
-    document = (
-        db.query(Document)
-        .filter(Document.id == document_id, Document.user_id == current_user.id)
-        .first()
-    )
+    document = (await db.execute(
+        select(Document.id, Document.collection_id)
+        .where(Document.id == document_id, Document.user_id == current_user.id)
+    )).first()
     
     if not document:
         raise HTTPException(
@@ -283,10 +308,9 @@ async def get_collection_by_document(
         )
         
     # Get collection with its documents
-    collection = (
-        db.query(Collection)
-        .filter(Collection.id == document.collection_id, Collection.user_id == current_user.id)
-        .first()
+    collection = await db.scalar(
+        select(Collection)
+        .where(Collection.id == document.collection_id, Collection.user_id == current_user.id)
     )
     
     if not collection:
@@ -296,12 +320,19 @@ async def get_collection_by_document(
         )
     
     # Get all documents in this collection
-    documents = (
-        db.query(Document)
-        .filter(Document.collection_id == collection.id, Document.user_id == current_user.id)
+    documents = (await db.execute(
+        select(
+            Document.id,
+            Document.filename,
+            Document.filesize,
+            Document.word_count,
+            # Only the preview is returned; never read the full summary (or the document text)
+            func.substr(Document.summary, 1, SUMMARY_PREVIEW_LENGTH + 1).label("summary"),
+            Document.uploaded_at
+        )
+        .where(Document.collection_id == collection.id, Document.user_id == current_user.id)
         .order_by(Document.uploaded_at.desc())
-        .all()
-    )
+    )).all()
     
     document_list = []
     for doc in documents:
@@ -310,7 +341,7 @@ async def get_collection_by_document(
             "filename": doc.filename,
             "filesize": doc.filesize,
             "word_count": doc.word_count,
-            "summary": doc.summary[:200] + "..." if doc.summary and len(doc.summary) > 200 else doc.summary,
+            "summary": doc.summary[:SUMMARY_PREVIEW_LENGTH] + "..." if doc.summary and len(doc.summary) > SUMMARY_PREVIEW_LENGTH else doc.summary,
             "uploaded_at": doc.uploaded_at.isoformat()
         })
     
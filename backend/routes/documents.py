@@ -1,30 +1,42 @@
-from fastapi import APIRouter, Depends, HTTPException, status, File, UploadFile, Form
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, status, File, UploadFile, Form, Query, Response
+from sqlalchemy import select, delete, func, literal_column, tuple_
+from sqlalchemy.orm import load_only
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
-import json
+import orjson
 from io import BytesIO
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from database import supabase
 import uuid
 
-from database import get_db
-from models import User, Document, ChatHistory, Collection, PublicChatShare, PublicChatView
+from database import AsyncSessionLocal, get_async_db
+from models import User, Document, DocumentContent, ChatHistory, AccountDeletionJob
 from dependencies import (
     get_current_active_user, 
     check_document_limit,
-    check_token_limit,
-    increment_document_usage,
-    increment_token_usage,
+    admit_llm_request,
+    reserve_tokens,
     estimate_tokens
 )
-from routes.collections import check_and_delete_empty_collection
+from routes.collections import add_to_document_count, check_and_delete_empty_collection, require_collection
+from analysis_coalescer import coalesce_analysis, content_hash
+from usage_metering import billable_tokens, usage_meter
+from llm_router import track_llm_usage
+from pagination import COUNT_MODES, count_rows, decode_cursor, encode_cursor
+from document_store import add_payload, load_analysis, load_analysis_json, load_payload
+from conversation_state import conversation_cache
+from public_shares import share_render_cache
+from account_deletion import account_deleter, deletion_preview, latest_deletion_job
+from user_stats import user_stats_cache
+from collection_rollups import add_document as add_to_rollup, remove_document as remove_from_rollup, rollup_cache
 
 # Import document processing functions from utility module
 from document_utils import (
     extract_text_from_pdf,
     extract_text_from_docx,
     analyze_document_with_chunking,
+    analysis_token_budget,
     count_words,
     split_text_into_chunks,
     should_chunk_document,
@@ -33,6 +45,23 @@ from document_utils import (
 
 router = APIRouter(prefix="/documents", tags=["documents"])
 
+# Columns a document listing returns. document_text and the analysis columns can be
+# megabytes per row, so listings select these explicitly instead of whole Documents.
+DOCUMENT_LIST_COLUMNS = (
+    Document.id,
+    Document.collection_id,
+    Document.filename,
+    Document.filesize,
+    Document.word_count,
+    Document.summary,
+    Document.analysis_method,
+    Document.file_url,
+    Document.uploaded_at,
+)
+
+# Identical submissions within this window are served from the stored analysis
+DUPLICATE_ANALYSIS_WINDOW = timedelta(minutes=10)
+
 # Pydantic models
 class DocumentResponse(BaseModel):
     id: uuid.UUID
@@ -59,20 +88,31 @@ class DocumentAnalysisResponse(BaseModel):
     document_text: str  # Add document text for frontend highlighting
     analyzed_at: str
 
+def parse_collection_id(collection_id: Optional[str]) -> Optional[uuid.UUID]:
+    """Collection id from a request, or None; 400 if malformed"""
+    if not collection_id:
+        return None
+    try:
+        return uuid.UUID(collection_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid collection ID.")
+
 class TextAnalysisRequest(BaseModel):
     text: str
     collection_id: Optional[str] = None
 
 class DocumentListResponse(BaseModel):
     documents: List[DocumentResponse]
-    total: int
+    total: Optional[int] = None
+    total_is_estimate: bool = False
+    next_cursor: Optional[str] = None
 
-@router.post("/upload", response_model=DocumentAnalysisResponse)
+@router.post("/upload", response_model=DocumentAnalysisResponse, dependencies=[Depends(admit_llm_request)])
 async def upload_and_analyze_document(
     file: UploadFile = File(...),
     current_user: User = Depends(check_document_limit),
     collection_id: Optional[str] = Form(None),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Upload and analyze a PDF or DOCX file"""
     # Check file type
@@ -90,6 +130,30 @@ async def upload_and_analyze_document(
             detail="File too large. Maximum size is 10MB"
         )
     
+    parsed_collection_id = parse_collection_id(collection_id)
+    if parsed_collection_id:
+        # Before the file is stored and analyzed, so a bad id costs nothing
+        await require_collection(db, parsed_collection_id, current_user.id)
+
+    # Coalesce double-clicked / repeated uploads of the same file (into the same collection) into one analysis
+    file_hash = content_hash(file_bytes)
+    await db.commit()  # End the read transaction; waiting for another worker's analysis holds no connection
+    return await coalesce_analysis(
+        f"{current_user.id}:{parsed_collection_id}:{file_hash}",
+        lambda: _upload_and_analyze(file, file_bytes, file_hash, current_user, parsed_collection_id, db),
+        lambda: lookup_duplicate_analysis(current_user.id, file_hash, parsed_collection_id),
+    )
+
+async def _upload_and_analyze(
+    file: UploadFile,
+    file_bytes: bytes,
+    file_hash: str,
+    current_user: User,
+    parsed_collection_id: Optional[uuid.UUID],
+    db: AsyncSession
+) -> DocumentAnalysisResponse:
+    """Store the file, run the analysis and persist the document"""
+    reservation = None
     try:
         
         print("Supabase URL:", supabase.supabase_url)
@@ -173,14 +237,15 @@ async def upload_and_analyze_document(
         word_count = count_words(text)
         chunks = split_text_into_chunks(text) if should_chunk_document(text) else [text]
         
-        # Estimate tokens for usage tracking
+        # Estimate tokens for usage tracking (charged only if the provider reports nothing)
         estimated_tokens = estimate_tokens(text)
         
-        # Check if user has enough tokens before analysis
-        await check_token_limit(current_user, db, estimated_tokens)
+        # Reserve the most the analysis can use (every chunk's prompt and response) before running it
+        reservation = await reserve_tokens(current_user, db, analysis_token_budget(text))
         
-        # Analyze document with chunking if needed
-        analysis = await analyze_document_with_chunking(text)
+        # Analyze document with chunking if needed, collecting provider-reported usage
+        with track_llm_usage() as llm_usage:
+            analysis = await analyze_document_with_chunking(text)
         print("Analysis result:", analysis)
         
         print("Key points:", analysis.get("key_points"))
@@ -199,45 +264,44 @@ async def upload_and_analyze_document(
                 position = find_quote_position(text, risk_flag["quote"])
                 risk_flag["position"] = position
                 
-        parsed_collection_id = None
-        if collection_id:
-            try:
-                parsed_collection_id = uuid.UUID(collection_id)
-            except ValueError:
-                raise HTTPException(status_code=400, detail="Invalid collection ID.")
-
-        
         # Store document in database
         new_document = Document(
             user_id=current_user.id,
             collection_id=parsed_collection_id,
             filename=file.filename,
             filesize=len(file_bytes),
-            document_text=text,
             summary=analysis.get("summary", ""),
-            problem_context=analysis.get("problem_context", ""),
-            key_points=json.dumps(analysis.get("key_points", [])),
-            risk_flags=json.dumps(analysis.get("risk_flags", [])),
-            key_concepts=json.dumps(analysis.get("key_concepts", [])),
-            swot_analysis=json.dumps(analysis.get("swot_analysis", {})), 
-            recommendations=json.dumps(analysis.get("recommendations", {})),
-            impact=json.dumps(analysis.get("impact_analysis", {})),
             word_count=word_count,
             analysis_method=analysis.get("analysis_method", "single"),
-            file_url=file_url  # Store the file URL for later retrieval
+            file_url=file_url,  # Store the file URL for later retrieval
+            content_hash=file_hash
         )
         
         print(f"Creating document with user_id: {current_user.id}, collection_id: {parsed_collection_id}, file_url: {file_url}")
         
-        db.add(new_document)
-        db.commit()
-        db.refresh(new_document)
+        if parsed_collection_id:
+            if not await add_to_document_count(db, parsed_collection_id, current_user.id, 1):
+                # Deleted while the document was being analyzed
+                raise HTTPException(status_code=404, detail="Collection not found")
+            await add_to_rollup(db, parsed_collection_id, analysis)
+        
+        # Text and analysis go to document_contents, compressed
+        add_payload(db, new_document, text, analysis)
+        await db.commit()
+        await db.refresh(new_document)
+        user_stats_cache.invalidate(current_user.id)
+        if parsed_collection_id:
+            rollup_cache.invalidate(parsed_collection_id)
         
         print(f"Document saved with ID: {new_document.id}, file_url: {new_document.file_url}")
         
-        # Update usage tracking
-        increment_document_usage(current_user.id, db)
-        increment_token_usage(current_user.id, estimated_tokens, db)
+        # Update usage tracking and free the rest of the reservation
+        await usage_meter.settle(
+            db, reservation, "document_analysis",
+            tokens=billable_tokens(llm_usage, estimated_tokens), docs=1,
+            document_id=new_document.id, llm_usage=llm_usage
+        )
+        reservation = None
         
         return DocumentAnalysisResponse(
             success=True,
@@ -264,12 +328,16 @@ async def upload_and_analyze_document(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error processing file: {str(e)}"
         )
+    finally:
+        if reservation is not None:
+            # Analysis failed before usage was charged; hand the budget back
+            await usage_meter.release(reservation)
 
-@router.post("/analyze-text", response_model=DocumentAnalysisResponse)
+@router.post("/analyze-text", response_model=DocumentAnalysisResponse, dependencies=[Depends(admit_llm_request)])
 async def analyze_text_direct(
     request: TextAnalysisRequest,
     current_user: User = Depends(check_document_limit),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Analyze pasted text directly"""
     text = request.text.strip()
@@ -286,19 +354,42 @@ async def analyze_text_direct(
             detail="Text too long. Maximum length is 50,000 characters"
         )
     
+    parsed_collection_id = parse_collection_id(request.collection_id)
+    if parsed_collection_id:
+        await require_collection(db, parsed_collection_id, current_user.id)
+
+    # Coalesce identical in-flight submissions (e.g. two tabs) into the same collection into one analysis
+    text_hash = content_hash(text)
+    await db.commit()  # End the read transaction; waiting for another worker's analysis holds no connection
+    return await coalesce_analysis(
+        f"{current_user.id}:{parsed_collection_id}:{text_hash}",
+        lambda: _analyze_text(text, text_hash, parsed_collection_id, current_user, db),
+        lambda: lookup_duplicate_analysis(current_user.id, text_hash, parsed_collection_id),
+    )
+
+async def _analyze_text(
+    text: str,
+    text_hash: str,
+    parsed_collection_id: Optional[uuid.UUID],
+    current_user: User,
+    db: AsyncSession
+) -> DocumentAnalysisResponse:
+    """Run the analysis for pasted text and persist the document"""
+    reservation = None
     try:
         # Calculate document statistics
         word_count = count_words(text)
         chunks = split_text_into_chunks(text) if should_chunk_document(text) else [text]
         
-        # Estimate tokens for usage tracking
+        # Estimate tokens for usage tracking (charged only if the provider reports nothing)
         estimated_tokens = estimate_tokens(text)
         
-        # Check if user has enough tokens before analysis
-        await check_token_limit(current_user, db, estimated_tokens)
+        # Reserve the most the analysis can use (every chunk's prompt and response) before running it
+        reservation = await reserve_tokens(current_user, db, analysis_token_budget(text))
         
-        # Analyze with chunking if needed
-        analysis = await analyze_document_with_chunking(text)
+        # Analyze with chunking if needed, collecting provider-reported usage
+        with track_llm_usage() as llm_usage:
+            analysis = await analyze_document_with_chunking(text)
         
         # Add position information for highlighting
         for key_point in analysis.get("key_points", []):
@@ -311,41 +402,40 @@ async def analyze_text_direct(
                 position = find_quote_position(text, risk_flag["quote"])
                 risk_flag["position"] = position
         
-        # Parse collection_id if provided
-        parsed_collection_id = None
-        if request.collection_id:
-            try:
-                parsed_collection_id = uuid.UUID(request.collection_id)
-            except ValueError:
-                raise HTTPException(status_code=400, detail="Invalid collection ID.")
-        
         # Store document in database
         new_document = Document(
             user_id=current_user.id,
             collection_id=parsed_collection_id,
             filename="Pasted Text",
             filesize=len(text.encode('utf-8')),
-            document_text=text,
             summary=analysis.get("summary", ""),
-            problem_context=analysis.get("problem_context", ""),
-            key_points=json.dumps(analysis.get("key_points", [])),
-            risk_flags=json.dumps(analysis.get("risk_flags", [])),
-            key_concepts=json.dumps(analysis.get("key_concepts", [])),
-            swot_analysis=json.dumps(analysis.get("swot_analysis", {})),
-            recommendations=json.dumps(analysis.get("recommendations", {})),
-            impact=json.dumps(analysis.get("impact_analysis", {})),
             word_count=word_count,
             analysis_method=analysis.get("analysis_method", "single"),
-            file_url=None  # Text documents don't have file URLs
+            file_url=None,  # Text documents don't have file URLs
+            content_hash=text_hash
         )
         
-        db.add(new_document)
-        db.commit()
-        db.refresh(new_document)
-        
-        # Update usage tracking
-        increment_document_usage(current_user.id, db)
-        increment_token_usage(current_user.id, estimated_tokens, db)
+        if parsed_collection_id:
+            if not await add_to_document_count(db, parsed_collection_id, current_user.id, 1):
+                # Deleted while the document was being analyzed
+                raise HTTPException(status_code=404, detail="Collection not found")
+            await add_to_rollup(db, parsed_collection_id, analysis)
+        
+        # Text and analysis go to document_contents, compressed
+        add_payload(db, new_document, text, analysis)
+        await db.commit()
+        await db.refresh(new_document)
+        user_stats_cache.invalidate(current_user.id)
+        if parsed_collection_id:
+            rollup_cache.invalidate(parsed_collection_id)
+        
+        # Update usage tracking and free the rest of the reservation
+        await usage_meter.settle(
+            db, reservation, "document_analysis",
+            tokens=billable_tokens(llm_usage, estimated_tokens), docs=1,
+            document_id=new_document.id, llm_usage=llm_usage
+        )
+        reservation = None
         
         return DocumentAnalysisResponse(
             success=True,
@@ -372,27 +462,97 @@ async def analyze_text_direct(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error analyzing text: {str(e)}"
         )
+    finally:
+        if reservation is not None:
+            # Analysis failed before usage was charged; hand the budget back
+            await usage_meter.release(reservation)
+
+async def lookup_duplicate_analysis(
+    user_id: uuid.UUID,
+    document_hash: str,
+    collection_id: Optional[uuid.UUID] = None
+) -> Optional[DocumentAnalysisResponse]:
+    """find_recent_duplicate_analysis in a short session of its own, for coalescing waiters that poll"""
+    async with AsyncSessionLocal() as db:
+        return await find_recent_duplicate_analysis(db, user_id, document_hash, collection_id)
+
+async def find_recent_duplicate_analysis(
+    db: AsyncSession,
+    user_id: uuid.UUID,
+    document_hash: str,
+    collection_id: Optional[uuid.UUID] = None
+) -> Optional[DocumentAnalysisResponse]:
+    """Return the stored analysis of an identical submission into the same collection made within the duplicate window"""
+    since = datetime.now(timezone.utc) - DUPLICATE_ANALYSIS_WINDOW
+    document = await db.scalar(
+        select(Document)
+        .where(
+            Document.user_id == user_id,
+            Document.content_hash == document_hash,
+            Document.collection_id.is_(None) if collection_id is None else Document.collection_id == collection_id,
+            Document.uploaded_at >= since
+        )
+        .order_by(Document.uploaded_at.desc())
+        .limit(1)
+    )
+    if not document:
+        return None
+    
+    payload = await load_payload(db, document.id)
+    text = payload.document_text
+    analysis_method = document.analysis_method or "single"
+    analysis = {
+        "summary": document.summary,
+        **payload.analysis,
+        "analysis_method": analysis_method
+    }
+    
+    return DocumentAnalysisResponse(
+        success=True,
+        document_id=document.id,
+        collection_id=document.collection_id,
+        filename=document.filename,
+        file_size=document.filesize,
+        text_length=len(text),
+        word_count=document.word_count or 0,
+        chunk_count=len(split_text_into_chunks(text)) if should_chunk_document(text) else 1,
+        analysis_method=analysis_method,
+        analysis=analysis,
+        document_text=text,
+        analyzed_at=document.uploaded_at.isoformat()
+    )
 
 @router.get("/", response_model=DocumentListResponse)
 async def get_user_documents(
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db),
-    skip: int = 0,
-    limit: int = 10
+    db: AsyncSession = Depends(get_async_db),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(10, ge=1, le=100),
+    cursor: Optional[str] = None,
+    count: str = Query("exact", pattern=f"^({'|'.join(COUNT_MODES)})$")
 ):
-    """Get user's documents with pagination"""
-    # Get user's documents
-    documents = (
-        db.query(Document)
-        .filter(Document.user_id == current_user.id)
-        .order_by(Document.uploaded_at.desc())
-        .offset(skip)
-        .limit(limit)
-        .all()
+    """Get user's documents, newest first. Pass next_cursor back as cursor for the following page
+    (skip still works for the first pages); count is exact, estimated or none."""
+    user_documents = select(Document.id).where(Document.user_id == current_user.id)
+    
+    query = (
+        select(*DOCUMENT_LIST_COLUMNS)
+        .where(Document.user_id == current_user.id)
+        .order_by(Document.uploaded_at.desc(), Document.id.desc())
+        .limit(limit + 1)
     )
+    if cursor:
+        # Keyset: rows strictly after the last one returned, served from ix_documents_user_id_uploaded_at_id
+        uploaded_at, document_id = decode_cursor(cursor)
+        query = query.where(tuple_(Document.uploaded_at, Document.id) < tuple_(uploaded_at, document_id))
+    elif skip:
+        query = query.offset(skip)
+    
+    documents = (await db.execute(query)).all()
+    has_more = len(documents) > limit
+    documents = documents[:limit]
     
-    # Get total count
-    total = db.query(Document).filter(Document.user_id == current_user.id).count()
+    total, total_is_estimate = await count_rows(db, user_documents, count)
     
     document_responses = [
         DocumentResponse(
@@ -403,7 +563,7 @@ async def get_user_documents(
             word_count=doc.word_count,
             summary=doc.summary,
             analysis_method=doc.analysis_method,
-            file_url=getattr(doc, 'file_url', None),
+            file_url=doc.file_url,
             uploaded_at=doc.uploaded_at.isoformat()
         )
         for doc in documents
@@ -411,20 +571,134 @@ async def get_user_documents(
     
     return DocumentListResponse(
         documents=document_responses,
-        total=total
+        total=total,
+        total_is_estimate=total_is_estimate,
+        next_cursor=encode_cursor(documents[-1].uploaded_at, documents[-1].id) if has_more else None
     )
 
+# Stored analyses are JSONB (document_contents.analysis), so these run in Postgres over
+# the GIN jsonb_path_ops index instead of loading and parsing every document
+# Placeholder impact entries (document_store._generated_impact) carry "generated" and are not counted
+HIGH_IMPACT_RISK_PATH = literal_column("""'$.impact_analysis.risks_impact[*] ? (@.impact_level == "high" && !exists(@.generated))'::jsonpath""")
+RISK_IMPACT_LEVEL_PATH = literal_column("'$.impact_analysis.risks_impact[*] ? (!exists(@.generated)).impact_level'::jsonpath")
+
+@router.get("/insights/risks")
+async def get_risk_insights(
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db),
+    collection_id: Optional[uuid.UUID] = None
+):
+    """Count analyzed documents with high-impact risks and risks by impact level, across the user's documents"""
+    scope = [Document.user_id == current_user.id]
+    if collection_id:
+        scope.append(Document.collection_id == collection_id)
+    
+    counts = (await db.execute(
+        select(
+            func.count(),
+            func.count().filter(DocumentContent.analysis.op("@?")(HIGH_IMPACT_RISK_PATH))
+        )
+        .select_from(DocumentContent)
+        .join(Document, Document.id == DocumentContent.document_id)
+        .where(*scope)
+    )).first()
+    
+    levels = (
+        select(func.jsonb_path_query(DocumentContent.analysis, RISK_IMPACT_LEVEL_PATH).label("level"))
+        .select_from(DocumentContent)
+        .join(Document, Document.id == DocumentContent.document_id)
+        .where(*scope)
+        .subquery()
+    )
+    risk_levels = (await db.execute(
+        select(levels.c.level.op("#>>")(literal_column("'{}'")), func.count())
+        .group_by(levels.c.level)
+    )).all()
+    
+    return {
+        "documents_analyzed": counts[0],
+        "documents_with_high_impact_risks": counts[1],
+        "risks_by_impact_level": {level or "unknown": count for level, count in risk_levels}
+    }
+
+def deletion_job_response(job: AccountDeletionJob) -> Dict[str, Any]:
+    progress = job.progress or {}
+    totals = job.totals or {}
+    if job.status == "completed":
+        message = (
+            f"Successfully deleted all user data: {progress.get('documents_deleted', 0)} documents, "
+            f"{progress.get('chat_history_deleted', 0)} chat messages, {progress.get('public_views_deleted', 0)} public views, "
+            f"{progress.get('public_shares_deleted', 0)} public shares, {progress.get('collections_deleted', 0)} collections"
+        )
+        if progress.get("storage_files_deleted"):
+            message += f", {progress['storage_files_deleted']} files from storage"
+        if progress.get("storage_errors"):
+            message += f" (with {progress['storage_errors']} storage errors)"
+    elif job.status == "failed":
+        message = "Deleting your data stopped before it finished; start it again to continue"
+    else:
+        message = (
+            f"Deleting your data: {progress.get('documents_deleted', 0)} of "
+            f"{totals.get('documents_to_delete', 0)} documents deleted so far"
+        )
+
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "step": job.step,
+        "message": message,
+        "summary": progress,
+        "totals": totals,
+        "error": job.last_error if job.status == "failed" else None,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "completed_at": job.completed_at.isoformat() if job.completed_at else None
+    }
+
+# Declared before /{document_id}, which would otherwise match these paths
+@router.get("/deletion-preview")
+async def get_deletion_preview(
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Get a preview of what would be deleted"""
+    try:
+        preview = await deletion_preview(db, current_user.id)
+    except Exception as error:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to get deletion preview: {str(error)}"
+        )
+
+    return {
+        "preview": preview,
+        "warning": "This action cannot be undone. All data will be permanently deleted."
+    }
+
+@router.get("/deletion-status")
+async def get_deletion_status(
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Progress of the user's latest delete-all request"""
+    job = await latest_deletion_job(db, current_user.id)
+    if not job:
+        raise HTTPException(status_code=404, detail="No data deletion has been requested")
+
+    if job.status in ("pending", "running"):
+        # Picks the job up again if the worker running it has gone away
+        account_deleter.schedule(job.id)
+    return deletion_job_response(job)
+
 @router.get("/{document_id}")
 async def get_document(
     document_id: uuid.UUID,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get a specific document with full analysis"""
-    document = (
-        db.query(Document)
-        .filter(Document.id == document_id, Document.user_id == current_user.id)
-        .first()
+    document = await db.scalar(
+        select(Document)
+        .where(Document.id == document_id, Document.user_id == current_user.id)
     )
     
     if not document:
@@ -433,185 +707,28 @@ async def get_document(
             detail="Document not found"
         )
     
-    # ✅ FIXED - Parse JSON fields correctly
-    try:
-        key_points = json.loads(document.key_points) if document.key_points else []
-        risk_flags = json.loads(document.risk_flags) if document.risk_flags else []
-        key_concepts = json.loads(document.key_concepts) if document.key_concepts else []
-        
-        # ✅ FIXED - Parse SWOT as object, with proper fallback
-        swot_analysis = {}
-        if document.swot_analysis:
-            try:
-                parsed_swot = json.loads(document.swot_analysis)
-                # Ensure it has the correct structure
-                if isinstance(parsed_swot, dict):
-                    swot_analysis = {
-                        "strengths": parsed_swot.get("strengths", []),
-                        "weaknesses": parsed_swot.get("weaknesses", []),
-                        "opportunities": parsed_swot.get("opportunities", []),
-                        "threats": parsed_swot.get("threats", [])
-                    }
-                else:
-                    # If it's somehow still an array, convert to empty structure
-                    swot_analysis = {
-                        "strengths": [],
-                        "weaknesses": [],
-                        "opportunities": [],
-                        "threats": []
-                    }
-            except json.JSONDecodeError:
-                swot_analysis = {
-                    "strengths": [],
-                    "weaknesses": [],
-                    "opportunities": [],
-                    "threats": []
-                }
-        else:
-            swot_analysis = {
-                "strengths": [],
-                "weaknesses": [],
-                "opportunities": [],
-                "threats": []
-            }
-        
-        # Parse impact analysis
-        impact_analysis = {
-            "insights_impact": [],
-            "risks_impact": []
-        }
-        if document.impact:
-            try:
-                parsed_impact = json.loads(document.impact)
-                if isinstance(parsed_impact, dict):
-                    impact_analysis = {
-                        "insights_impact": parsed_impact.get("insights_impact", []),
-                        "risks_impact": parsed_impact.get("risks_impact", [])
-                    }
-                print(f"Document {document.id} impact analysis: {len(impact_analysis['insights_impact'])} insights, {len(impact_analysis['risks_impact'])} risks")
-            except json.JSONDecodeError:
-                print(f"Failed to parse impact data for document {document.id}")
-        
-        # Parse recommendations
-        recommendations = {}
-        if document.recommendations:
-            try:
-                recommendations = json.loads(document.recommendations)
-                if not isinstance(recommendations, dict):
-                    recommendations = {}
-            except json.JSONDecodeError:
-                print(f"Failed to parse recommendations data for document {document.id}")
-                recommendations = {}
-        
-        # If this is an old document without impact analysis, generate it from existing data
-        if not impact_analysis["insights_impact"] and not impact_analysis["risks_impact"]:
-            print(f"No impact analysis found for document {document.id}, generating from existing data")
-            
-            # Generate impact analysis from key_points and risk_flags
-            generated_insights_impact = []
-            generated_risks_impact = []
-            
-            # Process key points into insights impact
-            for i, point in enumerate(key_points[:3]):  # Limit to first 3 for performance
-                if isinstance(point, dict):
-                    point_text = point.get("text", "")
-                elif isinstance(point, str):
-                    point_text = point
-                else:
-                    continue
-                    
-                if point_text:
-                    generated_insights_impact.append({
-                        "insight_point": point_text[:100] + "..." if len(point_text) > 100 else point_text,
-                        "impact_description": f"This insight could have significant implications for business operations and decision-making processes",
-                        "impacted_organization": "Business Operations Team",
-                        "affected_areas": ["Operations", "Strategy", "Decision Making"],
-                        "impact_level": "medium",
-                        "timeline": "medium-term", 
-                        "action_required": "Review and incorporate this insight into relevant business processes and strategic planning"
-                    })
-            
-            # Process risk flags into risks impact  
-            for i, risk in enumerate(risk_flags[:3]):  # Limit to first 3 for performance
-                if isinstance(risk, dict):
-                    risk_text = risk.get("text", "")
-                elif isinstance(risk, str):
-                    risk_text = risk
-                else:
-                    continue
-                    
-                if risk_text:
-                    # Remove emoji from risk text for cleaner display
-                    clean_risk_text = risk_text.replace("🚩", "").strip()
-                    generated_risks_impact.append({
-                        "risk_point": clean_risk_text[:100] + "..." if len(clean_risk_text) > 100 else clean_risk_text,
-                        "impact_description": f"If this risk materializes, it could negatively affect operations and require immediate attention",
-                        "impacted_organization": "Operations and Management Team",
-                        "affected_areas": ["Operations", "Risk Management", "Compliance"],
-                        "impact_level": "medium",
-                        "timeline": "short-term",
-                        "action_required": "Implement risk mitigation strategies and monitor for potential issues"
-                    })
-            
-            # Update impact_analysis with generated data
-            if generated_insights_impact or generated_risks_impact:
-                impact_analysis = {
-                    "insights_impact": generated_insights_impact,
-                    "risks_impact": generated_risks_impact
-                }
-                print(f"Generated impact analysis: {len(generated_insights_impact)} insights, {len(generated_risks_impact)} risks")
-            
-        print("Parsed SWOT analysis:", swot_analysis)
-        print("SWOT analysis type:", type(swot_analysis))
-        print("SWOT strengths count:", len(swot_analysis.get("strengths", [])))
-        
-    except json.JSONDecodeError as e:
-        print(f"JSON decode error: {e}")
-        key_points = []
-        risk_flags = []
-        key_concepts = []
-        swot_analysis = {
-            "strengths": [],
-            "weaknesses": [],
-            "opportunities": [],
-            "threats": []
-        }
-    
-    return {
+    # Stored analysis is already in response shape; Postgres renders it as JSON and it is
+    # spliced into the body as-is, at the root and again under "analysis"
+    document_text, analysis_json = await load_analysis_json(db, document.id)
+    head = orjson.dumps({
         "id": document.id,
         "collection_id": document.collection_id,
         "filename": document.filename,
         "filesize": document.filesize,
         "word_count": document.word_count,
-        "summary": document.summary,
-        "problem_context": document.problem_context,
         "analysis_method": document.analysis_method,
         "uploaded_at": document.uploaded_at.isoformat(),
-        "document_text": document.document_text,
-        "file_url": getattr(document, 'file_url', None),
-        "key_points": key_points,
-        "risk_flags": risk_flags,
-        "key_concepts": key_concepts,
-        "swot_analysis": swot_analysis,  # ✅ FIXED - Now properly structured
-        "recommendations": recommendations,  # ✅ Add recommendations at root level
-        "impact_analysis": impact_analysis,  # ✅ FIXED - Add impact_analysis at root level
-        "analysis": {
-            "summary": document.summary,
-            "problem_context": document.problem_context,
-            "key_points": key_points,
-            "risk_flags": risk_flags,
-            "key_concepts": key_concepts,
-            "swot_analysis": swot_analysis,  # ✅ FIXED - Now properly structured
-            "recommendations": recommendations,  # ✅ Add recommendations to analysis section
-            "impact_analysis": impact_analysis
-        }
-    }
+        "document_text": document_text,
+        "file_url": document.file_url
+    }, default=str)  # asyncpg's UUID type is not a uuid.UUID to orjson
+    body = b"".join((head[:-1], b",", analysis_json[1:-1], b',"analysis":', analysis_json, b"}"))
+    return Response(content=body, media_type="application/json")
 
 @router.post("/delete")
 async def delete_document(
     document_id: str,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Delete a document:
@@ -626,11 +743,11 @@ async def delete_document(
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid document ID format")
 
-    # Fetch document from DB
-    document = (
-        db.query(Document)
-        .filter(Document.id == document_uuid, Document.user_id == current_user.id)
-        .first()
+    # Fetch document from DB (only what deletion needs, not the text or analysis)
+    document = await db.scalar(
+        select(Document)
+        .options(load_only(Document.id, Document.collection_id, Document.file_url))
+        .where(Document.id == document_uuid, Document.user_id == current_user.id)
     )
 
     if not document:
@@ -638,223 +755,77 @@ async def delete_document(
 
     bucket_name = "documents-uploaded-digestifile"
 
-    # Extract storage key from file_url
-    try:
-        storage_key = document.file_url.split(f"/{bucket_name}/", 1)[1]
-    except IndexError:
-        raise HTTPException(status_code=500, detail="Invalid file URL format stored in DB")
+    # Pasted-text documents have no stored file
+    if document.file_url:
+        # Extract storage key from file_url
+        try:
+            storage_key = document.file_url.split(f"/{bucket_name}/", 1)[1]
+        except IndexError:
+            raise HTTPException(status_code=500, detail="Invalid file URL format stored in DB")
 
-    print(f"Deleting file from bucket: {storage_key}")
+        print(f"Deleting file from bucket: {storage_key}")
 
-    # Delete from Supabase storage
-    try:
-        response = supabase.storage.from_(bucket_name).remove([storage_key])
-        print(f"Supabase storage delete response: {response}")
-    except Exception as e:
-        print(f"Error deleting file from Supabase storage: {e}")
-        raise HTTPException(status_code=500, detail="Failed to delete file from storage")
+        # Delete from Supabase storage
+        try:
+            response = supabase.storage.from_(bucket_name).remove([storage_key])
+            print(f"Supabase storage delete response: {response}")
+        except Exception as e:
+            print(f"Error deleting file from Supabase storage: {e}")
+            raise HTTPException(status_code=500, detail="Failed to delete file from storage")
 
     # Store collection_id before deletion to check if collection becomes empty
     collection_id = document.collection_id
+    # Its analysis is taken out of the collection rollup
+    analysis = await load_analysis(db, document.id) if collection_id else None
 
     # Delete related chat messages
-    chat_deleted = db.query(ChatHistory).filter(
-        ChatHistory.document_id == document_uuid,
-        ChatHistory.user_id == current_user.id
-    ).delete(synchronize_session=False)
+    chat_deleted = (await db.execute(
+        delete(ChatHistory).where(
+            ChatHistory.document_id == document_uuid,
+            ChatHistory.user_id == current_user.id
+        )
+    )).rowcount
     print(f"Deleted {chat_deleted} chat messages for document {document_uuid}")
 
     # Delete document record
-    db.delete(document)
-    db.commit()
+    await db.delete(document)
+    if collection_id:
+        await add_to_document_count(db, collection_id, current_user.id, -1)
+        await remove_from_rollup(db, collection_id, analysis)
+    await db.commit()
+    conversation_cache.invalidate(current_user.id)  # The document's sessions are gone
+    share_render_cache.invalidate(user_id=current_user.id)
+    user_stats_cache.invalidate(current_user.id)
+    if collection_id:
+        rollup_cache.invalidate(collection_id)
     print(f"Deleted document {document_uuid} from the database")
 
     # Check if the collection becomes empty and delete it if so
     if collection_id:
-        collection_was_deleted = check_and_delete_empty_collection(db, collection_id, current_user.id)
+        collection_was_deleted = await check_and_delete_empty_collection(db, collection_id, current_user.id)
         if collection_was_deleted:
             return {"message": "Document deleted successfully. Empty collection was also removed."}
 
     return {"message": "Document deleted successfully"}
 
-    
-    
-@router.post("/delete-all")
+
+@router.post("/delete-all", status_code=status.HTTP_202_ACCEPTED)
 async def delete_all_user_data(
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Delete ALL user data: documents, chat history, and collections"""
+    """Delete ALL user data: documents, stored files, chat history, public shares and collections.
+
+    Runs in the background; poll GET /documents/deletion-status for progress."""
     try:
-        deletion_summary = {
-            "documents_deleted": 0,
-            "chat_history_deleted": 0,
-            "collections_deleted": 0,
-            "storage_files_deleted": 0,
-            "storage_errors": []
-        }
-        
-        print(f"Starting complete data deletion for user: {current_user.id}")
-        
-        # Step 1: Get all user documents first (to get file URLs for storage deletion)
-        user_documents = db.query(Document).filter(
-            Document.user_id == current_user.id
-        ).all()
-        
-        deletion_summary["documents_deleted"] = len(user_documents)
-        print(f"Found {len(user_documents)} documents to delete")
-        
-        # Step 2: Delete files from Supabase storage
-        storage_files_to_delete = []
-        for document in user_documents:
-            if document.file_url:
-                # Use document ID as storage filename
-                storage_filename = str(document.id)
-                storage_files_to_delete.append(storage_filename)
-        
-        if storage_files_to_delete:
-            try:
-                print(f"Deleting {len(storage_files_to_delete)} files from storage")
-                response = supabase.storage.from_("documents-uploaded-digestifile").remove(storage_files_to_delete)
-                
-                if isinstance(response, list):
-                    for file_result in response:
-                        if isinstance(file_result, dict) and 'error' in file_result and file_result['error']:
-                            deletion_summary["storage_errors"].append(file_result['error'])
-                        else:
-                            deletion_summary["storage_files_deleted"] += 1
-                else:
-                    deletion_summary["storage_files_deleted"] = len(storage_files_to_delete)
-                    
-                print(f"Storage deletion response: {response}")
-                
-            except Exception as storage_error:
-                print(f"Storage deletion failed: {storage_error}")
-                deletion_summary["storage_errors"].append(str(storage_error))
-        
-        # Step 3: Delete all chat history for the user
-        chat_deleted = db.query(ChatHistory).filter(
-            ChatHistory.user_id == current_user.id
-        ).delete(synchronize_session=False)
-        
-        deletion_summary["chat_history_deleted"] = chat_deleted
-        print(f"Deleted {chat_deleted} chat history records")
-        
-        # Step 4: Delete all public chat views for the user (must be before public_chat_shares due to foreign key)
-        public_views_deleted = db.query(PublicChatView).filter(
-            PublicChatView.share_id.in_(
-                db.query(PublicChatShare.id).filter(PublicChatShare.user_id == current_user.id)
-            )
-        ).delete(synchronize_session=False)
-        
-        deletion_summary["public_views_deleted"] = public_views_deleted
-        print(f"Deleted {public_views_deleted} public chat views")
-        
-        # Step 5: Delete all public chat shares for the user (must be before documents due to foreign key)
-        public_shares_deleted = db.query(PublicChatShare).filter(
-            PublicChatShare.user_id == current_user.id
-        ).delete(synchronize_session=False)
-        
-        deletion_summary["public_shares_deleted"] = public_shares_deleted
-        print(f"Deleted {public_shares_deleted} public chat shares")
-        
-        # Step 6: Delete all documents for the user (must be before collections due to foreign key)
-        documents_deleted = db.query(Document).filter(
-            Document.user_id == current_user.id
-        ).delete(synchronize_session=False)
-        
-        print(f"Deleted {documents_deleted} documents from database")
-        
-        # Step 7: Delete all collections for the user (after documents)
-        collections_deleted = db.query(Collection).filter(
-            Collection.user_id == current_user.id
-        ).delete(synchronize_session=False)
-        
-        deletion_summary["collections_deleted"] = collections_deleted
-        print(f"Deleted {collections_deleted} collections")
-        
-        # Commit all deletions
-        db.commit()
-        
-        # Build response message
-        message = f"Successfully deleted all user data: {deletion_summary['documents_deleted']} documents, {deletion_summary['chat_history_deleted']} chat messages, {deletion_summary['public_views_deleted']} public views, {deletion_summary['public_shares_deleted']} public shares, {deletion_summary['collections_deleted']} collections"
-        
-        if deletion_summary["storage_files_deleted"] > 0:
-            message += f", {deletion_summary['storage_files_deleted']} files from storage"
-        
-        if deletion_summary["storage_errors"]:
-            message += f" (with {len(deletion_summary['storage_errors'])} storage errors)"
-        
-        return {
-            "message": message,
-            "summary": deletion_summary
-        }
-        
+        job = await account_deleter.start(db, current_user.id)
     except Exception as error:
-        db.rollback()
-        print(f"Complete deletion failed: {error}")
-        import traceback
-        print("Full traceback:", traceback.format_exc())
+        await db.rollback()
+        print(f"Could not start data deletion for user {current_user.id}: {error}")
         raise HTTPException(
             status_code=500,
             detail=f"Failed to delete all user data: {str(error)}"
         )
-        
-@router.get("/deletion-preview")
-async def get_deletion_preview(
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
-):
-    """Get a preview of what would be deleted"""
-    try:
-        # Count documents
-        documents_count = db.query(Document).filter(
-            Document.user_id == current_user.id
-        ).count()
-        
-        # Count chat history
-        chat_count = db.query(ChatHistory).filter(
-            ChatHistory.user_id == current_user.id
-        ).count()
-        
-        # Count collections
-        collections_count = db.query(Collection).filter(
-            Collection.user_id == current_user.id
-        ).count()
-        
-        # Count storage files (documents with file_url)
-        storage_files_count = db.query(Document).filter(
-            Document.user_id == current_user.id,
-            Document.file_url.isnot(None)
-        ).count()
-        
-        # Count public chat shares
-        public_shares_count = db.query(PublicChatShare).filter(
-            PublicChatShare.user_id == current_user.id
-        ).count()
-        
-        # Count public chat views
-        public_views_count = db.query(PublicChatView).filter(
-            PublicChatView.share_id.in_(
-                db.query(PublicChatShare.id).filter(PublicChatShare.user_id == current_user.id)
-            )
-        ).count()
-        
-        return {
-            "preview": {
-                "documents_to_delete": documents_count,
-                "chat_messages_to_delete": chat_count,
-                "public_views_to_delete": public_views_count,
-                "public_shares_to_delete": public_shares_count,
-                "collections_to_delete": collections_count,
-                "storage_files_to_delete": storage_files_count
-            },
-            "warning": "This action cannot be undone. All data will be permanently deleted."
-        }
-        
-    except Exception as error:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Failed to get deletion preview: {str(error)}"
-        )
-  
\ No newline at end of file
+
+    print(f"Deleting all data for user {current_user.id} in the background (job {job.id})")
+    return deletion_job_response(job)
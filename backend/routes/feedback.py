@@ -1,9 +1,9 @@
 
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
 from models import Feedback
-from database import get_db
+from database import get_async_db
 from dependencies import get_current_active_user
 from models import User
 
@@ -18,7 +18,7 @@ class FeedbackCreate(BaseModel):
 async def submit_feedback(
     feedback: FeedbackCreate,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     try:
         new_feedback = Feedback(
@@ -28,9 +28,9 @@ async def submit_feedback(
             message=feedback.message
         )
         db.add(new_feedback)
-        db.commit()
-        db.refresh(new_feedback)
+        await db.commit()
+        await db.refresh(new_feedback)
         return {"message": "Feedback submitted successfully", "feedback_id": new_feedback.id}
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
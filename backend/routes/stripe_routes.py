@@ -1,11 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
 import stripe
 import os
 from datetime import datetime, timedelta, timezone
-from database import get_db
+from database import get_async_db
 from models import User, UserPlan, UserSubscription, SubscriptionPlan
 from dependencies import get_current_active_user
 from email_service import email_service
@@ -22,18 +23,18 @@ BASE_BACKEND_URL = os.getenv("BASE_BACKEND_URL")
 router = APIRouter(prefix="/stripe", tags=["stripe"])
 
 # Helper functions for UserSubscription management
-def get_subscription_plan_by_name(db: Session, plan_name: str):
+async def get_subscription_plan_by_name(db: AsyncSession, plan_name: str):
     """Get subscription plan by name"""
-    return db.query(SubscriptionPlan).filter(SubscriptionPlan.name == plan_name).first()
+    return await db.scalar(select(SubscriptionPlan).where(SubscriptionPlan.name == plan_name))
 
-def get_user_subscription(db: Session, user_id: str):
+async def get_user_subscription(db: AsyncSession, user_id: str):
     """Get UserSubscription for a user"""
-    return db.query(UserSubscription).filter(
+    return await db.scalar(select(UserSubscription).where(
         UserSubscription.user_id == user_id
-    ).first()
+    ))
 
-def get_or_create_user_subscription(
-    db: Session, 
+async def get_or_create_user_subscription(
+    db: AsyncSession, 
     user_id: str, 
     plan_name: str,
     stripe_customer_id: str = None,
@@ -44,12 +45,12 @@ def get_or_create_user_subscription(
 ):
     """Get existing UserSubscription or create a new one"""
     # First, try to find existing subscription for this user
-    user_subscription = db.query(UserSubscription).filter(
+    user_subscription = await db.scalar(select(UserSubscription).where(
         UserSubscription.user_id == user_id
-    ).first()
+    ))
     
     # Get the plan by name
-    plan = get_subscription_plan_by_name(db, plan_name)
+    plan = await get_subscription_plan_by_name(db, plan_name)
     if not plan:
         print(f"⚠️ Plan '{plan_name}' not found in database. Creating with default values.")
         # For now, we'll still create the UserSubscription without plan_id
@@ -98,7 +99,7 @@ class ManualUpdateRequest(BaseModel):
 async def create_checkout_session(
     request: CheckoutRequest,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Create a Stripe Checkout Session for subscription"""
     try:
@@ -106,7 +107,7 @@ async def create_checkout_session(
         print(f"📋 Price ID: {request.price_id}")
         
         # Create or get Stripe customer from UserSubscription table
-        user_subscription = get_user_subscription(db, str(current_user.id))
+        user_subscription = await get_user_subscription(db, str(current_user.id))
         stripe_customer_id = user_subscription.stripe_customer_id if user_subscription else None
         
         if not stripe_customer_id:
@@ -126,7 +127,7 @@ async def create_checkout_session(
                 user_subscription.stripe_customer_id = stripe_customer_id
             else:
                 # Create new UserSubscription record with customer ID
-                user_subscription = get_or_create_user_subscription(
+                user_subscription = await get_or_create_user_subscription(
                     db=db,
                     user_id=str(current_user.id),
                     plan_name="Free",  # Default plan
@@ -136,7 +137,7 @@ async def create_checkout_session(
                     subscription_end_date=None,
                     last_payment_check=None
                 )
-            db.commit()
+            await db.commit()
             print(f"✅ Created Stripe customer: {stripe_customer_id}")
         
         # Create checkout session
@@ -174,7 +175,7 @@ async def create_checkout_session(
 async def update_plan_manual(
     request: ManualUpdateRequest,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Manually update user plan after successful payment (no webhooks)"""
     try:
@@ -191,7 +192,7 @@ async def update_plan_manual(
         if request.session_id in update_plan_manual.processed_sessions:
             print(f"⚠️ Session {request.session_id} already processed, skipping email")
             # Get existing subscription data for return
-            existing_user_subscription = get_user_subscription(db, str(current_user.id))
+            existing_user_subscription = await get_user_subscription(db, str(current_user.id))
             # Return success but don't send email again - include subscription_end_date
             return {
                 "status": "already_processed",
@@ -211,7 +212,7 @@ async def update_plan_manual(
         print(f"🏪 Session customer: {session.customer}")
         
         # Get current user's stripe customer ID from UserSubscription
-        user_subscription = get_user_subscription(db, str(current_user.id))
+        user_subscription = await get_user_subscription(db, str(current_user.id))
         user_stripe_customer_id = user_subscription.stripe_customer_id if user_subscription else None
         print(f"👤 User customer ID: {user_stripe_customer_id}")
         
@@ -311,7 +312,7 @@ async def update_plan_manual(
         current_user.updated_at = now
         
         # Update UserSubscription table with all subscription info
-        user_subscription = get_or_create_user_subscription(
+        user_subscription = await get_or_create_user_subscription(
             db=db,
             user_id=str(current_user.id),
             plan_name=plan_name,
@@ -323,8 +324,8 @@ async def update_plan_manual(
         )
         
         # Commit changes
-        db.commit()
-        db.refresh(current_user)
+        await db.commit()
+        await db.refresh(current_user)
         
         print(f"✅ Successfully updated user {current_user.email}")
         print(f"✅ Plan changed from {old_plan} to {current_user.plan.value}")
@@ -475,14 +476,14 @@ async def update_plan_manual(
 @router.get("/subscription-status")
 async def get_subscription_status(
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get current user's subscription status"""
     try:
         now = datetime.now(timezone.utc)
         
         # Get subscription data from UserSubscription table
-        user_subscription = get_user_subscription(db, str(current_user.id))
+        user_subscription = await get_user_subscription(db, str(current_user.id))
         
         if not (user_subscription and user_subscription.stripe_customer_id):
             return {
@@ -511,7 +512,7 @@ async def get_subscription_status(
                     current_user.plan = UserPlan.FREE
                     
                     # Update UserSubscription table - mark as inactive
-                    user_subscription = get_or_create_user_subscription(
+                    user_subscription = await get_or_create_user_subscription(
                         db=db,
                         user_id=str(current_user.id),
                         plan_name="Free",
@@ -523,7 +524,7 @@ async def get_subscription_status(
                     )
                     user_subscription.is_active = False
                     
-                    db.commit()
+                    await db.commit()
                     
                     return {
                         "has_subscription": False,
@@ -563,12 +564,12 @@ async def get_subscription_status(
 @router.post("/sync-subscription-status")
 async def sync_subscription_status(
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Manually sync subscription status from Stripe (no webhooks)"""
     try:
         # Get user subscription first
-        user_subscription = get_user_subscription(db, str(current_user.id))
+        user_subscription = await get_user_subscription(db, str(current_user.id))
         
         if not (user_subscription and user_subscription.stripe_customer_id):
             return {"status": "no_customer", "plan": current_user.plan.value}
@@ -638,7 +639,7 @@ async def sync_subscription_status(
             
             # Update UserSubscription table with all subscription info
             if plan_name:
-                user_subscription = get_or_create_user_subscription(
+                user_subscription = await get_or_create_user_subscription(
                     db=db,
                     user_id=str(current_user.id),
                     plan_name=plan_name,
@@ -649,7 +650,7 @@ async def sync_subscription_status(
                     last_payment_check=now
                 )
             
-            db.commit()
+            await db.commit()
             
             print(f"✅ Synced: {old_plan} -> {current_user.plan.value}")
             
@@ -670,7 +671,7 @@ async def sync_subscription_status(
                 current_user.updated_at = now
                 
                 # Update UserSubscription table - mark as inactive
-                user_subscription = get_or_create_user_subscription(
+                user_subscription = await get_or_create_user_subscription(
                     db=db,
                     user_id=str(current_user.id),
                     plan_name="Free",
@@ -682,7 +683,7 @@ async def sync_subscription_status(
                 )
                 user_subscription.is_active = False
                 
-                db.commit()
+                await db.commit()
                 
                 print(f"⬇️ Downgraded: {old_plan} -> FREE")
                 
@@ -708,12 +709,12 @@ async def sync_subscription_status(
 async def create_portal_session(
     request: PortalRequest,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Create a Stripe Customer Portal Session"""
     try:
         # Get stripe customer ID from UserSubscription
-        user_subscription = get_user_subscription(db, str(current_user.id))
+        user_subscription = await get_user_subscription(db, str(current_user.id))
         
         if not (user_subscription and user_subscription.stripe_customer_id):
             raise HTTPException(
@@ -738,12 +739,12 @@ async def create_portal_session(
 @router.post("/cancel-subscription")
 async def cancel_subscription(
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Cancel user's subscription (no webhooks - manual update)"""
     try:
         # Get subscription data from UserSubscription table
-        user_subscription = get_user_subscription(db, str(current_user.id))
+        user_subscription = await get_user_subscription(db, str(current_user.id))
         
         print(f"🚫 Cancel subscription request from user: {current_user.email}")
         print(f"📋 Current user plan: {current_user.plan.value}")
@@ -776,7 +777,7 @@ async def cancel_subscription(
                         print(f"✅ Found active subscription: {subscription.id}")
                         
                         # Update the user's subscription in UserSubscription table
-                        user_subscription = get_or_create_user_subscription(
+                        user_subscription = await get_or_create_user_subscription(
                             db=db,
                             user_id=str(current_user.id),
                             plan_name=current_user.plan.value.title(),  # Free/Standard/Pro
@@ -786,7 +787,7 @@ async def cancel_subscription(
                             subscription_end_date=None,  # Will be updated when we get subscription details
                             last_payment_check=datetime.now(timezone.utc)
                         )
-                        db.commit()
+                        await db.commit()
                         
                         print("✅ Updated user with found subscription ID")
                     else:
@@ -819,13 +820,13 @@ async def cancel_subscription(
         print(f"📋 Cancel at period end: {subscription.cancel_at_period_end}")
         
         # Update user status in UserSubscription table
-        user_subscription = get_user_subscription(db, str(current_user.id))
+        user_subscription = await get_user_subscription(db, str(current_user.id))
         if user_subscription:
             user_subscription.subscription_status = "cancel_at_period_end"
             user_subscription.last_payment_check = datetime.now(timezone.utc)
         current_user.updated_at = datetime.now(timezone.utc)
         
-        db.commit()
+        await db.commit()
         print(f"✅ Database updated successfully")
         
         return {
@@ -859,12 +860,12 @@ async def cancel_subscription(
 @router.get("/subscription-health")
 async def get_subscription_health(
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get comprehensive subscription health status"""
     try:
         now = datetime.now(timezone.utc)
-        user_subscription = get_user_subscription(db, str(current_user.id))
+        user_subscription = await get_user_subscription(db, str(current_user.id))
         
         health_status = {
             "user_id": str(current_user.id),
@@ -906,12 +907,12 @@ async def get_subscription_health(
 @router.post("/fix-missing-stripe-data")
 async def fix_missing_stripe_data(
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Fix users who have paid plans but missing Stripe customer/subscription data"""
     try:
         # Get current subscription data
-        user_subscription = get_user_subscription(db, str(current_user.id))
+        user_subscription = await get_user_subscription(db, str(current_user.id))
         
         print(f"🔧 Fixing missing Stripe data for user: {current_user.email}")
         print(f"📋 Current plan: {current_user.plan.value}")
@@ -933,7 +934,7 @@ async def fix_missing_stripe_data(
                     
                     # Update UserSubscription with found customer ID
                     if not user_subscription:
-                        user_subscription = get_or_create_user_subscription(
+                        user_subscription = await get_or_create_user_subscription(
                             db=db,
                             user_id=str(current_user.id),
                             plan_name=current_user.plan.value.title(),
@@ -945,7 +946,7 @@ async def fix_missing_stripe_data(
                         )
                     else:
                         user_subscription.stripe_customer_id = customer.id
-                    db.commit()
+                    await db.commit()
                     print("✅ Updated user with found customer ID")
                 else:
                     print("⚠️ No Stripe customer found by email")
@@ -954,7 +955,7 @@ async def fix_missing_stripe_data(
                     current_user.plan = UserPlan.FREE
                     
                     # Update UserSubscription table - mark as inactive
-                    user_subscription = get_or_create_user_subscription(
+                    user_subscription = await get_or_create_user_subscription(
                         db=db,
                         user_id=str(current_user.id),
                         plan_name="Free",
@@ -966,7 +967,7 @@ async def fix_missing_stripe_data(
                     )
                     user_subscription.is_active = False
                     
-                    db.commit()
+                    await db.commit()
                     
                     return {
                         "status": "downgraded_to_free",
@@ -1012,7 +1013,7 @@ async def fix_missing_stripe_data(
                     
                     # Update UserSubscription table with all subscription data
                     if plan_name:
-                        user_subscription = get_or_create_user_subscription(
+                        user_subscription = await get_or_create_user_subscription(
                             db=db,
                             user_id=str(current_user.id),
                             plan_name=plan_name,
@@ -1023,7 +1024,7 @@ async def fix_missing_stripe_data(
                             last_payment_check=datetime.now(timezone.utc)
                         )
                     
-                    db.commit()
+                    await db.commit()
                     
                     print(f"✅ Fixed user subscription data")
                     
@@ -1044,7 +1045,7 @@ async def fix_missing_stripe_data(
                     current_user.plan = UserPlan.FREE
                     
                     # Update UserSubscription table - mark as inactive
-                    user_subscription = get_or_create_user_subscription(
+                    user_subscription = await get_or_create_user_subscription(
                         db=db,
                         user_id=str(current_user.id),
                         plan_name="Free",
@@ -1056,7 +1057,7 @@ async def fix_missing_stripe_data(
                     )
                     user_subscription.is_active = False
                     
-                    db.commit()
+                    await db.commit()
                     
                     return {
                         "status": "downgraded_to_free",
@@ -1128,7 +1129,7 @@ async def download_invoice(
 async def get_invoice_data(
     session_id: str,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get invoice data for display"""
     try:
@@ -1136,7 +1137,7 @@ async def get_invoice_data(
         session = stripe.checkout.Session.retrieve(session_id)
         
         # Get user's stripe customer ID from UserSubscription
-        user_subscription = get_user_subscription(db, str(current_user.id))
+        user_subscription = await get_user_subscription(db, str(current_user.id))
         user_stripe_customer_id = user_subscription.stripe_customer_id if user_subscription else None
         
         if session.customer != user_stripe_customer_id:
@@ -1,26 +1,35 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query
+from dataclasses import asdict
+from datetime import datetime, timedelta, timezone
+from sqlalchemy.ext.asyncio import AsyncSession
 from dependencies import get_current_active_user, get_user_limits_info
-from database import get_db
-from models import Usage, User
+from database import get_async_db
+from models import User
+from usage_metering import usage_meter
+from user_stats import get_user_stats
 
 router = APIRouter(prefix="/usage", tags=["usage"])
 
 @router.get("/me")
-def get_my_usage(current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
-    """Get current user's usage statistics with limits"""
-    return get_user_limits_info(current_user, db)
+async def get_my_usage(current_user: User = Depends(get_current_active_user), db: AsyncSession = Depends(get_async_db)):
+    """Get current user's usage statistics with limits, and counts of their stored data"""
+    usage_info = await get_user_limits_info(current_user, db)
+    usage_info["stats"] = asdict(await get_user_stats(db, current_user.id))
+    return usage_info
 
 @router.post("/reset")
-def reset_usage(current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+async def reset_usage(current_user: User = Depends(get_current_active_user), db: AsyncSession = Depends(get_async_db)):
     """Reset usage statistics for current user (admin only or monthly reset)"""
-    usage = db.query(Usage).filter(Usage.user_id == current_user.id).first()
+    await usage_meter.reset(db, current_user.id)
     
-    if usage:
-        usage.docs_used = 0
-        usage.chats_used = 0
-        usage.tokens_used = 0
-        db.commit()
-        db.refresh(usage)
-    
-    return {"message": "Usage statistics reset successfully"} 
\ No newline at end of file
+    return {"message": "Usage statistics reset successfully"}
+
+@router.get("/costs")
+async def get_my_costs(
+    days: int = Query(30, ge=1, le=366),
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Provider-reported LLM tokens and cost per operation over the last `days` days"""
+    since = (datetime.now(timezone.utc) - timedelta(days=days - 1)).date()
+    return await usage_meter.cost_report(db, since, current_user.id)
@@ -5,8 +5,6 @@ Run this periodically (e.g., daily via cron job)
 import os
 import sys
 from datetime import datetime, timedelta, timezone
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
 import stripe
 import logging
 
@@ -14,7 +12,7 @@ import logging
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from models import User, UserPlan, Base
-from database import DATABASE_URL
+from database import SessionLocal
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -24,9 +22,7 @@ logger = logging.getLogger(__name__)
 stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
 
 def get_db_session():
-    """Create database session"""
-    engine = create_engine(DATABASE_URL)
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    """Create database session on the shared process-wide engine"""
     return SessionLocal()
 
 def check_expired_subscriptions():
@@ -4,20 +4,16 @@ Test script to verify subscription tracking system
 import os
 import sys
 from datetime import datetime, timedelta, timezone
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
 
 # Add the backend directory to Python path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from models import User, UserPlan
-from database import DATABASE_URL
+from database import SessionLocal
 from subscription_checker import main as check_subscriptions
 
 def setup_test_user():
     """Create a test user with expired subscription"""
-    engine = create_engine(DATABASE_URL)
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
     db = SessionLocal()
     
     try:
@@ -57,8 +53,6 @@ def setup_test_user():
 
 def verify_downgrade(user_id):
     """Check if user was downgraded"""
-    engine = create_engine(DATABASE_URL)
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
     db = SessionLocal()
     
     try:
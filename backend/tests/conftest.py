@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Tests import the backend modules the way main.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# database.py builds its engines at import; they only connect on first use, which these tests never make
+os.environ.setdefault("DB_PORT", "5432")
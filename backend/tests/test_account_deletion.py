@@ -0,0 +1,18 @@
+import pytest
+
+from account_deletion import STORAGE_BUCKET, storage_key
+
+BASE = f"https://project.supabase.co/storage/v1/object"
+
+
+@pytest.mark.parametrize("file_url, key", [
+    (f"{BASE}/public/{STORAGE_BUCKET}/user-1/report.pdf", "user-1/report.pdf"),
+    (f"{BASE}/sign/{STORAGE_BUCKET}/user-1/report.pdf?token=abc", "user-1/report.pdf"),
+    (f"{BASE}/public/{STORAGE_BUCKET}/user-1/Q3%20report.docx", "user-1/Q3 report.docx"),
+    (f"{BASE}/public/other-bucket/user-1/report.pdf", None),
+    (f"{BASE}/public/{STORAGE_BUCKET}/", None),
+    ("", None),
+    (None, None),
+])
+def test_storage_key(file_url, key):
+    assert storage_key(file_url) == key
@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+from admission_control import AdmissionRejected, Bucket, MemoryBucketStore, SQLiteBucketStore, WeightedFairQueue
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemoryBucketStore()
+    return SQLiteBucketStore(str(tmp_path / "buckets.sqlite"))
+
+
+def test_take_drains_burst_then_reports_wait(store):
+    bucket = Bucket("user:a", capacity=3, rate_per_second=0.5)
+    assert [store.take([bucket]) for _ in range(3)] == [0.0, 0.0, 0.0]
+    wait = store.take([bucket])
+    # One token at 0.5/s is about two seconds away
+    assert 1.9 < wait <= 2.0
+
+
+def test_take_is_all_or_none(store):
+    user = Bucket("user:a", capacity=5, rate_per_second=0.0)
+    plan = Bucket("plan:free", capacity=1, rate_per_second=1.0)
+    assert store.take([user, plan]) == 0.0
+    assert store.take([user, plan]) > 0
+    # The rejected take left the user bucket untouched: 4 tokens remain
+    assert [store.take([user]) for _ in range(5)][:4] == [0.0] * 4
+    assert store.take([user]) > 0
+
+
+def test_empty_bucket_without_refill_never_admits(store):
+    bucket = Bucket("user:a", capacity=1, rate_per_second=0.0)
+    assert store.take([bucket]) == 0.0
+    assert store.take([bucket]) == float("inf")
+
+
+def _serve_order(waiters, weights):
+    """Order in which queued users get a single busy slot"""
+    async def run():
+        queue = WeightedFairQueue(slots=1, max_queued_per_user=10, timeout=5)
+        await queue.acquire("holder", 1)
+        served = []
+
+        async def wait(user):
+            await queue.acquire(user, weights[user])
+            served.append(user)
+
+        tasks = []
+        for user in waiters:
+            tasks.append(asyncio.create_task(wait(user)))
+            await asyncio.sleep(0)
+        for _ in waiters:
+            queue.release()
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        return served
+
+    return asyncio.run(run())
+
+
+def test_fair_queue_serves_by_plan_weight():
+    served = _serve_order(["free"] * 4 + ["pro"] * 4, {"free": 1, "pro": 4})
+    # Finish tags: pro 0.25, 0.5, 0.75, 1.0; free 1, 2, 3, 4 (ties go to the earlier waiter)
+    assert served == ["pro", "pro", "pro", "free", "pro", "free", "free", "free"]
+
+
+def test_fair_queue_alternates_users_on_the_same_plan():
+    served = _serve_order(["a", "a", "a", "b", "b", "b"], {"a": 1, "b": 1})
+    assert served == ["a", "b", "a", "b", "a", "b"]
+
+
+def test_fair_queue_limits_queued_requests_per_user():
+    async def run():
+        queue = WeightedFairQueue(slots=1, max_queued_per_user=1, timeout=5)
+        await queue.acquire("holder", 1)
+        first = asyncio.create_task(queue.acquire("a", 1))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await queue.acquire("a", 1)
+        assert rejected.value.retry_after >= 1
+        queue.release()
+        await first
+
+    asyncio.run(run())
+
+
+def test_fair_queue_times_out_with_retry_after_and_forgets_waiter():
+    async def run():
+        queue = WeightedFairQueue(slots=1, max_queued_per_user=2, timeout=0.05)
+        await queue.acquire("holder", 1)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await queue.acquire("a", 1)
+        assert rejected.value.reason == "Timed out waiting for capacity"
+        assert rejected.value.retry_after >= 1
+        assert queue.waiting == 0
+        # The slot goes back to the pool, not to the timed-out waiter
+        queue.release()
+        assert queue.in_use == 0
+
+    asyncio.run(run())
@@ -0,0 +1,120 @@
+"""Chat history pages and cached conversation state; needs Postgres (DB_* env)"""
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytestmark = pytest.mark.skipif(not os.getenv("DB_HOST"), reason="needs a Postgres database (DB_* env)")
+
+START = datetime(2026, 10, 19, 12, 0, tzinfo=timezone.utc)
+
+
+async def _with_session(scenario, timestamps):
+    """Run scenario(user, document_id, session_id, chat_ids) on a session with one exchange per timestamp"""
+    from sqlalchemy import delete
+    from database import AsyncSessionLocal, async_engine
+    from models import ChatHistory, ChatSession, ConversationSummary, Document, User
+
+    async with AsyncSessionLocal() as db:
+        user = User(email=f"history-{uuid.uuid4().hex}@example.com", name="history")
+        db.add(user)
+        await db.flush()
+        document = Document(user_id=user.id, filename="f", filesize=1, word_count=1, summary="s", analysis_method="single")
+        db.add(document)
+        await db.flush()
+        session = ChatSession(user_id=user.id, document_id=document.id, message_count=len(timestamps))
+        db.add(session)
+        await db.flush()
+        chat_ids = []
+        for number, timestamp in enumerate(timestamps):
+            chat = ChatHistory(
+                user_id=user.id, document_id=document.id, chat_session_id=session.id,
+                question=f"q{number}", answer=f"a{number}", timestamp=timestamp,
+            )
+            db.add(chat)
+            await db.flush()
+            chat_ids.append(chat.id)
+        await db.commit()
+    try:
+        return await scenario(user, document.id, session.id, chat_ids)
+    finally:
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(ConversationSummary).where(ConversationSummary.chat_session_id == session.id))
+            await db.execute(delete(ChatHistory).where(ChatHistory.user_id == user.id))
+            await db.execute(delete(ChatSession).where(ChatSession.user_id == user.id))
+            await db.execute(delete(Document).where(Document.user_id == user.id))
+            await db.execute(delete(User).where(User.id == user.id))
+            await db.commit()
+        await async_engine.dispose()
+
+
+@pytest.mark.parametrize("session_filter", [False, True])
+def test_cursor_pages_cover_every_exchange_once(session_filter):
+    from database import AsyncSessionLocal
+    from routes.chat import get_chat_history
+
+    # Ties on timestamp are ordered by id, so no exchange falls between two pages
+    timestamps = [START, START, START + timedelta(seconds=1), START + timedelta(seconds=1), START + timedelta(seconds=1),
+                  START + timedelta(seconds=2), START + timedelta(seconds=3)]
+
+    async def scenario(user, document_id, session_id, chat_ids):
+        pages, cursor = [], None
+        async with AsyncSessionLocal() as db:
+            while True:
+                page = await get_chat_history(
+                    document_id, current_user=user, db=db, skip=0, limit=3, cursor=cursor,
+                    session_id=session_id if session_filter else None,
+                )
+                pages.append(page)
+                cursor = page.next_cursor
+                if cursor is None:
+                    return pages
+
+    pages = asyncio.run(_with_session(scenario, timestamps))
+    assert [len(page.chat_history) for page in pages] == [3, 3, 1]
+    assert all(page.total == len(timestamps) for page in pages)
+    # Newest page first, each page oldest first
+    messages = [item.user_message for page in reversed(pages) for item in page.chat_history]
+    assert sorted(messages) == sorted(f"q{number}" for number in range(len(timestamps)))
+    assert len(set(messages)) == len(timestamps)
+    times = [item.timestamp for page in reversed(pages) for item in page.chat_history]
+    assert times == sorted(times)
+
+
+def test_cached_conversation_is_reused_only_while_current():
+    from sqlalchemy import delete
+    from conversation_state import conversation_cache, load_conversation_state
+    from database import AsyncSessionLocal
+    from models import ChatHistory
+
+    async def scenario(user, document_id, session_id, chat_ids):
+        conversation_cache.clear()
+        async with AsyncSessionLocal() as db:
+            first = await load_conversation_state(db, user.id, document_id, session_id)
+            assert await load_conversation_state(db, user.id, document_id, session_id) is first
+
+            # Another worker answers a turn: the cached state no longer ends at the newest exchange
+            db.add(ChatHistory(
+                user_id=user.id, document_id=document_id, chat_session_id=session_id,
+                question="q-other", answer="a-other", timestamp=START + timedelta(minutes=1),
+            ))
+            await db.commit()
+            after_add = await load_conversation_state(db, user.id, document_id, session_id)
+
+            # And deletes its newest exchange again
+            await db.execute(delete(ChatHistory).where(ChatHistory.question == "q-other", ChatHistory.user_id == user.id))
+            await db.commit()
+            after_delete = await load_conversation_state(db, user.id, document_id, session_id)
+        conversation_cache.clear()
+        return first, after_add, after_delete, chat_ids
+
+    first, after_add, after_delete, chat_ids = asyncio.run(
+        _with_session(scenario, [START, START + timedelta(seconds=1)])
+    )
+    assert first.newest_id == chat_ids[-1]
+    assert after_add is not first
+    assert "q-other" in after_add.history_text
+    assert after_delete.newest_id == chat_ids[-1]
+    assert "q-other" not in after_delete.history_text
@@ -0,0 +1,143 @@
+"""Collection document counts kept by the document routes; needs Postgres (DB_* env)"""
+import asyncio
+import os
+import uuid
+
+import pytest
+
+pytestmark = pytest.mark.skipif(not os.getenv("DB_HOST"), reason="needs a Postgres database (DB_* env)")
+
+
+async def _with_user(scenario):
+    from sqlalchemy import delete
+    from database import AsyncSessionLocal, async_engine
+    from models import Collection, Document, User
+
+    async with AsyncSessionLocal() as db:
+        user = User(email=f"counts-{uuid.uuid4().hex}@example.com", name="counts")
+        db.add(user)
+        await db.commit()
+    try:
+        return await scenario(user)
+    finally:
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(Document).where(Document.user_id == user.id))
+            await db.execute(delete(Collection).where(Collection.user_id == user.id))
+            await db.execute(delete(User).where(User.id == user.id))
+            await db.commit()
+        await async_engine.dispose()
+
+
+async def _create_collection(user):
+    from database import AsyncSessionLocal
+    from routes.collections import CollectionCreate, create_collection
+
+    async with AsyncSessionLocal() as db:
+        created = await create_collection(CollectionCreate(name=f"c-{uuid.uuid4().hex[:8]}"), current_user=user, db=db)
+    return created.id
+
+
+async def _add_document(user, collection_id):
+    """What the upload routes do: insert the document and count it in one transaction"""
+    from database import AsyncSessionLocal
+    from models import Document
+    from routes.collections import add_to_document_count
+
+    async with AsyncSessionLocal() as db:
+        document = Document(
+            user_id=user.id, collection_id=collection_id,
+            filename="f", filesize=1, word_count=1, summary="s", analysis_method="single",
+        )
+        db.add(document)
+        await db.flush()
+        assert await add_to_document_count(db, collection_id, user.id, 1)
+        await db.commit()
+        return document.id
+
+
+async def _count(collection_id):
+    from sqlalchemy import select
+    from database import AsyncSessionLocal
+    from models import Collection
+
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(select(Collection.document_count).where(Collection.id == collection_id))
+
+
+def test_counts_follow_document_creates_and_deletes():
+    from database import AsyncSessionLocal
+    from routes.documents import delete_document
+
+    async def scenario(user):
+        collection_id = await _create_collection(user)
+        counts = [await _count(collection_id)]
+        first = await _add_document(user, collection_id)
+        second = await _add_document(user, collection_id)
+        counts.append(await _count(collection_id))
+
+        async with AsyncSessionLocal() as db:
+            kept = await delete_document(str(first), current_user=user, db=db)
+        counts.append(await _count(collection_id))
+        async with AsyncSessionLocal() as db:
+            removed = await delete_document(str(second), current_user=user, db=db)
+        counts.append(await _count(collection_id))
+        return counts, kept, removed
+
+    counts, kept, removed = asyncio.run(_with_user(scenario))
+    # None: deleting the last document removed the collection
+    assert counts == [0, 2, 1, None]
+    assert "collection" not in kept["message"]
+    assert "Empty collection was also removed" in removed["message"]
+
+
+def test_counting_into_another_users_collection_changes_nothing():
+    from database import AsyncSessionLocal
+    from routes.collections import add_to_document_count
+
+    async def scenario(user):
+        collection_id = await _create_collection(user)
+        async with AsyncSessionLocal() as db:
+            counted = await add_to_document_count(db, collection_id, uuid.uuid4(), 1)
+            await db.commit()
+        return counted, await _count(collection_id)
+
+    assert asyncio.run(_with_user(scenario)) == (False, 0)
+
+
+def test_empty_collection_is_kept_when_a_document_is_added_meanwhile():
+    from database import AsyncSessionLocal
+    from models import Document
+    from routes.collections import add_to_document_count, check_and_delete_empty_collection
+
+    async def scenario(user):
+        collection_id = await _create_collection(user)
+        async with AsyncSessionLocal() as uploader, AsyncSessionLocal() as deleter:
+            uploader.add(Document(
+                user_id=user.id, collection_id=collection_id,
+                filename="f", filesize=1, word_count=1, summary="s", analysis_method="single",
+            ))
+            await uploader.flush()
+            await add_to_document_count(uploader, collection_id, user.id, 1)  # Uncommitted
+
+            # The delete waits for the upload's row lock, then sees the new count
+            check = asyncio.create_task(check_and_delete_empty_collection(deleter, collection_id, user.id))
+            await asyncio.sleep(0.3)
+            assert not check.done()
+            await uploader.commit()
+            deleted = await check
+        return deleted, await _count(collection_id)
+
+    assert asyncio.run(_with_user(scenario)) == (False, 1)
+
+
+def test_empty_collection_is_deleted():
+    from database import AsyncSessionLocal
+    from routes.collections import check_and_delete_empty_collection
+
+    async def scenario(user):
+        collection_id = await _create_collection(user)
+        async with AsyncSessionLocal() as db:
+            deleted = await check_and_delete_empty_collection(db, collection_id, user.id)
+        return deleted, await _count(collection_id)
+
+    assert asyncio.run(_with_user(scenario)) == (True, None)
@@ -0,0 +1,109 @@
+"""Rollup maintenance racing a collection's first rollup read; needs Postgres (DB_* env)"""
+import asyncio
+import os
+import uuid
+
+import pytest
+
+pytestmark = pytest.mark.skipif(not os.getenv("DB_HOST"), reason="needs a Postgres database (DB_* env)")
+
+
+def _analysis():
+    from document_store import shape_analysis
+    return shape_analysis({"risk_flags": ["🚩 Supplier risk"], "key_concepts": [{"term": "Cash", "explanation": ""}]})
+
+
+async def _with_collection(scenario):
+    from sqlalchemy import delete, select
+    from database import AsyncSessionLocal, async_engine
+    from models import Collection, CollectionRollup, Document, User
+
+    async with AsyncSessionLocal() as db:
+        user = User(email=f"rollup-race-{uuid.uuid4().hex}@example.com", name="race")
+        db.add(user)
+        await db.flush()
+        # Created the way collections were before rollup rows existed
+        collection = Collection(user_id=user.id, name="race")
+        db.add(collection)
+        await db.commit()
+        user_id, collection_id = user.id, collection.id
+    try:
+        await scenario(user_id, collection_id)
+        async with AsyncSessionLocal() as db:
+            return await db.scalar(select(CollectionRollup).where(CollectionRollup.collection_id == collection_id))
+    finally:
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(Document).where(Document.user_id == user_id))
+            await db.execute(delete(Collection).where(Collection.user_id == user_id))
+            await db.execute(delete(User).where(User.id == user_id))
+            await db.commit()
+        await async_engine.dispose()
+
+
+async def _insert_document(db, user_id, collection_id):
+    """What the upload routes do in the document's transaction before the rollup (uncommitted)"""
+    from document_store import build_content
+    from models import Document
+    from routes.collections import add_to_document_count
+
+    document = Document(
+        id=uuid.uuid4(), user_id=user_id, collection_id=collection_id,
+        filename="f", filesize=1, word_count=1, summary="s", analysis_method="single"
+    )
+    db.add(document)
+    await db.flush()
+    db.add(build_content(document.id, "text", _analysis()))
+    assert await add_to_document_count(db, collection_id, user_id, 1)
+
+
+def test_document_added_while_first_rebuild_is_uncommitted():
+    from sqlalchemy.dialects.postgresql import insert as pg_insert
+    from collection_rollups import _locked_rollup, add_document, rebuild_rollup
+    from database import AsyncSessionLocal
+    from models import CollectionRollup
+
+    async def scenario(user_id, collection_id):
+        async with AsyncSessionLocal() as reader, AsyncSessionLocal() as uploader:
+            # The first read's rebuild has inserted and locked the row, not committed yet
+            await reader.execute(
+                pg_insert(CollectionRollup)
+                .values(collection_id=collection_id, document_count=0, tallies={}, summary={}, stale=True)
+                .on_conflict_do_nothing()
+            )
+            await _locked_rollup(reader, collection_id)
+
+            await _insert_document(uploader, user_id, collection_id)
+            upload = asyncio.create_task(add_document(uploader, collection_id, _analysis()))
+            await asyncio.sleep(0.3)
+            assert not upload.done()  # Waits for the rebuild
+
+            await rebuild_rollup(reader, collection_id)  # Cannot see the uncommitted document
+            await upload
+            await uploader.commit()
+
+    rollup = asyncio.run(_with_collection(scenario))
+    assert rollup.stale is False
+    assert rollup.document_count == 1
+    assert rollup.tallies["risks"]["supplier risk"]["documents"] == 1
+
+
+def test_first_read_while_document_is_uncommitted():
+    from collection_rollups import add_document, load_rollup_json, rollup_cache
+    from database import AsyncSessionLocal
+
+    async def scenario(user_id, collection_id):
+        async with AsyncSessionLocal() as reader, AsyncSessionLocal() as uploader:
+            await _insert_document(uploader, user_id, collection_id)
+            await add_document(uploader, collection_id, _analysis())  # Leaves a stale row, uncommitted
+
+            read = asyncio.create_task(load_rollup_json(reader, collection_id, user_id))
+            await asyncio.sleep(0.3)
+            assert not read.done()  # The rebuild waits for the document's transaction
+
+            await uploader.commit()
+            await read
+        rollup_cache.invalidate(collection_id)
+
+    rollup = asyncio.run(_with_collection(scenario))
+    assert rollup.stale is False
+    assert rollup.document_count == 1
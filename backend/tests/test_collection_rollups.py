@@ -0,0 +1,92 @@
+import copy
+import random
+
+from collection_rollups import document_contributions, fold, summarize
+from document_store import shape_analysis
+
+TERMS = ["Strong brand", "Cash reserves", "Legacy systems", "Market expansion", "Regulatory change", "Talent gap"]
+
+
+def _analysis(rng):
+    pick = lambda k: rng.sample(TERMS, k)
+    return shape_analysis({
+        "risk_flags": [{"text": f"🚩 {term} risk", "quote": "q"} for term in pick(2)],
+        "key_concepts": [{"term": term, "explanation": "e"} for term in pick(3)],
+        "swot_analysis": {
+            category: [
+                {"title": term, "description": "d", "impact": rng.choice(["high", "medium", "low"])}
+                for term in pick(2)
+            ]
+            for category in ("strengths", "weaknesses", "opportunities", "threats")
+        },
+        "impact_analysis": {"insights_impact": [], "risks_impact": [{"risk_point": "r", "impact_level": rng.choice(["high", "medium"])}]},
+    })
+
+
+def _rebuilt(analyses):
+    """What rebuild_rollup computes from the documents of a collection"""
+    tallies = {}
+    for analysis in analyses:
+        tallies = fold(tallies, document_contributions(analysis), 1)
+    return tallies
+
+
+def test_contributions_count_an_item_once_per_document():
+    contributions = document_contributions(shape_analysis({
+        "risk_flags": ["🚩 Supplier risk", "supplier RISK!"],
+        "key_concepts": [{"term": "Cloud"}, {"term": "cloud"}],
+    }))
+    assert list(contributions["risks"]) == ["supplier risk"]
+    assert list(contributions["key_concepts"]) == ["cloud"]
+
+
+def test_adding_then_removing_a_document_restores_tallies():
+    rng = random.Random(7)
+    tallies = _rebuilt([_analysis(rng) for _ in range(20)])
+    before = copy.deepcopy(tallies)
+    extra = document_contributions(_analysis(rng))
+    assert fold(fold(tallies, extra, 1), extra, -1) == before
+    assert tallies == before  # fold does not modify its input
+
+
+def test_incremental_changes_match_a_rebuild():
+    rng = random.Random(11)
+    analyses = [_analysis(rng) for _ in range(30)]
+    tallies = _rebuilt(analyses[:20])
+    for analysis in analyses[20:]:
+        tallies = fold(tallies, document_contributions(analysis), 1)
+    removed = rng.sample(range(30), 12)
+    for index in removed:
+        tallies = fold(tallies, document_contributions(analyses[index]), -1)
+
+    remaining = [analysis for index, analysis in enumerate(analyses) if index not in removed]
+    assert tallies == _rebuilt(remaining)
+
+
+def test_removing_every_document_empties_the_rollup():
+    rng = random.Random(3)
+    analyses = [_analysis(rng) for _ in range(5)]
+    tallies = _rebuilt(analyses)
+    for analysis in analyses:
+        tallies = fold(tallies, document_contributions(analysis), -1)
+    assert all(not entries for entries in tallies.values())
+
+
+def test_summary_ranks_by_documents_then_impact():
+    high = shape_analysis({"swot_analysis": {"threats": [{"title": "Churn", "description": "", "impact": "high"}]}})
+    low = shape_analysis({"swot_analysis": {"threats": [{"title": "Fraud", "description": "", "impact": "low"}]}})
+    tallies = _rebuilt([low, low, high])
+    threats = summarize("c", tallies, 3)["swot_analysis"]["threats"]
+    assert [(item["title"], item["documents"], item["impact"]) for item in threats] == [("Fraud", 2, "low"), ("Churn", 1, "high")]
+
+    tallies = _rebuilt([low, high])
+    assert summarize("c", tallies, 2)["swot_analysis"]["threats"][0]["title"] == "Churn"
+
+
+def test_generated_impact_placeholders_are_not_counted():
+    # No impact analysis from the model: shape_analysis fills in display placeholders
+    analysis = shape_analysis({"risk_flags": ["🚩 Late payments"], "key_points": ["Revenue grew"]})
+    assert analysis["impact_analysis"]["risks_impact"][0]["generated"] is True
+    contributions = document_contributions(analysis)
+    assert contributions["risk_levels"] == {}
+    assert list(contributions["risks"]) == ["late payments"]
@@ -0,0 +1,22 @@
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import HTTPException
+
+from pagination import decode_cursor, encode_cursor
+
+
+def test_cursor_round_trip():
+    timestamp = datetime(2026, 10, 19, 12, 30, 5, 123456, tzinfo=timezone.utc)
+    row_id = uuid.uuid4()
+    cursor = encode_cursor(timestamp, row_id)
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == (timestamp, row_id)
+
+
+@pytest.mark.parametrize("cursor", ["", "not-a-cursor", encode_cursor(datetime.now(timezone.utc), uuid.uuid4())[:-4]])
+def test_invalid_cursor_is_rejected_with_400(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor)
+    assert error.value.status_code == 400
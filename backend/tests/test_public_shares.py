@@ -0,0 +1,105 @@
+import asyncio
+import uuid
+
+import orjson
+import pytest
+from starlette.requests import Request
+
+from public_shares import RenderedShare, ShareRenderCache, etag_matches
+
+
+def _rendered(chat_session_id=None, user_id=None, view_count=0, title="Shared"):
+    return RenderedShare(
+        share_id=uuid.uuid4(),
+        user_id=user_id or uuid.uuid4(),
+        chat_session_id=chat_session_id or uuid.uuid4(),
+        body=orjson.dumps({"view_count": view_count, "title": title}),
+        expires_at=None,
+        max_views=None,
+        view_count=view_count,
+    )
+
+
+def test_invalidate_drops_the_pages_of_a_session_or_user():
+    cache = ShareRenderCache(ttl=60, max_bytes=1 << 20)
+    session_id, user_id = uuid.uuid4(), uuid.uuid4()
+    cache.put("by-session", _rendered(chat_session_id=session_id))
+    cache.put("by-user-1", _rendered(user_id=user_id))
+    cache.put("by-user-2", _rendered(user_id=user_id))
+    cache.put("other", _rendered())
+
+    cache.invalidate(chat_session_id=session_id)
+    assert cache.get("by-session") is None
+    assert cache.get("by-user-1") is not None
+
+    cache.invalidate(user_id=str(user_id))
+    assert cache.get("by-user-1") is None and cache.get("by-user-2") is None
+    assert cache.get("other") is not None
+
+
+def test_size_cap_evicts_least_recently_used_pages():
+    first, second, third = _rendered(), _rendered(), _rendered()
+    cache = ShareRenderCache(ttl=60, max_bytes=len(first.body) * 2)
+    cache.put("first", first)
+    cache.put("second", second)
+    cache.get("first")
+    cache.put("third", third)
+    assert cache.get("second") is None
+    assert cache.get("first") is first and cache.get("third") is third
+
+
+def test_etag_covers_the_whole_body_view_count_included():
+    assert _rendered(view_count=3).etag == _rendered(view_count=3).etag
+    assert _rendered(view_count=3).etag != _rendered(view_count=4).etag
+    assert _rendered(title="a").etag != _rendered(title="b").etag
+    assert _rendered().etag.startswith('W/"')
+
+
+@pytest.mark.parametrize("if_none_match, matches", [
+    (None, False),
+    ("", False),
+    ("*", True),
+    ('W/"abc"', True),
+    ('"abc"', True),
+    ('"other", W/"abc"', True),
+    ('"other",W/"abc" ', True),
+    ('W/"abcd"', False),
+    ('W/"ab"', False),
+    ('"a", "bc"', False),
+    ("abc", False),
+])
+def test_if_none_match_compares_whole_entity_tags(if_none_match, matches):
+    assert etag_matches(if_none_match, 'W/"abc"') is matches
+
+
+def _get(share_token, if_none_match=None):
+    from routes.chat import get_public_share
+
+    headers = [(b"if-none-match", if_none_match.encode())] if if_none_match else []
+    request = Request({"type": "http", "method": "GET", "path": "/", "headers": headers, "client": ("127.0.0.1", 1)})
+    return asyncio.run(get_public_share(share_token, request, db=None))
+
+
+def test_public_share_is_served_from_the_cache_with_304_for_its_etag(monkeypatch):
+    from routes import chat
+
+    recorded = []
+    monkeypatch.setattr(chat.share_view_recorder, "record", lambda share_id, **view: recorded.append(share_id))
+    rendered = _rendered(view_count=7)
+    share_token = f"test-{uuid.uuid4().hex}"
+    chat.share_render_cache.put(share_token, rendered)
+    try:
+        full = _get(share_token)
+        assert full.status_code == 200
+        assert full.body == rendered.body
+        assert full.headers["ETag"] == rendered.etag
+
+        assert _get(share_token, f'"stale", {rendered.etag}').status_code == 304
+        assert _get(share_token, rendered.etag[2:]).status_code == 304  # Weak comparison
+        assert _get(share_token, "*").status_code == 304
+        assert _get(share_token, rendered.etag[:-2] + '"').status_code == 200
+    finally:
+        chat.share_render_cache.invalidate(chat_session_id=rendered.chat_session_id)
+
+    assert recorded == [rendered.share_id] * 5
+    assert rendered.views == 12
@@ -0,0 +1,162 @@
+"""Usage counters and token reservations; needs Postgres (DB_* env)"""
+import asyncio
+import os
+import uuid
+
+import pytest
+
+pytestmark = pytest.mark.skipif(not os.getenv("DB_HOST"), reason="needs a Postgres database (DB_* env)")
+
+
+async def _with_user(scenario):
+    from sqlalchemy import delete
+    from database import AsyncSessionLocal, async_engine
+    from models import Usage, UsageEvent, UsageReservation, User
+
+    async with AsyncSessionLocal() as db:
+        user = User(email=f"usage-{uuid.uuid4().hex}@example.com", name="usage")
+        db.add(user)
+        await db.commit()
+        user_id = user.id
+    try:
+        return await scenario(user_id)
+    finally:
+        async with AsyncSessionLocal() as db:
+            for model in (UsageReservation, UsageEvent, Usage):
+                await db.execute(delete(model).where(model.user_id == user_id))
+            await db.execute(delete(User).where(User.id == user_id))
+            await db.commit()
+        await async_engine.dispose()
+
+
+async def _stored(user_id):
+    """Counters and event totals as committed, bypassing the meter's cache"""
+    from sqlalchemy import func, select
+    from database import AsyncSessionLocal
+    from models import Usage, UsageEvent
+    from usage_metering import COUNTER_COLUMNS, UsageCounters
+
+    async with AsyncSessionLocal() as db:
+        row = (await db.execute(select(*COUNTER_COLUMNS).where(Usage.user_id == user_id))).first()
+        events = (await db.execute(
+            select(func.count(), func.sum(UsageEvent.chats), func.sum(UsageEvent.tokens))
+            .where(UsageEvent.user_id == user_id)
+        )).one()
+    return (UsageCounters(*row) if row else None), tuple(events)
+
+
+def test_concurrent_records_create_the_row_once_and_lose_no_increments():
+    from database import AsyncSessionLocal
+    from usage_metering import UsageMeter
+
+    meter = UsageMeter(ttl=0)
+
+    async def record(user_id):
+        async with AsyncSessionLocal() as db:
+            await meter.record(db, user_id, "chat", chats=1, tokens=10)
+
+    async def scenario(user_id):
+        # No Usage row yet: every request races to create it
+        await asyncio.gather(*(record(user_id) for _ in range(8)))
+        return await _stored(user_id)
+
+    counters, events = asyncio.run(_with_user(scenario))
+    assert (counters.chats_used, counters.tokens_used, counters.tokens_reserved) == (8, 80, 0)
+    assert events == (8, 8, 80)
+
+
+def test_record_returns_and_caches_the_new_totals():
+    from database import AsyncSessionLocal
+    from usage_metering import UsageMeter
+
+    meter = UsageMeter(ttl=60)
+
+    async def scenario(user_id):
+        async with AsyncSessionLocal() as db:
+            await meter.record(db, user_id, "document_upload", docs=1, tokens=5)
+            recorded = await meter.record(db, user_id, "document_upload", docs=1, tokens=7)
+        return recorded, meter._cached(user_id)
+
+    recorded, cached = asyncio.run(_with_user(scenario))
+    assert (recorded.docs_used, recorded.tokens_used) == (2, 12)
+    assert cached == recorded
+
+
+def test_concurrent_reservations_do_not_overshoot_the_limit():
+    from database import AsyncSessionLocal
+    from usage_metering import UsageMeter
+
+    meter = UsageMeter(ttl=0)
+
+    async def reserve(user_id):
+        async with AsyncSessionLocal() as db:
+            return await meter.reserve(db, user_id, 300, token_limit=1000)
+
+    async def scenario(user_id):
+        reservations = await asyncio.gather(*(reserve(user_id) for _ in range(6)))
+        return reservations, await _stored(user_id)
+
+    reservations, (counters, _) = asyncio.run(_with_user(scenario))
+    assert sum(reservation is not None for reservation in reservations) == 3
+    assert counters.tokens_reserved == 900
+
+
+def test_settle_charges_actual_usage_and_frees_the_rest():
+    from database import AsyncSessionLocal
+    from usage_metering import UsageMeter
+
+    meter = UsageMeter(ttl=0)
+
+    async def scenario(user_id):
+        async with AsyncSessionLocal() as db:
+            reservation = await meter.reserve(db, user_id, 500, token_limit=1000)
+            await meter.settle(db, reservation, "chat", tokens=120, chats=1)
+            # The freed remainder is available again: 120 used + 880 <= 1000
+            again = await meter.reserve(db, user_id, 880, token_limit=1000)
+        return again, await _stored(user_id)
+
+    again, (counters, events) = asyncio.run(_with_user(scenario))
+    assert again is not None
+    assert (counters.tokens_used, counters.chats_used, counters.tokens_reserved) == (120, 1, 880)
+    assert events == (1, 1, 120)
+
+
+def test_release_frees_the_whole_reservation_once():
+    from database import AsyncSessionLocal
+    from usage_metering import UsageMeter
+
+    meter = UsageMeter(ttl=0)
+
+    async def scenario(user_id):
+        async with AsyncSessionLocal() as db:
+            kept = await meter.reserve(db, user_id, 200, token_limit=1000)
+            released = await meter.reserve(db, user_id, 300, token_limit=1000)
+        await meter.release(released)
+        await meter.release(released)  # Already gone: frees nothing more
+        return kept, await _stored(user_id)
+
+    kept, (counters, events) = asyncio.run(_with_user(scenario))
+    assert kept is not None
+    assert (counters.tokens_used, counters.tokens_reserved) == (0, 200)
+    assert events == (0, None, None)
+
+
+def test_expired_reservation_is_reclaimed_and_not_freed_twice():
+    from database import AsyncSessionLocal
+    from usage_metering import UsageMeter
+
+    meter = UsageMeter(ttl=0)
+
+    async def scenario(user_id):
+        async with AsyncSessionLocal() as db:
+            # Left behind by a dead worker: expires immediately
+            abandoned = await meter.reserve(db, user_id, 900, token_limit=1000, ttl=0)
+            assert abandoned is not None
+            reclaimed = await meter.reserve(db, user_id, 900, token_limit=1000)
+            # Settling the reclaimed reservation charges usage but frees nothing of the new one
+            await meter.settle(db, abandoned, "chat", tokens=50, chats=1)
+        return reclaimed, await _stored(user_id)
+
+    reclaimed, (counters, _) = asyncio.run(_with_user(scenario))
+    assert reclaimed is not None
+    assert (counters.tokens_used, counters.tokens_reserved) == (50, 900)
@@ -0,0 +1,308 @@
+"""
+Off-request IP-to-timezone detection.
+
+TimezoneMiddleware only enqueues (user, IP) pairs; a background worker resolves them
+and writes the results to the users table in batches, so a slow geo service never
+adds latency to an API call or blocks the event loop.
+
+Resolution order for an IP:
+  1. LRU+TTL cache keyed by subnet (/24 for IPv4, /48 for IPv6)
+  2. Offline database (GEOIP_DATABASE_PATH): a MaxMind .mmdb file (needs the optional
+     maxminddb package) or a CSV with `network` and `time_zone` columns, e.g. GeoLite2
+     City blocks joined with their locations
+  3. ip-api.com, then worldtimeapi.org, over a shared async HTTP client with a short timeout
+
+Failed lookups are cached for a shorter TTL so an unknown subnet is not retried on
+every request.
+"""
+import asyncio
+import bisect
+import csv
+import ipaddress
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import httpx
+from sqlalchemy import update
+
+from database import AsyncSessionLocal
+from identity import principal_cache
+from models import User
+from timezone_service import timezone_service
+
+logger = logging.getLogger(__name__)
+
+GEOIP_DATABASE_PATH = os.getenv("GEOIP_DATABASE_PATH")
+TIMEZONE_CACHE_SIZE = int(os.getenv("TIMEZONE_CACHE_SIZE", "50000"))
+TIMEZONE_CACHE_TTL_SECONDS = float(os.getenv("TIMEZONE_CACHE_TTL_SECONDS", "86400"))
+TIMEZONE_NEGATIVE_CACHE_TTL_SECONDS = float(os.getenv("TIMEZONE_NEGATIVE_CACHE_TTL_SECONDS", "600"))
+TIMEZONE_LOOKUP_TIMEOUT_SECONDS = float(os.getenv("TIMEZONE_LOOKUP_TIMEOUT_SECONDS", "2"))
+TIMEZONE_UPDATE_BATCH_SIZE = int(os.getenv("TIMEZONE_UPDATE_BATCH_SIZE", "100"))
+TIMEZONE_UPDATE_FLUSH_SECONDS = float(os.getenv("TIMEZONE_UPDATE_FLUSH_SECONDS", "2"))
+TIMEZONE_QUEUE_SIZE = int(os.getenv("TIMEZONE_QUEUE_SIZE", "10000"))
+
+_MISS = object()
+
+
+def subnet_key(ip_address: str) -> str:
+    """Cache key shared by addresses in the same /24 (IPv4) or /48 (IPv6)"""
+    try:
+        address = ipaddress.ip_address(ip_address)
+    except ValueError:
+        return ip_address
+    prefix = 24 if address.version == 4 else 48
+    return str(ipaddress.ip_network(f"{address}/{prefix}", strict=False))
+
+
+def is_local_address(ip_address: str) -> bool:
+    try:
+        address = ipaddress.ip_address(ip_address)
+    except ValueError:
+        # "localhost", "testclient" and other non-addresses
+        return True
+    return address.is_private or address.is_loopback or address.is_link_local
+
+
+class TimezoneCache:
+    """Bounded LRU of subnet -> timezone (None for a failed lookup) with per-entry TTL"""
+
+    def __init__(self, maxsize: int = TIMEZONE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISS
+            timezone_name, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return _MISS
+            self._entries.move_to_end(key)
+            return timezone_name
+
+    def put(self, key: str, timezone_name: Optional[str]):
+        ttl = TIMEZONE_CACHE_TTL_SECONDS if timezone_name else TIMEZONE_NEGATIVE_CACHE_TTL_SECONDS
+        with self._lock:
+            self._entries[key] = (timezone_name, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+class OfflineGeoIP:
+    """Local IP -> timezone database loaded from a .mmdb or network/time_zone CSV file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._reader = None
+        # Per IP version: sorted range starts, with parallel range ends and timezones
+        self._ranges: Dict[int, Tuple[list, list, list]] = {}
+
+        if path.endswith(".mmdb"):
+            try:
+                import maxminddb
+            except ImportError:
+                raise RuntimeError("maxminddb is required to read .mmdb files (pip install maxminddb)")
+            self._reader = maxminddb.open_database(path)
+        else:
+            self._load_csv(path)
+
+    def _load_csv(self, path: str):
+        rows = {4: [], 6: []}
+        with open(path, newline="", encoding="utf-8") as handle:
+            for row in csv.DictReader(handle):
+                timezone_name = row.get("time_zone") or row.get("timezone")
+                if not timezone_name or not row.get("network"):
+                    continue
+                network = ipaddress.ip_network(row["network"], strict=False)
+                rows[network.version].append(
+                    (int(network.network_address), int(network.broadcast_address), timezone_name)
+                )
+
+        for version, entries in rows.items():
+            entries.sort()
+            self._ranges[version] = (
+                [start for start, _, _ in entries],
+                [end for _, end, _ in entries],
+                [timezone_name for _, _, timezone_name in entries],
+            )
+        logger.info(f"🌍 Loaded {sum(len(r) for r in rows.values())} GeoIP networks from {path}")
+
+    def lookup(self, ip_address: str) -> Optional[str]:
+        try:
+            address = ipaddress.ip_address(ip_address)
+        except ValueError:
+            return None
+
+        if self._reader is not None:
+            record = self._reader.get(ip_address) or {}
+            return (record.get("location") or {}).get("time_zone")
+
+        starts, ends, timezones = self._ranges.get(address.version, ([], [], []))
+        index = bisect.bisect_right(starts, int(address)) - 1
+        if index >= 0 and int(address) <= ends[index]:
+            return timezones[index]
+        return None
+
+
+class TimezoneDetector:
+    def __init__(self, geoip_path: Optional[str] = GEOIP_DATABASE_PATH):
+        self.cache = TimezoneCache()
+        self.offline = None
+        if geoip_path:
+            try:
+                self.offline = OfflineGeoIP(geoip_path)
+            except Exception as e:
+                logger.error(f"❌ Could not load GeoIP database {geoip_path}: {e}")
+
+        self._client: Optional[httpx.AsyncClient] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # user_id -> client IP, queued and not yet resolved (deduplicates bursts)
+        self._queued: Dict[uuid.UUID, str] = {}
+        # user_id -> (timezone, IP) resolved and waiting for the next batch write
+        self._pending: Dict[uuid.UUID, Tuple[str, str]] = {}
+
+    def schedule(self, user_id: uuid.UUID, ip_address: str) -> bool:
+        """Queue a detection for the user; never blocks. Returns False if dropped."""
+        if self._queued.get(user_id) == ip_address:
+            return True
+
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait((user_id, ip_address))
+        except asyncio.QueueFull:
+            logger.warning("⚠️ Timezone detection queue full, dropping update")
+            return False
+        self._queued[user_id] = ip_address
+        return True
+
+    async def resolve(self, ip_address: str) -> Optional[str]:
+        """Timezone for an IP from the cache, the offline database or the online services"""
+        if is_local_address(ip_address):
+            # For local/development environments, use system timezone
+            key = "local"
+        else:
+            key = subnet_key(ip_address)
+
+        cached = self.cache.get(key)
+        if cached is not _MISS:
+            return cached
+
+        if key == "local":
+            timezone_name = timezone_service.get_system_timezone()
+        else:
+            timezone_name = self.offline.lookup(ip_address) if self.offline else None
+            if not timezone_name:
+                timezone_name = await self._lookup_online(ip_address)
+
+        if timezone_name and not timezone_service._is_valid_timezone(timezone_name):
+            timezone_name = None
+        self.cache.put(key, timezone_name)
+        return timezone_name
+
+    async def _lookup_online(self, ip_address: str) -> Optional[str]:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=TIMEZONE_LOOKUP_TIMEOUT_SECONDS)
+
+        services = [
+            f"http://ip-api.com/json/{ip_address}?fields=timezone",
+            f"http://worldtimeapi.org/api/ip/{ip_address}",
+        ]
+        for url in services:
+            try:
+                response = await self._client.get(url)
+                response.raise_for_status()
+                timezone_name = response.json().get("timezone")
+                if timezone_name:
+                    return timezone_name
+            except Exception as e:
+                logger.warning(f"⚠️ Timezone service failed: {e}")
+        return None
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        if self._worker is not None and not self._worker.done() and self._loop is loop:
+            return
+        # First use, or the previous loop has gone away (tests, reloads)
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=TIMEZONE_QUEUE_SIZE)
+        self._queued.clear()
+        self._client = None
+        self._worker = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                user_id, ip_address = await asyncio.wait_for(
+                    self._queue.get(), timeout=TIMEZONE_UPDATE_FLUSH_SECONDS
+                )
+            except asyncio.TimeoutError:
+                await self.flush()
+                continue
+
+            try:
+                timezone_name = await self.resolve(ip_address)
+                if timezone_name and timezone_name != 'UTC':
+                    self._pending[user_id] = (timezone_name, ip_address)
+                else:
+                    logger.debug(f"⚠️ No timezone detected for user {user_id}, keeping current")
+            except Exception as e:
+                logger.error(f"❌ Timezone detection error: {e}")
+            finally:
+                if self._queued.get(user_id) == ip_address:
+                    del self._queued[user_id]
+
+            if len(self._pending) >= TIMEZONE_UPDATE_BATCH_SIZE or self._queue.empty():
+                await self.flush()
+
+    async def flush(self):
+        """Write resolved timezones in one batched UPDATE"""
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(User),
+                    [
+                        {"id": user_id, "timezone": timezone_name, "last_ip_address": ip_address}
+                        for user_id, (timezone_name, ip_address) in batch.items()
+                    ],
+                )
+                await db.commit()
+        except Exception as e:
+            logger.error(f"❌ Error updating user timezones: {e}")
+            return
+
+        for user_id in batch:
+            principal_cache.invalidate(user_id)
+        logger.info(f"🌍 Updated timezone for {len(batch)} user(s)")
+
+    async def shutdown(self):
+        """Stop the worker and write anything already resolved"""
+        if self._worker is not None and self._loop is asyncio.get_running_loop():
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            await self.flush()
+            if self._client is not None:
+                await self._client.aclose()
+        self._worker = None
+        self._client = None
+
+
+# Global timezone detector instance
+timezone_detector = TimezoneDetector()
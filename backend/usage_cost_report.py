@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Print LLM token usage and cost per operation and model, across all users, from the
+usage_cost_daily rollup.
+
+Usage:
+    python usage_cost_report.py --days 30
+    python usage_cost_report.py --days 7 --user <user-uuid>
+"""
+import argparse
+import asyncio
+import os
+import sys
+import uuid
+from datetime import datetime, timedelta, timezone
+
+# Add the backend directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from database import AsyncSessionLocal
+from usage_metering import usage_meter
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--user", type=uuid.UUID, default=None, help="restrict the report to one user")
+    args = parser.parse_args()
+
+    since = (datetime.now(timezone.utc) - timedelta(days=args.days - 1)).date()
+    async with AsyncSessionLocal() as db:
+        report = await usage_meter.cost_report(db, since, args.user)
+
+    print(f"LLM usage since {report['since']}" + (f" for user {args.user}" if args.user else ""))
+    print(f"{'operation / model':<44}{'calls':>8}{'input':>12}{'output':>12}{'cost $':>12}")
+    for operation in report["operations"]:
+        print(f"{operation['operation']:<44}{operation['calls']:>8}{operation['input_tokens']:>12}"
+              f"{operation['output_tokens']:>12}{operation['cost_usd']:>12.4f}")
+        for model in operation["models"]:
+            label = f"  {model['provider']}:{model['model']}"
+            print(f"{label:<44}{model['calls']:>8}{model['input_tokens']:>12}"
+                  f"{model['output_tokens']:>12}{model['cost_usd']:>12.4f}")
+    print(f"{'total':<76}{report['total_cost_usd']:>12.4f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
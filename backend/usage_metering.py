@@ -0,0 +1,446 @@
+"""
+Usage metering: atomic counter updates, an append-only event log and token reservations.
+
+Every metered operation is one upsert of the user's Usage row
+(INSERT ... ON CONFLICT (user_id) DO UPDATE SET x = x + :n RETURNING ...) and one
+UsageEvent insert, committed together. Concurrent requests can no longer lose
+increments, and a missing Usage row is created by the same statement.
+
+The counters returned by each write are kept in a short-TTL per-user cache, so quota
+checks in this process read the latest committed totals without another query. Writes
+from other workers become visible once the entry expires (USAGE_CACHE_TTL_SECONDS).
+
+LLM calls reserve their estimated budget before calling the model (reserve), then
+charge actual usage and free the remainder (settle) or free all of it on failure
+(release). Usage.tokens_reserved holds the sum of open reservations; reservations
+left behind by a dead worker expire and are reclaimed on that user's next reserve.
+
+Operations that call a model pass the llm_router usage tally. Its provider-reported
+input/output tokens are what gets charged (falling back to the caller's estimate when
+a provider reports nothing), are stored on the event with their cost, and are added
+to the usage_cost_daily rollup that cost reports read from.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal
+from llm_router import LLMUsageTally
+from models import Usage, UsageCostDaily, UsageEvent, UsageReservation
+
+logger = logging.getLogger(__name__)
+
+USAGE_CACHE_TTL_SECONDS = float(os.getenv("USAGE_CACHE_TTL_SECONDS", "5"))
+USAGE_CACHE_SIZE = int(os.getenv("USAGE_CACHE_SIZE", "10000"))
+# A reservation not settled or released within this window (worker died) is reclaimed
+TOKEN_RESERVATION_TTL_SECONDS = int(os.getenv("TOKEN_RESERVATION_TTL_SECONDS", "900"))
+# Headroom on reservations: budgets are counted with tiktoken/4-chars-per-token, providers count their own way
+TOKEN_RESERVATION_MARGIN = float(os.getenv("TOKEN_RESERVATION_MARGIN", "1.25"))
+
+# USD per million (input, output) tokens; override or extend with LLM_PRICING_JSON='{"model": [in, out]}'
+MODEL_PRICING: Dict[str, Tuple[float, float]] = {
+    "claude-sonnet-4-20250514": (3.00, 15.00),
+    "anthropic/claude-sonnet-4": (3.00, 15.00),
+    "claude-3-5-haiku-20241022": (0.80, 4.00),
+    "google/gemini-2.5-flash": (0.30, 2.50),
+    "google/gemini-2.5-pro": (1.25, 10.00),
+}
+MODEL_PRICING.update({
+    model: tuple(prices) for model, prices in json.loads(os.getenv("LLM_PRICING_JSON", "{}")).items()
+})
+
+
+@dataclass(frozen=True)
+class UsageCounters:
+    docs_used: int = 0
+    chats_used: int = 0
+    tokens_used: int = 0
+    tokens_reserved: int = 0
+
+
+@dataclass(frozen=True)
+class TokenReservation:
+    id: uuid.UUID
+    user_id: uuid.UUID
+    tokens: int
+    expires_at: datetime
+
+
+COUNTER_COLUMNS = (Usage.docs_used, Usage.chats_used, Usage.tokens_used, Usage.tokens_reserved)
+
+
+def call_cost(model: str, input_tokens: int, output_tokens: int) -> float:
+    """USD cost of one model call; unknown models (e.g. the mock providers) cost nothing"""
+    input_price, output_price = MODEL_PRICING.get(model, (0.0, 0.0))
+    return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+
+def billable_tokens(llm_usage: Optional[LLMUsageTally], estimated_tokens: int) -> int:
+    """Provider-reported tokens of an operation, or the estimate if none were reported"""
+    if llm_usage is not None and llm_usage.total_tokens > 0:
+        return llm_usage.total_tokens
+    return estimated_tokens
+
+
+class UsageMeter:
+    def __init__(self, ttl: float = USAGE_CACHE_TTL_SECONDS, maxsize: int = USAGE_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached(self, user_id: uuid.UUID) -> Optional[UsageCounters]:
+        key = str(user_id)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            counters, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return counters
+
+    def _store(self, user_id: uuid.UUID, counters: UsageCounters):
+        if self.ttl <= 0:
+            return
+        key = str(user_id)
+        with self._lock:
+            self._cache[key] = (counters, time.monotonic() + self.ttl)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+
+    def invalidate(self, user_id: uuid.UUID):
+        with self._lock:
+            self._cache.pop(str(user_id), None)
+
+    async def counters(self, db: AsyncSession, user_id: uuid.UUID) -> UsageCounters:
+        """Current totals for quota checks (cached; a user without a Usage row has zeros)"""
+        counters = self._cached(user_id)
+        if counters is not None:
+            return counters
+
+        row = (await db.execute(select(*COUNTER_COLUMNS).where(Usage.user_id == user_id))).first()
+        counters = UsageCounters(*(value or 0 for value in row)) if row else UsageCounters()
+        self._store(user_id, counters)
+        return counters
+
+    async def record(
+        self,
+        db: AsyncSession,
+        user_id: uuid.UUID,
+        operation: str,
+        docs: int = 0,
+        chats: int = 0,
+        tokens: int = 0,
+        document_id: Optional[uuid.UUID] = None,
+        llm_usage: Optional[LLMUsageTally] = None,
+    ) -> UsageCounters:
+        """Atomically add to the user's totals and log the event; commits"""
+        return await self._record(db, user_id, operation, docs, chats, tokens, document_id, llm_usage)
+
+    async def _record(
+        self,
+        db: AsyncSession,
+        user_id: uuid.UUID,
+        operation: str,
+        docs: int = 0,
+        chats: int = 0,
+        tokens: int = 0,
+        document_id: Optional[uuid.UUID] = None,
+        llm_usage: Optional[LLMUsageTally] = None,
+        reservation: Optional[TokenReservation] = None,
+    ) -> UsageCounters:
+        calls = llm_usage.calls if llm_usage is not None else []
+        if reservation is not None and tokens > reservation.tokens:
+            # Charged in full (the tokens were spent), but the reservation did not cover them
+            logger.warning(
+                f"⚠️ {operation} used {tokens} tokens, over the {reservation.tokens} reserved for user {user_id}"
+            )
+        try:
+            # Tokens still held by the reservation; zero if it already expired and was reclaimed
+            released = 0
+            if reservation is not None:
+                released = await db.scalar(
+                    delete(UsageReservation)
+                    .where(UsageReservation.id == reservation.id)
+                    .returning(UsageReservation.tokens)
+                ) or 0
+
+            stmt = pg_insert(Usage).values(
+                user_id=user_id, docs_used=docs, chats_used=chats, tokens_used=tokens, tokens_reserved=0
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[Usage.user_id],
+                set_={
+                    "docs_used": func.coalesce(Usage.docs_used, 0) + stmt.excluded.docs_used,
+                    "chats_used": func.coalesce(Usage.chats_used, 0) + stmt.excluded.chats_used,
+                    "tokens_used": func.coalesce(Usage.tokens_used, 0) + stmt.excluded.tokens_used,
+                    "tokens_reserved": func.greatest(Usage.tokens_reserved - released, 0),
+                },
+            ).returning(*COUNTER_COLUMNS)
+
+            counters = UsageCounters(*(await db.execute(stmt)).one())
+            await db.execute(insert(UsageEvent).values(
+                user_id=user_id,
+                document_id=document_id,
+                operation=operation,
+                docs=docs,
+                chats=chats,
+                tokens=tokens,
+                input_tokens=sum(call.input_tokens for call in calls),
+                output_tokens=sum(call.output_tokens for call in calls),
+                cost_usd=sum(call_cost(call.model, call.input_tokens, call.output_tokens) for call in calls),
+            ))
+            if calls:
+                await self._add_to_cost_rollup(db, user_id, operation, llm_usage)
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            self.invalidate(user_id)
+            raise
+
+        self._store(user_id, counters)
+        return counters
+
+    async def _add_to_cost_rollup(self, db: AsyncSession, user_id: uuid.UUID, operation: str, llm_usage: LLMUsageTally):
+        """Add the calls to today's (UTC) usage_cost_daily rows, one per provider and model"""
+        per_model: Dict[Tuple[str, str], dict] = {}
+        for call in llm_usage.calls:
+            row = per_model.setdefault((call.provider, call.model), {
+                "day": datetime.now(timezone.utc).date(),
+                "user_id": user_id,
+                "operation": operation,
+                "provider": call.provider,
+                "model": call.model,
+                "calls": 0,
+                "input_tokens": 0,
+                "output_tokens": 0,
+                "cost_usd": 0.0,
+            })
+            row["calls"] += 1
+            row["input_tokens"] += call.input_tokens
+            row["output_tokens"] += call.output_tokens
+            row["cost_usd"] += call_cost(call.model, call.input_tokens, call.output_tokens)
+
+        stmt = pg_insert(UsageCostDaily).values(list(per_model.values()))
+        await db.execute(stmt.on_conflict_do_update(
+            index_elements=[
+                UsageCostDaily.day, UsageCostDaily.user_id, UsageCostDaily.operation,
+                UsageCostDaily.provider, UsageCostDaily.model,
+            ],
+            set_={
+                "calls": UsageCostDaily.calls + stmt.excluded.calls,
+                "input_tokens": UsageCostDaily.input_tokens + stmt.excluded.input_tokens,
+                "output_tokens": UsageCostDaily.output_tokens + stmt.excluded.output_tokens,
+                "cost_usd": UsageCostDaily.cost_usd + stmt.excluded.cost_usd,
+            },
+        ))
+
+    async def cost_report(self, db: AsyncSession, since: date, user_id: Optional[uuid.UUID] = None) -> dict:
+        """Per-operation (and per-model) calls, tokens and cost since a day, from the daily rollup"""
+        query = (
+            select(
+                UsageCostDaily.operation,
+                UsageCostDaily.provider,
+                UsageCostDaily.model,
+                func.sum(UsageCostDaily.calls).label("calls"),
+                func.sum(UsageCostDaily.input_tokens).label("input_tokens"),
+                func.sum(UsageCostDaily.output_tokens).label("output_tokens"),
+                func.sum(UsageCostDaily.cost_usd).label("cost_usd"),
+            )
+            .where(UsageCostDaily.day >= since)
+            .group_by(UsageCostDaily.operation, UsageCostDaily.provider, UsageCostDaily.model)
+        )
+        if user_id is not None:
+            query = query.where(UsageCostDaily.user_id == user_id)
+
+        operations: Dict[str, dict] = {}
+        for row in (await db.execute(query)).all():
+            operation = operations.setdefault(row.operation, {
+                "operation": row.operation,
+                "calls": 0,
+                "input_tokens": 0,
+                "output_tokens": 0,
+                "cost_usd": 0.0,
+                "models": [],
+            })
+            operation["calls"] += int(row.calls)
+            operation["input_tokens"] += int(row.input_tokens)
+            operation["output_tokens"] += int(row.output_tokens)
+            operation["cost_usd"] += float(row.cost_usd)
+            operation["models"].append({
+                "provider": row.provider,
+                "model": row.model,
+                "calls": int(row.calls),
+                "input_tokens": int(row.input_tokens),
+                "output_tokens": int(row.output_tokens),
+                "cost_usd": round(float(row.cost_usd), 6),
+            })
+
+        report = sorted(operations.values(), key=lambda operation: operation["cost_usd"], reverse=True)
+        for operation in report:
+            operation["cost_usd"] = round(operation["cost_usd"], 6)
+        return {
+            "since": since.isoformat(),
+            "operations": report,
+            "total_cost_usd": round(sum(operation["cost_usd"] for operation in report), 6),
+        }
+
+    async def reserve(
+        self,
+        db: AsyncSession,
+        user_id: uuid.UUID,
+        tokens: int,
+        token_limit: int,
+        ttl: int = TOKEN_RESERVATION_TTL_SECONDS,
+    ) -> Optional[TokenReservation]:
+        """
+        Hold `tokens` of the user's budget if used + reserved + tokens stays within
+        token_limit; commits. Returns None when the budget is exhausted.
+
+        The check and the hold are one conditional UPDATE on the Usage row, so
+        concurrent requests are admitted without a per-user lock and cannot overshoot.
+        """
+        tokens = max(0, tokens)
+        try:
+            await self._reclaim_expired(db, user_id)
+
+            admit = (
+                update(Usage)
+                .where(
+                    Usage.user_id == user_id,
+                    func.coalesce(Usage.tokens_used, 0) + Usage.tokens_reserved + tokens <= token_limit,
+                )
+                .values(tokens_reserved=Usage.tokens_reserved + tokens)
+                .returning(*COUNTER_COLUMNS)
+            )
+            row = (await db.execute(admit)).first()
+            if row is None:
+                # First metered call for this user: create the row and try once more
+                await db.execute(pg_insert(Usage).values(user_id=user_id).on_conflict_do_nothing(
+                    index_elements=[Usage.user_id]
+                ))
+                row = (await db.execute(admit)).first()
+
+            if row is None:
+                await db.commit()
+                self.invalidate(user_id)
+                return None
+
+            reservation = (await db.execute(
+                insert(UsageReservation)
+                .values(user_id=user_id, tokens=tokens, expires_at=func.now() + timedelta(seconds=ttl))
+                .returning(UsageReservation.id, UsageReservation.expires_at)
+            )).one()
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            self.invalidate(user_id)
+            raise
+
+        self._store(user_id, UsageCounters(*row))
+        return TokenReservation(reservation.id, user_id, tokens, reservation.expires_at)
+
+    async def settle(
+        self,
+        db: AsyncSession,
+        reservation: TokenReservation,
+        operation: str,
+        tokens: int,
+        docs: int = 0,
+        chats: int = 0,
+        document_id: Optional[uuid.UUID] = None,
+        llm_usage: Optional[LLMUsageTally] = None,
+    ) -> UsageCounters:
+        """Charge the actual usage and release whatever remains of the reservation; commits"""
+        return await self._record(
+            db, reservation.user_id, operation, docs, chats, tokens, document_id, llm_usage, reservation
+        )
+
+    async def release(self, reservation: TokenReservation):
+        """
+        Give the whole reservation back without charging anything.
+
+        Uses its own session because callers release from error paths, where the
+        request session may be mid-failure. If this fails too, expiry reclaims it.
+        """
+        try:
+            async with AsyncSessionLocal() as db:
+                released = await db.scalar(
+                    delete(UsageReservation)
+                    .where(UsageReservation.id == reservation.id)
+                    .returning(UsageReservation.tokens)
+                )
+                if released:
+                    await db.execute(
+                        update(Usage)
+                        .where(Usage.user_id == reservation.user_id)
+                        .values(tokens_reserved=func.greatest(Usage.tokens_reserved - released, 0))
+                    )
+                await db.commit()
+        except Exception as e:
+            logger.error(f"❌ Could not release token reservation {reservation.id}: {e}")
+        self.invalidate(reservation.user_id)
+
+    async def _reclaim_expired(self, db: AsyncSession, user_id: uuid.UUID):
+        """Return the budget of this user's expired reservations (caller commits)"""
+        expired = (await db.scalars(
+            delete(UsageReservation)
+            .where(UsageReservation.user_id == user_id, UsageReservation.expires_at <= func.now())
+            .returning(UsageReservation.tokens)
+        )).all()
+        if expired:
+            logger.warning(f"⚠️ Reclaimed {len(expired)} expired token reservation(s) for user {user_id}")
+            await db.execute(
+                update(Usage)
+                .where(Usage.user_id == user_id)
+                .values(tokens_reserved=func.greatest(Usage.tokens_reserved - sum(expired), 0))
+            )
+
+    async def reset(self, db: AsyncSession, user_id: uuid.UUID, operation: str = "reset") -> UsageCounters:
+        """Zero the user's totals and log the reset; commits"""
+        try:
+            previous = (await db.execute(
+                select(*COUNTER_COLUMNS).where(Usage.user_id == user_id).with_for_update()
+            )).first()
+            if previous is not None:
+                await db.execute(
+                    update(Usage)
+                    .where(Usage.user_id == user_id)
+                    .values(docs_used=0, chats_used=0, tokens_used=0, last_reset=func.now())
+                )
+                # Negative deltas, so summing a user's events gives the current totals
+                await db.execute(insert(UsageEvent).values(
+                    user_id=user_id,
+                    operation=operation,
+                    docs=-(previous.docs_used or 0),
+                    chats=-(previous.chats_used or 0),
+                    tokens=-(previous.tokens_used or 0),
+                ))
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            self.invalidate(user_id)
+            raise
+
+        counters = UsageCounters(tokens_reserved=previous.tokens_reserved if previous else 0)
+        self._store(user_id, counters)
+        return counters
+
+
+# Global usage meter instance
+usage_meter = UsageMeter()
@@ -0,0 +1,126 @@
+"""
+Per-user counts of stored data: documents (and their stored files), chat messages and
+sessions, collections, public shares and their views.
+
+All of them come from one statement (an aggregate over the user's documents plus a
+scalar count per other table, each served by a user_id index), cached per user for
+USER_STATS_CACHE_TTL_SECONDS. Routes that add or remove a user's data invalidate the
+entry, so the usage dashboard and the deletion preview read one snapshot instead of a
+count query per kind.
+"""
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Union
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import ChatHistory, ChatSession, Collection, Document, PublicChatShare, PublicChatView
+
+USER_STATS_CACHE_TTL_SECONDS = float(os.getenv("USER_STATS_CACHE_TTL_SECONDS", "60"))
+USER_STATS_CACHE_SIZE = int(os.getenv("USER_STATS_CACHE_SIZE", "10000"))
+
+
+@dataclass(frozen=True)
+class UserStats:
+    documents: int = 0
+    storage_files: int = 0  # Documents with an uploaded file
+    chat_messages: int = 0
+    chat_sessions: int = 0
+    collections: int = 0
+    public_shares: int = 0
+    public_views: int = 0
+
+
+class UserStatsCache:
+    """Bounded LRU of user -> UserStats with a fixed TTL"""
+
+    def __init__(self, ttl: float = USER_STATS_CACHE_TTL_SECONDS, maxsize: int = USER_STATS_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id) -> Optional[UserStats]:
+        key = str(user_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stats, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return stats
+
+    def put(self, user_id, stats: UserStats):
+        if self.ttl <= 0:
+            return
+        key = str(user_id)
+        with self._lock:
+            self._entries[key] = (stats, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: Union[str, uuid.UUID]):
+        with self._lock:
+            self._entries.pop(str(user_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_stats_cache = UserStatsCache()
+
+
+async def load_user_stats(db: AsyncSession, user_id) -> UserStats:
+    """Counts straight from the database, in one query; refreshes the cache"""
+    documents = (
+        select(
+            func.count().label("documents"),
+            func.count(Document.file_url).label("storage_files"),
+        )
+        .where(Document.user_id == user_id)
+        .subquery()
+    )
+
+    def count(model, *criteria):
+        return select(func.count()).select_from(model).where(*criteria).scalar_subquery()
+
+    public_views = (
+        select(func.count())
+        .select_from(PublicChatView)
+        .join(PublicChatShare, PublicChatShare.id == PublicChatView.share_id)
+        .where(PublicChatShare.user_id == user_id)
+        .scalar_subquery()
+    )
+    row = (await db.execute(
+        select(
+            documents.c.documents,
+            documents.c.storage_files,
+            count(ChatHistory, ChatHistory.user_id == user_id).label("chat_messages"),
+            count(ChatSession, ChatSession.user_id == user_id).label("chat_sessions"),
+            count(Collection, Collection.user_id == user_id).label("collections"),
+            count(PublicChatShare, PublicChatShare.user_id == user_id).label("public_shares"),
+            public_views.label("public_views"),
+        ).select_from(documents)
+    )).one()
+
+    stats = UserStats(**row._mapping)
+    user_stats_cache.put(user_id, stats)
+    return stats
+
+
+async def get_user_stats(db: AsyncSession, user_id) -> UserStats:
+    """Counts for dashboards: cached, and at most USER_STATS_CACHE_TTL_SECONDS old"""
+    stats = user_stats_cache.get(user_id)
+    if stats is not None:
+        return stats
+    return await load_user_stats(db, user_id)
@@ -80,12 +80,25 @@ function SettingsPanel({ isOpen, onClose, onDataDeleted }) {
 
       console.log('Delete response:', response.data)
 
+      // Deletion runs in the background; wait for it to finish
+      let job = response.data
+      while (job.status === 'pending' || job.status === 'running') {
+        await new Promise(resolve => setTimeout(resolve, 1000))
+        const statusResponse = await axios.get(`${BASE_URL}/documents/deletion-status`, {
+          withCredentials: true
+        })
+        job = statusResponse.data
+      }
+      if (job.status === 'failed') {
+        throw new Error(job.message)
+      }
+
       // Clear all localStorage cache
       DocumentCache.clearCache()
       console.log('Cleared all cache')
 
       // Show success message
-      setDeleteSuccess(response.data.message)
+      setDeleteSuccess(job.message)
       
       // Close confirmation modal
       setShowDeleteConfirm(false)
@@ -108,6 +121,8 @@ function SettingsPanel({ isOpen, onClose, onDataDeleted }) {
         errorMessage = error.response.data.detail
       } else if (error.response?.status === 401) {
         errorMessage = 'Authentication failed. Please login again.'
+      } else if (!error.response && error.message) {
+        errorMessage = error.message
       }
       
       setDeleteError(errorMessage)